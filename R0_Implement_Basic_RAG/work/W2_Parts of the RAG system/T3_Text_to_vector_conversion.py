@@ -1,9 +1,9 @@
 import os
-import time # <--- 导入 time 库，用于实现延时
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma   # Chroma向量数据库
 from langchain_community.embeddings import DashScopeEmbeddings   #Embedding模型的类
+from R6_System_Optimization.embedding_batcher import EmbeddingScheduler
 
 
 pdf_name = 'PCB.pdf'
@@ -17,9 +17,13 @@ splitter = RecursiveCharacterTextSplitter(
     is_separator_regex = False,
 )
 
-embedding = DashScopeEmbeddings(      # DashScope Embedding模型的实例   翻译官
-    model="text-embedding-v1",   # 向量化模型名称
-    dashscope_api_key=os.getenv("DASHSCOPE_API_KEY")    # API密钥
+embedding = EmbeddingScheduler(   # 自适应并发的调度器：按token组批 + 令牌桶限流 + 429退避重试
+    DashScopeEmbeddings(      # DashScope Embedding模型的实例   翻译官
+        model="text-embedding-v1",   # 向量化模型名称
+        dashscope_api_key=os.getenv("DASHSCOPE_API_KEY")    # API密钥
+    ),
+    max_in_flight=4,
+    max_batch_size=25,   # text-embedding-v1 单次最多25条
 )
 
 
@@ -43,18 +47,10 @@ else:
             embedding_function=embedding          # 使用Embedding模型来将文本转换成向量
         )
 
-        batch_size = 16     #每个批次处理的文本块数量
-        total_docs = len(split_docs)
-
-        print(f"\n--- 开始分批处理，共 {total_docs} 个文本块，每批 {batch_size} 个... ---")
-        for i in range(0, total_docs, batch_size):     # range(start, stop, step)    起始值  结束值   步长
-            batch = split_docs[i : i + batch_size]
-
-            vector_db.add_documents(documents=batch)   #  .add_documents() 将当前批次的文档添加到数据库中   自动完成向量化和存储
-
-            print(f"已处理 {min(i + batch_size, total_docs)} / {total_docs} 个文本块...")    # min()确保最后一个批次显示的数字不会超过总数
-
-            time.sleep(1)       # 避免被服务器拒绝
+        # 组批、限流、并发和429重试都交给调度器，不再固定每批16个再 sleep 1 秒
+        print(f"\n--- 开始向量化，共 {len(split_docs)} 个文本块... ---")
+        vector_db.add_documents(documents=split_docs)
+        print(embedding.report())
 
         print("\n--- 所有文本块已自动持久化到硬盘！ ---")
 
@@ -7,6 +7,8 @@ from langchain_chroma import Chroma
 from langchain_community.embeddings import DashScopeEmbeddings
 from langchain_openai import ChatOpenAI
 from langchain.chains import RetrievalQA
+from R6_System_Optimization.embedding_batcher import EmbeddingScheduler
+from R6_System_Optimization.index_builder import build_or_update_vector_db, index_directory
 
 
 PDF_NAME = "PCB.pdf"
@@ -20,14 +22,23 @@ llm = ChatOpenAI(      # 大模型  模型名字  api  链接   其他参数 -
     extra_body={"enable_thinking": False},
 )
 
-def creat_or_load_vector_df(pdf_path: str, persist_directory: str, embedding_model: DashScopeEmbeddings) -> Chroma:
+def creat_or_load_vector_df(pdf_path: str, persist_directory: str, embedding_model: DashScopeEmbeddings,
+                            incremental: bool = True) -> Chroma:
     """
     创建或加载向量数据库  数据处理 模块，封装了所有考前准备工作   加载分割存储
     pdf_path (str): 要处理的PDF文件路径
     persist_directory (str): 数据库在硬盘上的路径
     embedding_model (DashScopeEmbeddings): 用于向量化的Embedding模型
+    incremental (bool): 增量模式，PDF改动后只重新向量化变化的chunk，删除消失的chunk
     Chroma: 一个已经就绪的、可供检索的Chroma向量数据库实例
     """
+    if incremental:
+        current_path = os.path.dirname(__file__)
+        pdf_path = os.path.join(current_path, pdf_path)
+        # 按模型和切分参数分目录（persist_directory_<配置指纹>），不同配置的索引不会共用一个目录
+        return build_or_update_vector_db(pdf_path, index_directory(persist_directory, embedding_model),
+                                         embedding_model)
+
     if os.path.exists(persist_directory):
         print("加载已有的数据库")
         vector_db = Chroma(    # Chroma数据库的实例  就是遥控器  需要翻译官翻译文本    存储的地方
@@ -54,18 +65,12 @@ def creat_or_load_vector_df(pdf_path: str, persist_directory: str, embedding_mod
         chunk = splitter.split_documents(pdf_docs)
         print("已分割文本")
 
-        # 分批处理
-        batch_size = 16
-        total_docs = len(chunk)
-        print(f"\n 分批处理，共 {total_docs} 个，每批 {batch_size} 个... ---")
+        # 分批、并发和限流交给 EmbeddingScheduler，这里一次性提交即可
         vector_db = Chroma(
             persist_directory=persist_directory,
             embedding_function=embedding_model
         )
-        for i in range(0, total_docs, batch_size):
-            batch = chunk[i: i + batch_size]
-            vector_db.add_documents(documents=batch)
-            print(f"已处理 {min(i + batch_size, total_docs)} / {total_docs} 个文本块...")
+        vector_db.add_documents(documents=chunk)
         # 一次性处理
         # vector_db = Chroma.from_documents(
         #     documents=chunk,
@@ -113,10 +118,10 @@ def start_interactive_session(qa_chain: RetrievalQA):
                 print(f"在处理您的问题时发生错误: {e}")
 
 def main():
-    embedding = DashScopeEmbeddings(    # 翻译官   需要模型进行翻译  需要模型的名字  api
+    embedding = EmbeddingScheduler(DashScopeEmbeddings(    # 翻译官   需要模型进行翻译  需要模型的名字  api
         model="text-embedding-v1",
         dashscope_api_key=os.getenv("DASHSCOPE_API_KEY")
-    )
+    ))   # 调度器负责按token组批、并发、限流和429重试
     vector = creat_or_load_vector_df(PDF_NAME, DB_PATH, embedding)
     retriever = vector.as_retriever()    # 角色转换  从数据库对象  转换为  检索的工具
     qa_chain = create_rag_chain(llm, retriever)
@@ -1,12 +1,11 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from langchain_openai import ChatOpenAI
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_community.embeddings import DashScopeEmbeddings
 from langchain.chains import RetrievalQA
 from pydantic import BaseModel  # pydantic库 定义数据模型
+from R6_System_Optimization.async_embedding import AsyncEmbeddingClient, AsyncRetriever
+from R6_System_Optimization.index_builder import build_or_update_vector_db, index_directory
 
 PDFNAME = 'PCB.pdf'
 DBPATH = 'chroma_db'
@@ -20,39 +19,19 @@ class ChatResponse(BaseModel):   # 定义响应体模型：规定了/chat接口
 
 
 print("正在创建RAG链")
-if os.path.exists(DBPATH):
-    print("正在加载数据库")
-    vector_db = Chroma(
-        persist_directory=DBPATH,
-        embedding_function=DashScopeEmbeddings(
-            model="text-embedding-v1",
-            dashscope_api_key=os.getenv("DASHSCOPE_API_KEY")
-        )
-    )
-else:
-    print("正在创建数据库")
-    current_path = os.path.dirname(__file__)
-    pdf_path = os.path.join(current_path, PDFNAME)
-    loader = PyPDFLoader(pdf_path)
-    docs = loader.load()
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=50,
-        length_function=len,
-        is_separator_regex=False,
-    )
-    chunk = splitter.split_documents(docs)
-
-    vector_db = Chroma.from_documents(
-        documents=chunk,
-        embedding=DashScopeEmbeddings(
-            model="text-embedding-v1",
-            dashscope_api_key=os.getenv("DASHSCOPE_API_KEY")
-        ),
-        persist_directory=DBPATH
-    )
-
-retrieval = vector_db.as_retriever()
+# 增量构建：已有数据库且PDF未变化时直接加载，PDF改动时只重新向量化变化的部分
+current_path = os.path.dirname(__file__)
+pdf_path = os.path.join(current_path, PDFNAME)
+# OpenAI 兼容接口的异步客户端：共享连接池，查询向量化用 aembed_query，不阻塞事件循环
+embedding = AsyncEmbeddingClient(
+    model="text-embedding-v1",
+    api_key=os.getenv("DASHSCOPE_API_KEY"),
+    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+)  # 兼容接口不区分 query / document（原生 DashScopeEmbeddings 会传 text_type），向量不同，索引另建一个目录
+# chroma_db -> chroma_db_<配置指纹>：换了模型或切分参数时另建一个目录，不会误用或覆盖别的配置建的索引
+vector_db = build_or_update_vector_db(pdf_path, index_directory(DBPATH, embedding), embedding)
+
+retrieval = AsyncRetriever(vector_db=vector_db, embeddings=embedding)
 llm = ChatOpenAI(
     model_name = "qwen-turbo",
     api_key=os.getenv("DASHSCOPE_API_KEY"),
@@ -67,17 +46,24 @@ qa_chain = RetrievalQA.from_chain_type(
     return_source_documents = True,
 )
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await embedding.aclose()  # 应用关闭时关闭异步连接池
+
+
 app = FastAPI(   # 这里的title, version, description等会显示在自动生成的API文档中  http://127.0.0.1:8000/docs
     title = "RAG问答系统API",
     version = "v1.0",
     description = "一个基于LangChain和FastAPI的、能够回答PDF文档相关问题的API",
+    lifespan = lifespan,
 )
 
 @app.post("/chat", response_model=ChatResponse)
 # 注册一个POST方法的路由，路径是 /chat  response_model=ChatResponse: 指定接口的响应体遵循我们定义的ChatResponse模型
-def chat(request: ChatRequest):
+async def chat(request: ChatRequest):
     try:
-        result = qa_chain.invoke({"query": request.query})
+        result = await qa_chain.ainvoke({"query": request.query})
         answer = result["result"]   # 使用[]访问字典里的值  创建字典是{}
         print(f"生成答案: {answer}")
         return ChatResponse(answer=answer)   # 将答案封装在ChatResponse模型中返回   FastAPI会自动将其序列化为JSON
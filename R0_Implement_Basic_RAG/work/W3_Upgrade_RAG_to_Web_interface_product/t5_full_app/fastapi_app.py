@@ -1,12 +1,9 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.openapi.models import APIKey
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_community.embeddings import DashScopeEmbeddings
 import os
 from langchain_openai import ChatOpenAI
 from langchain.chains import RetrievalQA
@@ -15,6 +12,8 @@ from pydantic import BaseModel
 import asyncio # 导入异步I/O库，用于处理异步生成器
 from fastapi.responses import StreamingResponse
 from sympy import false
+from R6_System_Optimization.async_embedding import AsyncEmbeddingClient, AsyncRetriever
+from R6_System_Optimization.index_builder import build_or_update_vector_db, index_directory
 
 PDFNAME = "PCB.pdf"
 
@@ -26,43 +25,20 @@ print(f"数据库的绝对路径是: {DBPATH}")
 class Requset(BaseModel):
     query:str
 
-embedding = DashScopeEmbeddings(
+# 走 DashScope 的 OpenAI 兼容接口：共享连接池，异步路由里用 aembed_query 向量化查询，不阻塞事件循环
+embedding = AsyncEmbeddingClient(
             model = "text-embedding-v1",
-            dashscope_api_key=os.getenv("DASHSCOPE_API_KEY")
-           )
-
-if not os.path.exists(DBPATH):
-    print("没有数据库，正在创建")
-    current_path = os.path.dirname(__file__)
-    pdf_path = os.path.join(current_path, PDFNAME)
-    print("找到文件")
-    loader = PyPDFLoader(pdf_path)
-    docs = loader.load()
-    print("成功加载文档")
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size = 500,
-        chunk_overlap=50,
-        length_function=len,
-        is_separator_regex=False
-    )
-    chunk = splitter.split_documents(docs)
-    print("成功分割文本")
-
+            api_key=os.getenv("DASHSCOPE_API_KEY"),
+            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+           )  # 兼容接口不区分 query / document（原生 DashScopeEmbeddings 会传 text_type），向量不同，索引另建一个目录
 
-    vector_db = Chroma.from_documents(
-        persist_directory=DBPATH,
-        documents=chunk,
-        embedding=embedding,
-    )
-    print("成功创建数据库")
-else:
-    print("已经存在数据库，正在导入")
-    vector_db = Chroma(
-        persist_directory=DBPATH,
-        embedding_function=embedding,
-    )
+# 增量构建：已有数据库且PDF未变化时直接加载，PDF改动时只重新向量化变化的部分
+current_path = os.path.dirname(__file__)
+pdf_path = os.path.join(current_path, PDFNAME)
+# chroma_db -> chroma_db_<配置指纹>：换了模型或切分参数时另建一个目录，不会误用或覆盖别的配置建的索引
+vector_db = build_or_update_vector_db(pdf_path, index_directory(DBPATH, embedding), embedding)
 
-retrieval = vector_db.as_retriever()
+retrieval = AsyncRetriever(vector_db=vector_db, embeddings=embedding)
 template = """
 请根据以下上下文信息，用中文回答问题。
 如果你在上下文中找不到答案，就说你不知道，不要试图编造答案。
@@ -92,7 +68,15 @@ rag_chain = (
 )
 
 
-app = FastAPI(title="RAG流式问答系统API", version="1.1")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await embedding.aclose()  # 应用关闭时关闭异步连接池
+
+
+app = FastAPI(title="RAG流式问答系统API", version="1.1", lifespan=lifespan)
+
+
 async def stream_rag_response(query:str):   # 异步生成器函数 (Async Generator)  连接astream 和 FastAPI 的管道
     try:
         # astream会异步地流式返回结果的每个文本块(chunk)
@@ -1,10 +1,8 @@
 import json
 from time import sleep
 
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.llms.tongyi import Tongyi
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
 from langchain_community.embeddings import DashScopeEmbeddings
 import os
 from dotenv import load_dotenv
@@ -12,6 +10,8 @@ import dashscope
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain.chains import RetrievalQA
 from local_model import get_llm, get_embedding_model, get_bge_embedding_model
+from R6_System_Optimization.embedding_cache import CachedEmbeddings
+from R6_System_Optimization.vector_backends import build_vector_index
 
 task_instruction = "根据查询找到相关文档"
 load_dotenv()
@@ -19,7 +19,8 @@ llm = get_llm()
 
 # 选择 BGE 模型
 # embedding = get_bge_embedding_model("BAAI/bge-large-en")  # small / base / large 都可以
-embedding = get_embedding_model()
+# embedding = CachedEmbeddings(get_qwen3_embedding_model(task_instruction=task_instruction))  # 本地 Qwen3-Embedding-0.6B，查询自动加指令前缀（下面就不再手动加）
+embedding = CachedEmbeddings(get_embedding_model())  # 磁盘缓存：重复实验只为新文本调用API
 
 
 PDFNAME = "ARES RAG Evaluation.pdf"
@@ -28,47 +29,31 @@ baseline_run_results = "baseline_run_results.jsonl"
 current_path = os.path.dirname(__file__)
 pdf_path = os.path.join(current_path, "PDF", PDFNAME)
 question_path = os.path.join(current_path, question_name)
-DBPATH = 'chroma_db'
+DBPATH = os.path.join(current_path, 'chroma_db')
 print(f"数据库的绝对路径是: {DBPATH}")
 
 
 
 
 def create_answer_jsonl(pdf_path, DBPATH):
-    if not os.path.exists(DBPATH):
-        print("没有数据库，正在创建")
-        print("找到文件")
-        loader = PyPDFLoader(pdf_path)
-        docs = loader.load()
-        print("成功加载文档")
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=800,
-            chunk_overlap=200,
-            length_function=len,
-            is_separator_regex=False
-        )
-        chunk = splitter.split_documents(docs)
-        print("成功分割文本")
-
-
-        vector_db = Chroma.from_documents(
-            persist_directory=DBPATH,
-            documents=chunk,
-            embedding=embedding,
-        )
-        print("成功创建数据库")
-    else:
-        print("已经存在数据库，正在导入")
-        vector_db = Chroma(
-            persist_directory=DBPATH,
-            embedding_function=embedding,
-        )
+    # 增量构建：PDF未变化时直接加载，改动时只重新向量化变化的chunk
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=800,
+        chunk_overlap=200,
+        length_function=len,
+        is_separator_regex=False
+    )
+    vector_db = build_vector_index(pdf_path, DBPATH, embedding, splitter=splitter)  # 存储引擎由 VECTOR_BACKEND 选择
 
     retrieval = vector_db.as_retriever(search_kwargs={
         "k": 20,
     })
     query = "ARES系统的全称是什么？"
-    instructed_query = f"Instruct: {task_instruction}\nQuery: {query}"
+    # 本地 Qwen3Embedding 在 embed_query 里自己加指令前缀，这里再加就重复了；远程模型需要手动加
+    if getattr(getattr(embedding, "embeddings", embedding), "task_instruction", None):
+        instructed_query = query
+    else:
+        instructed_query = f"Instruct: {task_instruction}\nQuery: {query}"
     docs = retrieval.get_relevant_documents(instructed_query)
 
     print(f"检索到 {len(docs)} 条文档：\n")
@@ -15,9 +15,8 @@ from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from local_model import get_embedding_model,get_bge_embedding_model,get_llm
+from R6_System_Optimization.embedding_cache import CachedEmbeddings
 
-JUDGE_LLM_MODEL = get_llm()
-EMBEDDING_MODEL = get_embedding_model()
 INPUT_FILE = "baseline_run_results.jsonl"
 
 
@@ -30,14 +29,14 @@ class Test:
         self.question_list = os.path.join(os.path.dirname(__file__), 'golden_dataset.jsonl')
 
         self.dataset_map = self._golden_dataset_map(self.question_list)
-        # 初始化 LLM
+        # 初始化 LLM（local_model 的注册表保证整个进程只构建一次，与 RAG 脚本共用同一个实例）
         self.llm = get_llm()
 
         # 包装 LLM 以用于 RAGAs
         self.llm_for_ragas = LangchainLLMWrapper(self.llm)
 
         # 初始化 Embeddings
-        self.ragas_embeddings = get_embedding_model()
+        self.ragas_embeddings = CachedEmbeddings(get_embedding_model())  # 同一批问题/答案重复评估时直接命中缓存
 
         # 设置 LLM 给各个指标
         faithfulness.llm = self.llm_for_ragas
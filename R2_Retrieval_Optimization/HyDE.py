@@ -5,13 +5,14 @@ import os
 from langchain_community.embeddings import DashScopeEmbeddings
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_chroma import Chroma
 from langchain.chains import HypotheticalDocumentEmbedder
 from R1_Evaluation_Framework.ragas_eval import Test
+from R6_System_Optimization.vector_backends import open_vector_index
 from local_model import get_embedding_model,get_llm
+from R6_System_Optimization.embedding_cache import CachedEmbeddings
 
 llm = get_llm()
-embedding = get_embedding_model()
+embedding = CachedEmbeddings(get_embedding_model())  # 磁盘缓存：重复实验只为新文本调用API
 
 # llm = ChatOpenAI(
 #         model_name="qwen-plus-2025-04-28",
@@ -41,7 +42,7 @@ parent_path = os.path.dirname(current_path)  # 返回上一级目录
 
 db_name = 'chroma_db'
 db_path = os.path.join(parent_path, 'R1_Evaluation_Framework', db_name)   #错误  现在不是向量数据库
-vector_db = Chroma(persist_directory=db_path, embedding_function=embedding)
+vector_db = open_vector_index(db_path, embedding)  # 校验清单中的模型和维度；存储引擎由 VECTOR_BACKEND 选择
 
 question_list_name = 'golden_dataset.jsonl'
 question_list = os.path.join(parent_path, 'R1_Evaluation_Framework', question_list_name)
@@ -53,10 +54,10 @@ def manual_dyde_retrieval(question:str, vector_db=vector_db):
 
     hyde_embedding = embedding.embed_query(hyde_doxs)   # embed_query()  对单条文本进行编码，返回该文本的嵌入向量。
 
-    retrieved_docs = vector_db.similarity_search_by_vector(
-        embedding=hyde_embedding,
+    retrieved_docs = vector_db.search_by_vector(
+        hyde_embedding,
         k=10
-    )    # 是ChromaDB等库支持的底层方法
+    )    # 直接按向量检索，所有后端都支持
 
     return retrieved_docs
 
@@ -5,22 +5,20 @@ import os
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.retrievers.multi_query import LineListOutputParser # 把LLM生成的、以换行符分隔的字符串，直接转换成一个字符串列表
 from langchain_core.output_parsers import StrOutputParser
-from langchain_chroma import Chroma
 from langchain_community.embeddings import DashScopeEmbeddings
 from R1_Evaluation_Framework.ragas_eval import Test
+from R6_System_Optimization.vector_backends import DEFAULT_INDEX_DIR, open_vector_index
 from local_model import get_embedding_model,get_llm
+from R6_System_Optimization.embedding_cache import CachedEmbeddings
 
 llm = get_llm()
-embedding = get_embedding_model()
+embedding = CachedEmbeddings(get_embedding_model())  # 磁盘缓存：重复实验只为新文本调用API
 
 
 
 
-DBPATH = '../R1_Evaluation_Framework/chroma_db'
-vector_db = Chroma(
-            persist_directory=DBPATH,
-            embedding_function=embedding,
-        )
+DBPATH = DEFAULT_INDEX_DIR  # R1_Evaluation_Framework/chroma_db 的绝对路径，不依赖启动目录
+vector_db = open_vector_index(DBPATH, embedding)  # 校验清单中的模型和维度；存储引擎由 VECTOR_BACKEND 选择
 # 定义模型路径
 
 # llm = ChatOpenAI(
@@ -64,14 +62,11 @@ def create_query(original_question:str):
     return all_queries
 
 
-def get_expanded_retrieved_contexts(retriever, all_queries):
+def get_expanded_retrieved_contexts(vector_index, all_queries, k=10):
     print("正在检索上下文")
     all_retrieved_docs = []
-    # 步骤 2: 遍历所有查询，并将结果累积
-    for query in all_queries:
-        # 先检索（不回答）  .get_relevant_documents()   专门用于 Retriever检索器  返回相关文档
-        # 问+答，一步到位，.invoke()  用于 Runnable / Chain / Agent   返回链的结果  答案 相关文档
-        current_retrieved_docs = retriever.get_relevant_documents(query)    # 和retriever.invoke(query) 一样
+    # 步骤 2: 所有查询一次向量化、一次批量检索（原来每个查询各自 向量化+检索 一次），再将结果累积
+    for current_retrieved_docs in vector_index.batch_search(all_queries, k=k):
         # 字典推导式    key 唯一，所以如果多个文档的内容相同，只会保留最后一个
         all_retrieved_docs.extend(current_retrieved_docs)
     unique_docs_map = {doc.page_content: doc for doc in all_retrieved_docs} # 把检索的文档一个个放入进去，组成大的相关列表  用extend  每个是Document对象
@@ -110,14 +105,12 @@ def generate_final_answer(llm, retrieved_docs:list, question:str)->str:
 def create_related_josnl(question_list):
     all_results=[]
 
-    retrieval = vector_db.as_retriever(search_type="similarity", search_kwargs={"k":10}) # 检索十个
-
     with open(question_list, 'r', encoding='utf-8') as f:
         for line in f:
             item = json.loads(line)
             question = item['question']
             all_queries = create_query(question)
-            retrieved_docs = get_expanded_retrieved_contexts(retrieval, all_queries)
+            retrieved_docs = get_expanded_retrieved_contexts(vector_db, all_queries, k=10)  # 每个查询检索十个
             answer = generate_final_answer(llm, retrieved_docs, question)
 
             answer_dict = {"question": question,
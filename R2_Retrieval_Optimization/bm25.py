@@ -1,38 +1,42 @@
 import os
-from rank_bm25 import BM25Okapi
-from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from R6_System_Optimization.page_cache import DEFAULT_CACHE_DIR, load_chunks_cached
+from R2_Retrieval_Optimization.sparse_bm25 import load_or_build_bm25
+from R2_Retrieval_Optimization.pruned_bm25 import LONG_QUERY_TERMS, MaxScoreBM25
 
 
 class BM25():
-    def __init__(self, filename=None):
+    # index_dir: 索引（含分词后的词 id 语料）保存的目录，语料和分词配置没变时启动直接加载，不再分词
+    def __init__(self, filename=None, index_dir=os.path.join(DEFAULT_CACHE_DIR, 'bm25')):
         self.filename = filename
 
         current_path = os.path.dirname(__file__)
         PDF = os.path.join(os.path.dirname(current_path), 'R1_Evaluation_Framework/PDF/ARES RAG Evaluation.pdf')
         filename = filename or PDF
 
-        loader = PyPDFLoader(filename)
-        documents = loader.load()
-
+        # 解析和切分结果按 文件哈希 + 切分参数 缓存在磁盘上，PDF 没变时启动不再重新解析
+        # filename 也可以是一个文件夹或通配符
         text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-        split_docs = text_splitter.split_documents(documents)
+        split_docs = load_chunks_cached(filename, text_splitter)
 
-        # 分词列表和原始文本列表
-        self.corpus_tokenized = [doc.page_content.split() for doc in split_docs]
+        # 原始文本列表
         self.corpus_original = [doc.page_content for doc in split_docs]
 
-        # 创建BM25索引
-        self.bm25 = BM25Okapi(self.corpus_tokenized)
+        # 创建BM25索引（稀疏矩阵实现，打分与 rank_bm25.BM25Okapi 相同，查询快得多）
+        # 中英文混合分词（中文二元切分 + 小写 + 停用词），str.split() 对中文整句只能切出一个词
+        self.bm25 = load_or_build_bm25(self.corpus_original, index_dir)
+        # 长查询（查询扩展、HyDE 假设文档）用 MaxScore 剪枝，结果与穷举相同
+        self.pruned = MaxScoreBM25(self.bm25)
 
     def search(self, query=None, index=3):
         # 准备查询
         if not query:
             raise ValueError("查询 query 不能为空")
-        tokenized_query = query.split()
+        tokenized_query = self.bm25.tokenize(query)  # 与语料相同的分词方式
 
         # 执行检索，但把【原始文本列表】作为返回值的来源
-        top_n_docs_text = self.bm25.get_top_n(tokenized_query, self.corpus_original, n=index)
+        bm25 = self.pruned if len(tokenized_query) >= LONG_QUERY_TERMS else self.bm25
+        top_n_docs_text = bm25.get_top_n(tokenized_query, self.corpus_original, n=index)
 
         # for i, doc_text in enumerate(top_n_docs_text):      返回字符串
         #     print(f"  文档 {i + 1} (预览): '{doc_text[:200]}...'")
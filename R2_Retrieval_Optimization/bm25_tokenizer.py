@@ -0,0 +1,142 @@
+# 文件名: bm25_tokenizer.py
+# BM25 用的中英文混合分词。str.split() 按空格切，"ARES系统的全称是什么？" 整句只得到一个词，BM25 基本不起作用：
+#   - 英文/数字：按单词切分并转小写（"ARES" 和 "ares" 是同一个词）
+#   - 中文：连续的汉字整段取相邻两字组成的二元词，再去掉停用词（Lucene CJKAnalyzer + StopFilter 的做法）
+#           "上下文窗口" -> ["上下", "下文", "文窗", "窗口"]；"什么是RAG" 中的 "什么" 是停用词，被丢弃
+#           不按单字停用词（上、中、有 ...）断开，否则 上下文 / 中文 / 有效 这类常用词会被切坏
+#           也可以用 jieba 词典分词（cjk="jieba"，需要另外安装 jieba）
+#   - 标点和停用词丢弃
+# encode_corpus 在进程池里并行分词，直接输出紧凑的 int32 词 id 数组（而不是 list[list[str]]），供 SparseBM25 建索引和保存。
+
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# 分词规则的版本，写进索引的分词配置；规则变化后旧索引的词对不上，需要重建
+# 2: 中文整段二元切分后再去停用词（1 按单字停用词断开后再切分）
+TOKENIZER_VERSION = 2
+
+# 常见的中英文停用词；单个汉字只在单独成词时（整段只有一个字）被去掉
+DEFAULT_STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in into is it its of on or that the their
+then there these this those to was were what when where which who why will with you your
+的 了 是 在 和 与 及 或 就 都 也 而 被 把 对 从 向 为 以 于 之 其 这 那 有 个 中 上 下 吗 呢 吧 啊 着 过 等 并 将
+什么 怎么 如何 哪些 哪个 为什么 是否 可以 我们 你们 他们 它们 一个 一种 没有 进行 通过 以及 如果 因为 所以 但是
+""".split())
+
+_CJK_CHARS = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"  # CJK 统一汉字（含扩展A、兼容汉字）
+_TOKEN_PATTERN = re.compile(f"[a-z0-9]+(?:['._-][a-z0-9]+)*|[{_CJK_CHARS}]+", re.IGNORECASE)
+_CJK_PATTERN = re.compile(f"[{_CJK_CHARS}]")
+
+
+class MixedTokenizer:
+    """
+    中英文混合分词器，实例可以 pickle（进程池并行分词时传给工作进程）
+    cjk (str): 中文的切分方式 "bigram"（二元切分，不需要词典）/ "jieba"（词典分词）
+    lowercase (bool): 英文是否转小写
+    stopwords: 停用词集合，None 使用 DEFAULT_STOPWORDS，传空集合表示不去停用词
+    """
+    def __init__(self, cjk: str = "bigram", lowercase: bool = True, stopwords=None):
+        if cjk not in ("bigram", "jieba"):
+            raise ValueError(f"未知的中文切分方式: {cjk}")
+        self.cjk = cjk
+        self.lowercase = lowercase
+        self.stopwords = frozenset(DEFAULT_STOPWORDS if stopwords is None else stopwords)
+
+    @property
+    def config(self) -> dict:
+        """写入索引元数据：分词方式不同的索引不能混用，加载时用 from_config 重建分词器"""
+        return {"version": TOKENIZER_VERSION, "cjk": self.cjk, "lowercase": self.lowercase,
+                "stopwords": sorted(self.stopwords)}
+
+    @classmethod
+    def from_config(cls, config: dict) -> "MixedTokenizer":
+        """按索引里记录的配置重建分词器；旧版分词规则建的索引抛出 ValueError（需要重建）"""
+        if config.get("version", 1) != TOKENIZER_VERSION:
+            raise ValueError(f"索引使用第 {config.get('version', 1)} 版分词规则，当前为第 {TOKENIZER_VERSION} 版，请重建索引")
+        return cls(**{key: value for key, value in config.items() if key != "version"})
+
+    def _split_cjk(self, run: str) -> list[str]:
+        if self.cjk == "jieba":
+            import jieba  # 可选依赖，只在使用词典分词时导入
+            return jieba.lcut(run)
+        if len(run) == 1:
+            return [run]
+        return [run[i: i + 2] for i in range(len(run) - 1)]  # 停用词在 __call__ 里统一去掉
+
+    def __call__(self, text: str) -> list[str]:
+        if self.lowercase:
+            text = text.lower()
+        tokens = []
+        for token in _TOKEN_PATTERN.findall(text):
+            if _CJK_PATTERN.match(token):
+                tokens.extend(self._split_cjk(token))
+            else:
+                tokens.append(token)
+        return [token for token in tokens if token and token not in self.stopwords]
+
+
+def _encode_texts(texts: list[str], tokenizer) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """
+    分词并编号（工作进程里执行），返回 (本批的局部词表, int32 局部词 id, 每个文本的词数)
+    只把数组和去重后的词表传回主进程，比传回 list[list[str]] 小得多
+    """
+    vocab = {}
+    lengths = np.empty(len(texts), dtype=np.int64)
+    ids = []
+    for i, text in enumerate(texts):
+        tokens = tokenizer(text)
+        lengths[i] = len(tokens)
+        ids.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+    return list(vocab), np.asarray(ids, dtype=np.int32), lengths
+
+
+def encode_corpus(texts: list[str], tokenizer=None, vocab: dict = None, max_workers: int = None,
+                  texts_per_task: int = 2000, min_texts_for_pool: int = 20000) -> tuple[dict, np.ndarray, np.ndarray]:
+    """
+    把一批文本分词并转成全局词 id
+    返回 (词表 {词: id}, 所有文本首尾相接的 int32 词 id 数组, 每个文本的词数)
+    vocab: 已有的词表（增量追加时传入，新词接在后面编号），会被原地更新
+    max_workers / texts_per_task: 进程池大小和每个任务的文本数；文本数少于 min_texts_for_pool 时直接在当前进程分词
+    """
+    tokenizer = tokenizer or MixedTokenizer()
+    vocab = {} if vocab is None else vocab
+    tasks = [texts[i: i + texts_per_task] for i in range(0, len(texts), texts_per_task)]
+    max_workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+    # 已经身处子进程时不再嵌套创建进程池（与 pdf_loader 相同）
+    in_child = multiprocessing.parent_process() is not None
+    if max_workers <= 1 or in_child or len(texts) < min_texts_for_pool:
+        results = (_encode_texts(task, tokenizer) for task in tasks)
+        return _merge(results, vocab)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return _merge(executor.map(_encode_texts, tasks, [tokenizer] * len(tasks)), vocab)
+
+
+def _merge(results, vocab: dict) -> tuple[dict, np.ndarray, np.ndarray]:
+    """局部词 id -> 全局词 id：只对每批去重后的词查表，再用数组下标一次映射整批"""
+    all_ids, all_lengths = [np.empty(0, dtype=np.int32)], [np.empty(0, dtype=np.int64)]
+    for terms, ids, lengths in results:
+        mapping = np.fromiter((vocab.setdefault(term, len(vocab)) for term in terms), dtype=np.int32,
+                              count=len(terms))
+        all_ids.append(mapping[ids])
+        all_lengths.append(lengths)
+    return vocab, np.concatenate(all_ids), np.concatenate(all_lengths)
+
+
+# --- 测试代码块 ---
+if __name__ == '__main__':
+    tokenizer = MixedTokenizer()
+    # 含单字停用词的常用词不能被切坏
+    assert tokenizer("上下文窗口") == ["上下", "下文", "文窗", "窗口"]
+    assert tokenizer("中文检索有效性") == ["中文", "文检", "检索", "索有", "有效", "效性"]
+    assert tokenizer("以上过程") == ["以上", "上过", "过程"]
+    assert "什么" not in tokenizer("ARES系统的全称是什么？")  # 停用二元词在切分后去掉
+    assert MixedTokenizer.from_config(tokenizer.config).config == tokenizer.config
+    for text in ["ARES系统的全称是什么？", "What is the full name of the ARES system?",
+                 "RAG评估框架ARES使用LLM-as-a-judge打分，准确率达到92.5%"]:
+        print(text, "->", tokenizer(text))
+    vocab, ids, lengths = encode_corpus(["检索增强生成 RAG", "RAG 的检索模块"])
+    print(vocab, ids, lengths)
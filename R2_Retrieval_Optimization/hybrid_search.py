@@ -1,16 +1,18 @@
 import json
 import os
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from rank_bm25 import BM25Okapi
-from langchain_chroma import Chroma
 from langchain_community.embeddings import DashScopeEmbeddings
 from R1_Evaluation_Framework.ragas_eval import Test
+from R6_System_Optimization.vector_backends import open_vector_index
+from R2_Retrieval_Optimization.sparse_bm25 import SparseBM25
+from R2_Retrieval_Optimization.pruned_bm25 import LONG_QUERY_TERMS, MaxScoreBM25
+from R2_Retrieval_Optimization.segment_bm25 import SegmentedBM25, document_id
 from local_model import get_embedding_model, get_llm
+from R6_System_Optimization.embedding_cache import CachedEmbeddings
 
 llm = get_llm()
-embedding = get_embedding_model()
+embedding = CachedEmbeddings(get_embedding_model())  # 磁盘缓存：重复实验只为新文本调用API
 
 current_path = os.path.dirname(__file__)
 parent_path = os.path.dirname(current_path)  # 返回上一级目录
@@ -20,7 +22,6 @@ parent_path = os.path.dirname(current_path)  # 返回上一级目录
 # )
 db_name = 'chroma_db'
 db_path = os.path.join(parent_path, 'R1_Evaluation_Framework', db_name)  # 错误  现在不是向量数据库
-vector_db = Chroma(persist_directory=db_path, embedding_function=embedding)
 
 question_list_name = 'golden_dataset.jsonl'
 question_list = os.path.join(parent_path, 'R1_Evaluation_Framework', question_list_name)
@@ -29,20 +30,27 @@ question_list = os.path.join(parent_path, 'R1_Evaluation_Framework', question_li
 class Hybrid_search():
     # 现在改为接收外部已经准备好的 "split_docs" 和 "retriever_vector" 作为参数。
     # 这样，重量级的操作（加载、切分、初始化向量检索器）就只需要在程序启动时执行一次。
-    def __init__(self, split_docs, retriever_vector):
+    # bm25: 已经建好的索引。SparseBM25 按下标对应 split_docs；SegmentedBM25 按 chunk id 对应（与向量库共用 id）
+    def __init__(self, split_docs, retriever_vector, bm25=None):
         self.split_docs = split_docs
         self.retriever_vector = retriever_vector  # 将高效的、持久化的向量检索器保存起来
 
-        # BM25的初始化仍然放在这里，因为它依赖于split_docs，并且计算很快
-        corpus_tokenized = [doc.page_content.split() for doc in self.split_docs]
-        self.bm25 = BM25Okapi(corpus_tokenized)
+        # 没有传入时现场建索引：中英文混合分词（中文二元切分 + 小写 + 停用词），打分与 BM25Okapi 相同
+        self.bm25 = bm25 or SparseBM25.from_texts([doc.page_content for doc in self.split_docs])
+        self.docs_by_id = {document_id(doc): doc for doc in self.split_docs}
+        # 长查询用 MaxScore 剪枝（结果与穷举相同），只支持 SparseBM25；
+        # 主程序传入的 SegmentedBM25 始终穷举打分（原因见 pruned_bm25 的文件头）
+        self.pruned = MaxScoreBM25(self.bm25) if isinstance(self.bm25, SparseBM25) else None
 
     def bm25_retrieved(self, query=None, k=10):
         # bm25检索器
         # BM25返回的是原始文本块，我们需要找到对应的Document对象     range(len(split_docs))  生成文本块长度的序列 占位  就返回索引
         # 传给 BM25 一个“占位列表”，让它返回索引而不是原始文本。
-        tokenized_query = query.split()
-        bm25_doc_indices = self.bm25.get_top_n(tokenized_query, range(len(self.split_docs)), n=k)
+        if isinstance(self.bm25, SegmentedBM25):
+            return [self.docs_by_id[doc_id] for doc_id, _ in self.bm25.search(query, k) if doc_id in self.docs_by_id]
+        tokenized_query = self.bm25.tokenize(query)  # 与语料相同的分词方式，中文问题不再整句只有一个词
+        bm25 = self.pruned if self.pruned and len(tokenized_query) >= LONG_QUERY_TERMS else self.bm25
+        bm25_doc_indices = bm25.get_top_n(tokenized_query, range(len(self.split_docs)), n=k)
         bm25_retrieved_docs = [self.split_docs[i] for i in bm25_doc_indices]
 
         return bm25_retrieved_docs
@@ -100,21 +108,25 @@ class Hybrid_search():
 
 
 if __name__ == "__main__":
-    # 步骤 1: 一次性加载和切分所有文档 (原本在 __init__ 中)
-    print("--- 步骤 1: 正在加载和切分文档 (仅执行一次) ---")
-    pdf_path = os.path.join(parent_path, 'R1_Evaluation_Framework/PDF/ARES RAG Evaluation.pdf')
-    loader = PyPDFLoader(pdf_path)
-    documents = loader.load()
+    # 步骤 1: 一次性准备好所有文本块 (原本在 __init__ 中)
+    print("--- 步骤 1: 正在从向量库读取文本块 (仅执行一次) ---")
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=200)
-    split_docs = text_splitter.split_documents(documents)
+    # BM25 的切分参数必须和向量库一致，否则两路检索的文本块对不上；不一致时这里直接报错
+    # 存储引擎由环境变量 VECTOR_BACKEND 选择（chroma / flat / ann）
+    # 分段的增量 BM25 索引由工厂一起打开，保存在实际的向量库目录旁边（chroma_db_xxxxxxxx -> chroma_db_xxxxxxxx_bm25），
+    # 文档 id 就是向量库的 chunk id；打开时按 id 和向量库对齐，只为新增的文本块分词、删除已经不存在的，不再整体重建
+    vector_index = open_vector_index(db_path, embedding, splitter=text_splitter, keyword_index=True)
+    # 向量库里已经存着切分好的文本块，BM25 直接用它们建语料，不再重新解析PDF
+    split_docs = vector_index.documents()
 
     # 步骤 2: 基于持久化数据库，一次性创建高效的向量检索器
     print("--- 步骤 2: 正在初始化持久化向量检索器 (仅执行一次) ---")
-    vector_retriever = vector_db.as_retriever(search_kwargs={"k": 10})
+    vector_retriever = vector_index.as_retriever(search_kwargs={"k": 10})
 
     # 步骤 3: 实例化 Hybrid_search，并传入准备好的材料
     print("--- 步骤 3: 正在实例化混合搜索模块 ---")
-    hybrid_search = Hybrid_search(split_docs=split_docs, retriever_vector=vector_retriever)
+    hybrid_search = Hybrid_search(split_docs=split_docs, retriever_vector=vector_retriever,
+                                  bm25=vector_index.keyword_index)
 
     # 步骤 4: 开始循环处理问题，此时所有准备工作都已完成
     print("--- 步骤 4: 开始循环处理所有问题 ---")
@@ -122,29 +134,29 @@ if __name__ == "__main__":
     resultdir = 'Hybrid.jsonl'
     test = Test(resultdir)
     with open(question_list, 'r', encoding='utf-8') as f:
-        for i, line in enumerate(f, start=1):
-            item = json.loads(line)
-            question = item["question"]
-            print(f"正在检索第{i}个问题：{question}")
+        questions = [json.loads(line)["question"] for line in f]
+    # 向量检索一次做完：所有问题一次向量化、一次批量检索，不再每个问题各自往返一次
+    all_vector_retrieved_docs = vector_index.batch_search(questions, k=10)
+    for i, (question, vector_retrieved_docs) in enumerate(zip(questions, all_vector_retrieved_docs), start=1):
+        print(f"正在检索第{i}个问题：{question}")
 
-            # 调用现在高效且正确的检索方法
-            bm25_retrieved_docs = hybrid_search.bm25_retrieved(question, k=10)
-            vector_retrieved_docs = hybrid_search.embeddings_retrieved(question)
+        # 调用现在高效且正确的检索方法
+        bm25_retrieved_docs = hybrid_search.bm25_retrieved(question, k=10)
 
-            # 将两个检索结果放入一个列表中
-            # 使用.extend()会破坏掉原始的排名信息。
-            # 而RRF算法的核心，恰恰就是依赖于每个文档在各自检索结果中的原始排名来计算分数的。所以，.extend()的方法在这里是完全错误的。
-            all_retrieval_results = [bm25_retrieved_docs, vector_retrieved_docs]
+        # 将两个检索结果放入一个列表中
+        # 使用.extend()会破坏掉原始的排名信息。
+        # 而RRF算法的核心，恰恰就是依赖于每个文档在各自检索结果中的原始排名来计算分数的。所以，.extend()的方法在这里是完全错误的。
+        all_retrieval_results = [bm25_retrieved_docs, vector_retrieved_docs]
 
-            # 调用RRF函数
-            fused_docs = hybrid_search.reciprocal_rank_fusion(all_retrieval_results)
+        # 调用RRF函数
+        fused_docs = hybrid_search.reciprocal_rank_fusion(all_retrieval_results)
 
-            # print("\n--- 融合排序 (RRF) 后的最终结果 ---")
-            # for i, doc in enumerate(fused_docs):
-            #     print(f"  Rank {i + 1}: {doc.page_content[:100]}...")
+        # print("\n--- 融合排序 (RRF) 后的最终结果 ---")
+        # for i, doc in enumerate(fused_docs):
+        #     print(f"  Rank {i + 1}: {doc.page_content[:100]}...")
 
-            question_dict = test.generate_answer(question, fused_docs)
-            all_results.append(question_dict)
+        question_dict = test.generate_answer(question, fused_docs)
+        all_results.append(question_dict)
 
     print("正在写入")
     with open(resultdir, 'w', encoding='utf-8') as f:
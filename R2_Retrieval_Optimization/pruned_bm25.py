@@ -0,0 +1,208 @@
+# 文件名: pruned_bm25.py
+# 动态剪枝（MaxScore）的 BM25 top-k，结果与穷举打分完全相同：
+#   - 穷举打分（SparseBM25）要把每个查询词的整条倒排都算一遍；查询扩展、HyDE 假设文档这类长查询有几十个词，
+#     延迟随语料规模线性增长
+#   - MaxScore：建索引时记下每个词的最大权重（分数上界）。查询时先从最稀有词的倒排里得到一个当前第 k 名分数 θ，
+#     上界之和都小于 θ 的那些词（通常是 df 大、idf 小的常见词）是 "非必要词"：只含这些词的文档进不了 top-k，
+#     它们的倒排不用遍历，只在候选文档上二分查找权重
+#   - 候选文档只来自必要词（稀有词）的倒排；再用每个词在每个块（block_size 个文档）里的最大权重给候选一个更紧的上界，
+#     上界达不到 θ 的候选连二分查找也省掉
+# 适合 k 较小、查询较长的场景；短查询直接用 SparseBM25 的矩阵乘法就够快（bm25.BM25 / Hybrid_search 按
+# LONG_QUERY_TERMS 自动选择）。
+# 只支持 SparseBM25：hybrid_search 主程序传入的是与向量库对齐的 segment_bm25.SegmentedBM25，那条路径不剪枝。
+# 分段索引的权重依赖查询时的全局 idf / avgdl，无法预先算出每个词的最大权重；按段用 (最大词频, 最小文档长度)
+# 估上界的做法试过，15 万文档的主题语料上长查询 4.6ms，反而比分段穷举的 1.7ms 慢（候选集合并的开销大于省下的倒排）。
+# 剪枝依赖 "权重非负"：语料里高频词多时 epsilon * 平均idf 可能为负，查询含这样的词时退回穷举打分。
+
+import time
+
+import numpy as np
+from scipy import sparse
+
+from R2_Retrieval_Optimization.sparse_bm25 import SparseBM25
+
+LONG_QUERY_TERMS = 16  # 分词后至少这么多个词的查询才走 MaxScore 剪枝
+
+
+class MaxScoreBM25:
+    """
+    在 SparseBM25 的权重矩阵上做 MaxScore 剪枝的 top-k；打分与 SparseBM25 / BM25Okapi 相同
+    bm25 (SparseBM25): 已经建好（或 load 出来）的索引
+    block_size (int): 块级最大权重的块大小，块越小候选文档的上界越紧，但块级数组越大
+    seed_docs (int): 第一步用来确定初始阈值 θ 的倒排条数（取自最稀有查询词的倒排）
+    refine_docs (int): 其中部分分数最高、再精确打分来收紧 θ 的文档数
+    """
+    def __init__(self, bm25: SparseBM25, block_size: int = 1024, seed_docs: int = 1024, refine_docs: int = 32):
+        self.bm25 = bm25
+        self.block_size = block_size
+        self.seed_docs = seed_docs
+        self.refine_docs = refine_docs
+        weights = bm25.weights
+        if not weights.has_sorted_indices:
+            weights.sort_indices()  # 每个词的倒排按文档下标有序，才能二分查找
+        self.num_blocks = -(-len(bm25) // block_size)
+        lengths = np.diff(weights.indptr)
+        self.df = lengths  # 每个词的倒排长度
+        data = np.asarray(weights.data)
+        # 每个词的最大 / 最小权重：最大权重是 MaxScore 的上界，最小权重为负的词不能参与剪枝
+        self.term_max = np.zeros(weights.shape[0], dtype=np.float32)
+        self.term_min = np.zeros(weights.shape[0], dtype=np.float32)
+        # 每个词在每个块里的最大权重：(词表大小, 块数) 的 CSR，倒排中 (词, 块) 变化的位置就是一段的起点
+        starts = blocks = maxima = np.empty(0, dtype=np.int64)
+        if len(data):  # 没有任何倒排（空语料 / 全是空文档）时各数组都是空的
+            nonempty = lengths > 0
+            self.term_max[nonempty] = np.maximum.reduceat(data, weights.indptr[:-1][nonempty])
+            self.term_min[nonempty] = np.minimum.reduceat(data, weights.indptr[:-1][nonempty])
+            rows = np.repeat(np.arange(weights.shape[0]), lengths)
+            blocks = np.asarray(weights.indices) // block_size
+            starts = np.flatnonzero(np.concatenate([[True], (rows[1:] != rows[:-1]) | (blocks[1:] != blocks[:-1])]))
+            maxima = np.maximum.reduceat(data, starts)
+        self.block_max = sparse.csr_matrix((maxima.astype(np.float32), blocks[starts],
+                                            np.searchsorted(starts, weights.indptr)),
+                                           shape=(weights.shape[0], self.num_blocks))
+
+    def _postings(self, term: int) -> tuple[np.ndarray, np.ndarray]:
+        span = slice(self.bm25.weights.indptr[term], self.bm25.weights.indptr[term + 1])
+        return self.bm25.weights.indices[span], self.bm25.weights.data[span]
+
+    def _lookup(self, term: int, docs: np.ndarray) -> np.ndarray:
+        """词 term 在这些文档上的权重（不含该词的为 0）：在有序倒排里二分查找，不遍历整条倒排"""
+        indices, data = self._postings(term)
+        if not len(indices):
+            return np.zeros(len(docs), dtype=np.float32)
+        positions = np.minimum(np.searchsorted(indices, docs), len(indices) - 1)
+        return np.where(indices[positions] == docs, data[positions], 0)
+
+    def __len__(self) -> int:
+        return len(self.bm25)
+
+    def tokenize(self, text: str) -> list[str]:
+        return self.bm25.tokenize(text)
+
+    def top_k(self, query: list[str], k: int = 10, stats: dict = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        与 SparseBM25.top_k 相同的 (文档下标, 分数)，按分数从高到低
+        stats: 传入 dict 时记录遍历的倒排数 postings 和二分查找次数 lookups（用于和穷举打分对比）
+        """
+        known = [self.bm25.vocab[token] for token in query if token in self.bm25.vocab]
+        terms, counts = np.unique(np.array(known, dtype=np.int64), return_counts=True)
+        if len(terms) and self.term_min[terms].min() < 0:
+            # 含负权重的词时部分分数不再是下界、上界之和也不再单调，剪枝不安全，直接穷举打分
+            if stats is not None:
+                stats.update(postings=int(self.df[terms].sum()), lookups=0, essential=len(terms), terms=len(terms))
+            return self.bm25.top_k(query, k)
+        bounds = self.term_max[terms].astype(np.float64) * counts
+        postings, lookups = 0, 0
+
+        # 1. 最稀有（倒排最短）的几个词的倒排只累加这几个词的分数；权重非负，部分分数是完整分数的下界，
+        #    其中第 k 大的值就是安全的初始阈值 θ（至少有 k 个文档的完整分数不低于它）
+        seed_docs, seed_values = [], []
+        for i in np.argsort(self.df[terms], kind="stable"):
+            indices, data = self._postings(terms[i])
+            seed_docs.append(indices)
+            seed_values.append(data * counts[i])
+            postings += len(indices)
+            if postings >= self.seed_docs:
+                break
+        threshold = 0.0
+        if seed_docs:
+            docs, inverse = np.unique(np.concatenate(seed_docs), return_inverse=True)
+            partial = np.bincount(inverse, np.concatenate(seed_values), minlength=len(docs))
+            # 部分分数最高的少数文档再精确打分（只做二分查找），θ 更接近真正的第 k 名
+            top = docs[np.argsort(-partial, kind="stable")[: max(k, self.refine_docs)]]
+            lookups += len(top) * len(terms)
+            exact = sum((self._lookup(t, top) * c for t, c in zip(terms, counts)), np.zeros(len(top)))
+            if len(exact) >= k:
+                threshold = np.partition(exact, len(exact) - k)[len(exact) - k]
+
+        # 2. 按上界从小到大，累计上界小于 θ 的词是 "非必要词"：只含这些词的文档分数不可能达到 θ
+        ascending = np.argsort(bounds, kind="stable")
+        optional = ascending[: np.searchsorted(np.cumsum(bounds[ascending]), threshold, side="left")]
+        essential = np.setdiff1d(np.arange(len(terms)), optional)
+
+        # 3. 候选文档只来自必要词的倒排，先累加必要词的分数
+        docs, values = [], []
+        for i in essential:
+            indices, data = self._postings(terms[i])
+            docs.append(indices)
+            values.append(data * counts[i])
+            postings += len(indices)
+        docs = np.concatenate(docs) if docs else np.empty(0, dtype=np.int64)
+        candidates, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, np.concatenate(values) if values else None, minlength=len(candidates))
+
+        # 4. 候选的上界 = 必要词分数 + 非必要词在所在块的最大权重之和；达到 θ 的才查非必要词的精确权重
+        if len(optional):
+            block_max = self.block_max[terms[optional]].toarray().astype(np.float64) * counts[optional][:, None]
+            upper = scores + block_max.sum(axis=0)[candidates // self.block_size]
+            keep = upper >= threshold
+            candidates, scores = candidates[keep], scores[keep]
+            lookups += len(candidates) * len(optional)
+            for i in optional:
+                scores = scores + self._lookup(terms[i], candidates) * counts[i]
+
+        scores = scores.astype(np.float32)
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores = candidates[best], scores[best]
+        keep = scores > 0
+        candidates, scores = candidates[keep], scores[keep]
+        if stats is not None:
+            stats.update(postings=postings, lookups=lookups, essential=len(essential), terms=len(terms))
+        order = np.argsort(-scores, kind="stable")
+        return candidates[order].astype(np.int64), scores[order]
+
+    def search(self, query: str, k: int = 10) -> tuple[np.ndarray, np.ndarray]:
+        return self.top_k(self.tokenize(query), k)
+
+    def batch_search(self, queries: list[str], k: int = 10) -> list[tuple[np.ndarray, np.ndarray]]:
+        return [self.search(query, k) for query in queries]
+
+    def get_top_n(self, query: list[str], documents: list, n: int = 5) -> list:
+        """与 SparseBM25.get_top_n 相同，可以直接传给 Hybrid_search(bm25=...)"""
+        docs, _ = self.top_k(query, n)
+        if len(docs) < n:
+            rest = np.setdiff1d(np.arange(min(len(self), n + len(docs))), docs)[: n - len(docs)]
+            docs = np.concatenate([docs, rest])
+        return [documents[i] for i in docs]
+
+
+# --- 测试代码块：长查询上 剪枝 vs 穷举 的延迟随语料规模的变化 ---
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    vocab_size, num_topics = 200_000, 2000
+    vocab = {f"w{i}": i for i in range(vocab_size)}
+    # 模拟真实语料：每个文档 24 个通用词（Zipf 分布）+ 16 个所属主题的主题词；
+    # 长查询 = 某个主题的 20 个主题词 + 12 个通用词（去掉最高频的 100 个停用词），模拟查询扩展 / HyDE 生成的一段话
+    general = 1 / np.arange(1, vocab_size + 1) ** 1.1
+    general /= general.sum()
+    topic_terms = rng.integers(1000, vocab_size, (num_topics, 200))
+    in_topic = 1 / np.arange(1, 201) ** 0.8
+    in_topic /= in_topic.sum()
+    no_stopwords = general[100:] / general[100:].sum()
+    queries = [[f"w{i}" for i in np.concatenate([topic_terms[rng.integers(num_topics), rng.choice(200, 20, p=in_topic)],
+                                                 rng.choice(np.arange(100, vocab_size), 12, p=no_stopwords)])]
+               for _ in range(50)]
+    for count in (250_000, 500_000, 1_000_000):
+        topics = rng.integers(0, num_topics, count)
+        term_ids = np.concatenate([rng.choice(vocab_size, (count, 24), p=general),
+                                   topic_terms[topics[:, None], rng.choice(200, (count, 16), p=in_topic)]],
+                                  axis=1).astype(np.int32).ravel()
+        bm25 = SparseBM25().fit_ids(vocab, term_ids, np.full(count, 40))
+        del term_ids
+        pruned = MaxScoreBM25(bm25)
+        exact_ms, pruned_ms, fraction, same = [], [], [], 0
+        for query in queries:
+            start = time.perf_counter()
+            expected = bm25.top_k(query, 10)
+            exact_ms.append((time.perf_counter() - start) * 1000)
+            stats = {}
+            start = time.perf_counter()
+            docs, scores = pruned.top_k(query, 10, stats)
+            pruned_ms.append((time.perf_counter() - start) * 1000)
+            total = pruned.df[np.unique([bm25.vocab[t] for t in query if t in bm25.vocab])].sum()
+            fraction.append(stats["postings"] / max(total, 1))
+            same += len(scores) == len(expected[1]) and np.allclose(scores, expected[1], atol=1e-4)
+        print(f"{count:>9} 个文档  穷举 p50 {np.percentile(exact_ms, 50):6.1f}ms  "
+              f"剪枝 p50 {np.percentile(pruned_ms, 50):6.1f}ms  遍历的倒排 / 全部倒排 {np.median(fraction):.1%}  "
+              f"结果一致 {same}/{len(queries)}")
@@ -0,0 +1,490 @@
+# 文件名: segment_bm25.py
+# 分段的增量 BM25 索引（Lucene 的做法），语料变化时不必整体重建：
+#   - 段 (segment)：不可变的一批文档，保存原始词频的 CSR 矩阵 (词, 文档)、文档长度、int32 词 id 流、文档 id
+#   - 缓冲区：新写入的文档先进内存缓冲区（同时追加到 buffer.jsonl 操作日志，进程崩溃后重放），满 buffer_size 条落盘成一个新段
+#   - 删除：段里的文档只打删除标记 (tombstone)；合并段时才真正丢弃
+#   - 合并：同一数量级的段攒够 merge_factor 个时合并成一个（按 词 id 流 重新建矩阵，不需要重新分词）
+#   - 全局统计（文档数、平均长度、每个词的文档频率 df）随写入/删除增量维护，查询时现算 idf 和长度归一化，
+#     所以任何时刻的打分都与对当前全部文档重新建 SparseBM25 / BM25Okapi 完全相同
+# 文档 id 与向量库的 chunk_id 相同（index_builder 生成的稳定 ID），sync(documents) 按 id 对齐两边：
+# 在千万级语料上新增 1000 个文本块，只需要给这 1000 个分词、写一个小段。
+# 目录结构:
+#   directory/
+#     segments.json      参数、分词器配置、段列表、全局统计、当前 df 文件
+#     vocab.txt          词表，每行一个 JSON 字符串，只追加
+#     df_<代>.npy        各段（不含缓冲区）中每个词的文档频率
+#     buffer.jsonl       缓冲区的操作日志 {"op": "add", "id", "tokens"} / {"op": "delete", "id"}
+#     seg_000001/        一个段: tf_indptr/tf_indices/tf_data/doc_len/term_ids.npy、ids.json、deleted_<代>.npy
+
+import itertools
+import json
+import math
+import os
+import shutil
+import time
+
+import numpy as np
+from scipy import sparse
+
+from R2_Retrieval_Optimization.bm25_tokenizer import TOKENIZER_VERSION, MixedTokenizer, encode_corpus
+
+SEGMENTS_META = "segments.json"
+SEGMENTS_VERSION = 1
+VOCAB_FILE = "vocab.txt"
+BUFFER_LOG = "buffer.jsonl"
+
+
+def document_id(doc) -> str:
+    """Document 的 id：flat / ann 库放在 doc.id，Chroma 读出来的放在 metadata["chunk_id"]"""
+    return doc.id or doc.metadata.get("chunk_id")
+
+
+def _write_json(path: str, data):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+class Segment:
+    """
+    一个不可变的段；只有删除标记 deleted 会变
+    tf: (建段时的词表大小, 文档数) 的原始词频 CSR 矩阵，词 id 是全局词表里的 id
+    """
+    def __init__(self, name: str, ids: list[str], doc_len: np.ndarray, term_ids: np.ndarray, tf: sparse.csr_matrix,
+                 deleted: np.ndarray = None):
+        self.name = name
+        self.ids = ids
+        self.doc_len = doc_len
+        self.term_ids = term_ids
+        self.tf = tf
+        self.deleted = np.zeros(len(ids), dtype=bool) if deleted is None else np.array(deleted, dtype=bool)
+        self.offsets = np.concatenate([[0], np.cumsum(doc_len, dtype=np.int64)])
+        self.deleted_file = None  # 当前保存删除标记的文件名（随代数变化）
+
+    @classmethod
+    def build(cls, name: str, ids: list[str], doc_len: np.ndarray, term_ids: np.ndarray, vocab_size: int):
+        doc_len = np.asarray(doc_len, dtype=np.int32)
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        doc_ids = np.repeat(np.arange(len(ids), dtype=np.int32), doc_len)
+        tf = sparse.csr_matrix((np.ones(len(term_ids), dtype=np.float32), (term_ids, doc_ids)),
+                               shape=(vocab_size, len(ids)))
+        tf.sum_duplicates()
+        return cls(name, list(ids), doc_len, term_ids, tf)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def live_count(self) -> int:
+        return len(self.ids) - int(self.deleted.sum())
+
+    def tokens(self, row: int) -> np.ndarray:
+        return self.term_ids[self.offsets[row]: self.offsets[row + 1]]
+
+    def live_rows(self) -> np.ndarray:
+        return np.flatnonzero(~self.deleted)
+
+    def save(self, directory: str):
+        path = os.path.join(directory, self.name)
+        os.makedirs(path, exist_ok=True)
+        arrays = {"tf_indptr": self.tf.indptr, "tf_indices": self.tf.indices, "tf_data": self.tf.data,
+                  "doc_len": self.doc_len, "term_ids": self.term_ids}
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        _write_json(os.path.join(path, "ids.json"), self.ids)
+
+    @classmethod
+    def load(cls, directory: str, name: str, deleted_file: str = None):
+        path = os.path.join(directory, name)
+
+        def load_array(array_name):
+            return np.load(os.path.join(path, f"{array_name}.npy"), mmap_mode="r")
+
+        with open(os.path.join(path, "ids.json"), "r", encoding="utf-8") as f:
+            ids = json.load(f)
+        doc_len = load_array("doc_len")
+        indptr = load_array("tf_indptr")
+        tf = sparse.csr_matrix((load_array("tf_data"), load_array("tf_indices"), indptr),
+                               shape=(len(indptr) - 1, len(ids)), copy=False)
+        deleted = np.load(os.path.join(path, deleted_file)) if deleted_file else None
+        segment = cls(name, ids, doc_len, load_array("term_ids"), tf, deleted)
+        segment.deleted_file = deleted_file
+        return segment
+
+    def score(self, query_ids: np.ndarray, idf: np.ndarray, avgdl: float, k1: float, b: float, k: int):
+        """本段的 top-k (行号, 分数)；query_ids 中重复的词按次数累加，已删除的文档不参与"""
+        known = query_ids < self.tf.shape[0]  # 建段之后才出现的词在本段里没有倒排
+        query_ids, idf = query_ids[known], idf[known]
+        postings = self.tf[query_ids]
+        rows = np.repeat(np.arange(len(query_ids)), np.diff(postings.indptr))
+        tf = postings.data
+        weights = idf[rows] * tf * (k1 + 1) / (tf + k1 * (1 - b + b * self.doc_len[postings.indices] / avgdl))
+        postings = sparse.csr_matrix((weights.astype(np.float32), postings.indices, postings.indptr),
+                                     shape=postings.shape)
+        scores = sparse.csr_matrix(np.ones((1, len(query_ids)), dtype=np.float32)) @ postings
+        docs, values = scores.indices, scores.data
+        live = ~self.deleted[docs]
+        docs, values = docs[live], values[live]
+        if len(values) > k:
+            top = np.argpartition(-values, k - 1)[:k]
+            docs, values = docs[top], values[top]
+        return docs, values
+
+
+class SegmentedBM25:
+    """
+    分段的增量 BM25 索引，打分与 BM25Okapi 相同
+    directory (str): 索引目录，已有索引时打开，否则在第一次写入时创建
+    tokenizer: 默认 MixedTokenizer；打开已有索引时使用索引里记录的分词配置，传入的配置不同会报错
+    buffer_size (int): 缓冲区满多少条时落盘成一个段
+    merge_factor (int): 同一数量级的段攒够多少个时合并
+    k1 / b / epsilon: BM25 参数，只在新建索引时使用
+    """
+    def __init__(self, directory: str, tokenizer=None, buffer_size: int = 10000, merge_factor: int = 10,
+                 k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.merge_factor = merge_factor
+        self.segments = []
+        self.terms = []             # 词 id -> 词
+        self.vocab = {}             # 词 -> 词 id
+        self.df = np.zeros(0, dtype=np.int64)          # 各段中未删除文档的 df（不含缓冲区），持久化
+        self.buffer = {}            # 缓冲区 id -> int32 词 id 数组（按写入顺序）
+        self.buffer_df = np.zeros(0, dtype=np.int64)   # 缓冲区文档的 df
+        self.buffer_len = 0         # 缓冲区文档的总词数
+        self._buffer_segment = None  # 缓冲区临时建成的段，缓冲区变化时失效
+        self._locations = None      # 段里未删除文档的 id -> (段, 行号)，删除/更新时才建立
+        self._avg_idf = None        # epsilon 下限用的平均 idf，统计变化时失效
+        self.meta = {"version": SEGMENTS_VERSION, "k1": k1, "b": b, "epsilon": epsilon,
+                     "tokenizer": (tokenizer or MixedTokenizer()).config, "generation": 0, "next_segment": 1,
+                     "vocab_size": 0, "live_count": 0, "total_len": 0, "df": None, "segments": []}
+        meta_path = os.path.join(directory, SEGMENTS_META)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["tokenizer"].get("version", 1) != TOKENIZER_VERSION:
+                # 分词规则变了，旧的词 id 流对不上新规则切出的查询词：清空后由 sync() 按新规则重新写入
+                print(f"索引 '{directory}' 使用旧版分词规则，清空后重新建立")
+                shutil.rmtree(directory)
+            else:
+                self.meta = meta
+                if tokenizer is not None and tokenizer.config != self.meta["tokenizer"]:
+                    raise ValueError(f"索引 '{directory}' 的分词配置与传入的分词器不同，请换一个目录")
+                self._load()
+        self._replay_buffer()  # 还没有落盘过任何段时，缓冲区也只存在于日志里
+        self.tokenizer = MixedTokenizer.from_config(self.meta["tokenizer"])
+        self.k1, self.b, self.epsilon = self.meta["k1"], self.meta["b"], self.meta["epsilon"]
+
+    # --- 打开 / 持久化 ---
+    def _load(self):
+        vocab_path = os.path.join(self.directory, VOCAB_FILE)
+        if os.path.exists(vocab_path):
+            with open(vocab_path, "r", encoding="utf-8") as f:
+                self.terms = [json.loads(line) for line in itertools.islice(f, self.meta["vocab_size"])]
+        self.vocab = {term: i for i, term in enumerate(self.terms)}
+        self._truncate_vocab_file()
+        if self.meta["df"]:
+            self.df = np.load(os.path.join(self.directory, self.meta["df"])).astype(np.int64)
+        self.segments = [Segment.load(self.directory, entry["name"], entry["deleted"])
+                         for entry in self.meta["segments"]]
+
+    def _truncate_vocab_file(self):
+        """上次保存元数据之前崩溃时，词表文件里可能多出未登记的词，截掉后才能继续追加"""
+        path = os.path.join(self.directory, VOCAB_FILE)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                extra = sum(1 for _ in f) > len(self.terms)
+            if extra:
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    f.writelines(json.dumps(term, ensure_ascii=False) + "\n" for term in self.terms)
+                os.replace(path + ".tmp", path)
+
+    def _replay_buffer(self):
+        path = os.path.join(self.directory, BUFFER_LOG)
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.endswith("\n")]  # 最后一行可能没写完
+        locations = self._id_locations() if records else {}
+        for record in records:
+            self._buffer_pop(record["id"])
+            if record["op"] == "add" and record["id"] not in locations:  # 已经在段里：落盘后、清空日志前崩溃
+                self._buffer_put(record["id"], self._term_ids(record["tokens"]))
+
+    def _term_ids(self, tokens: list[str]) -> np.ndarray:
+        ids = np.fromiter((self.vocab.setdefault(token, len(self.vocab)) for token in tokens), dtype=np.int32,
+                          count=len(tokens))
+        self.terms.extend(itertools.islice(self.vocab, len(self.terms), None))
+        return ids
+
+    def _buffer_put(self, doc_id: str, term_ids: np.ndarray):
+        if len(self.buffer_df) < len(self.terms):
+            self.buffer_df = np.pad(self.buffer_df, (0, len(self.terms) - len(self.buffer_df)))
+        self.buffer[doc_id] = term_ids
+        self.buffer_df[np.unique(term_ids)] += 1
+        self.buffer_len += len(term_ids)
+        self._buffer_segment = None
+
+    def _buffer_pop(self, doc_id: str) -> bool:
+        term_ids = self.buffer.pop(doc_id, None)
+        if term_ids is None:
+            return False
+        self.buffer_df[np.unique(term_ids)] -= 1
+        self.buffer_len -= len(term_ids)
+        self._buffer_segment = None
+        return True
+
+    def _log(self, records: list[dict]):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, BUFFER_LOG), "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+    def _save_meta(self, dirty_segments=()):
+        """
+        新的一代：先写新的 df / 删除标记文件、追加词表，最后替换 segments.json
+        中途崩溃时 segments.json 仍指向上一代的文件，索引保持一致
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        generation = self.meta["generation"] + 1
+        with open(os.path.join(self.directory, VOCAB_FILE), "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(term, ensure_ascii=False) + "\n" for term in self.terms[self.meta["vocab_size"]:])
+        stale = [self.meta["df"]] if self.meta["df"] else []
+        df_name = f"df_{generation}.npy"
+        np.save(os.path.join(self.directory, df_name), np.pad(self.df, (0, len(self.terms) - len(self.df))))
+        for segment in dirty_segments:
+            if segment.deleted_file:
+                stale.append(os.path.join(segment.name, segment.deleted_file))
+            segment.deleted_file = f"deleted_{generation}.npy"
+            np.save(os.path.join(self.directory, segment.name, segment.deleted_file), segment.deleted)
+        self.meta.update(generation=generation, df=df_name, vocab_size=len(self.terms),
+                         segments=[{"name": s.name, "count": len(s), "deleted": s.deleted_file}
+                                   for s in self.segments])
+        _write_json(os.path.join(self.directory, SEGMENTS_META), self.meta)
+        for name in stale:
+            os.remove(os.path.join(self.directory, name))
+
+    # --- 统计 ---
+    def __len__(self) -> int:
+        return self.meta["live_count"] + len(self.buffer)
+
+    def _doc_freq(self) -> np.ndarray:
+        """全部未删除文档（段 + 缓冲区）的 df"""
+        df = np.pad(self.df, (0, len(self.terms) - len(self.df)))
+        df[: len(self.buffer_df)] += self.buffer_df
+        return df
+
+    def _idf(self, query_ids: np.ndarray) -> np.ndarray:
+        """与 BM25Okapi 相同的 idf；epsilon 下限用全部出现过的词的平均 idf（缓存，写入/删除后重算）"""
+        count = len(self)
+        df = self._doc_freq()
+        if self._avg_idf is None:
+            present = df[df > 0]
+            self._avg_idf = float(np.mean(np.log(count - present + 0.5) - np.log(present + 0.5))) if len(present) else 0.0
+        df = df[query_ids]
+        idf = np.log(count - df + 0.5) - np.log(df + 0.5)
+        idf[idf < 0] = self.epsilon * self._avg_idf
+        return idf
+
+    def _id_locations(self) -> dict:
+        if self._locations is None:
+            self._locations = {segment.ids[row]: (segment, row)
+                               for segment in self.segments for row in segment.live_rows()}
+        return self._locations
+
+    # --- 写入 ---
+    def add(self, ids: list[str], texts: list[str], upsert: bool = True, max_workers: int = None):
+        """
+        写入文档；upsert=True 时已存在的 id 先删除旧版本（调用方确定都是新 id 时可以关掉，省去建 id 表）
+        写入的条数达到 buffer_size 时直接落盘成段，否则进缓冲区
+        """
+        if not ids:
+            return
+        if upsert:
+            self.delete(ids)
+        _, term_ids, lengths = encode_corpus(list(texts), self.tokenizer, vocab=self.vocab, max_workers=max_workers)
+        self.terms.extend(itertools.islice(self.vocab, len(self.terms), None))
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        docs = {doc_id: term_ids[offsets[i]: offsets[i + 1]] for i, doc_id in enumerate(ids)}
+        if len(docs) < self.buffer_size:
+            self._log([{"op": "add", "id": doc_id, "tokens": [self.terms[t] for t in tokens]}
+                       for doc_id, tokens in docs.items()])
+        for doc_id, tokens in docs.items():
+            self._buffer_put(doc_id, tokens)
+        self._avg_idf = None
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def delete(self, ids: list[str]) -> int:
+        """删除文档，返回实际删除的条数；段里的文档打删除标记并立即持久化"""
+        buffered = [doc_id for doc_id in ids if self._buffer_pop(doc_id)]
+        if buffered:
+            self._log([{"op": "delete", "id": doc_id} for doc_id in buffered])
+        dirty, removed = set(), 0
+        if self.segments:
+            locations = self._id_locations()
+            for doc_id in ids:
+                location = locations.pop(doc_id, None)
+                if location is None:
+                    continue
+                segment, row = location
+                segment.deleted[row] = True
+                tokens = segment.tokens(row)
+                self.df[np.unique(tokens)] -= 1
+                self.meta["live_count"] -= 1
+                self.meta["total_len"] -= len(tokens)
+                dirty.add(segment)
+                removed += 1
+        if dirty:
+            self._save_meta(dirty)
+        self._avg_idf = None
+        return removed + len(buffered)
+
+    def flush(self):
+        """缓冲区落盘成一个新段，然后按需合并"""
+        if not self.buffer:
+            return
+        ids = list(self.buffer)
+        lengths = np.fromiter(map(len, self.buffer.values()), dtype=np.int64, count=len(ids))
+        term_ids = np.concatenate(list(self.buffer.values()))
+        self._write_segment(ids, lengths, term_ids)
+        self.df = self._doc_freq()
+        self.buffer, self.buffer_df, self.buffer_len, self._buffer_segment = {}, np.zeros(0, dtype=np.int64), 0, None
+        self._save_meta()
+        open(os.path.join(self.directory, BUFFER_LOG), "w").close()
+        self._maybe_merge()
+
+    def _write_segment(self, ids, lengths, term_ids, replaces=()) -> Segment:
+        segment = Segment.build(f"seg_{self.meta['next_segment']:06d}", ids, lengths, term_ids, len(self.terms))
+        segment.save(self.directory)
+        self.meta["next_segment"] += 1
+        first = min((self.segments.index(s) for s in replaces), default=len(self.segments))
+        self.segments = [s for s in self.segments if s not in replaces]
+        self.segments.insert(first, segment)
+        if not replaces:
+            self.meta["live_count"] += len(ids)
+            self.meta["total_len"] += int(lengths.sum())
+        if self._locations is not None:
+            self._locations.update((doc_id, (segment, row)) for row, doc_id in enumerate(ids))
+        return segment
+
+    def merge(self, segments: list[Segment]):
+        """把几个段的未删除文档合并成一个新段（用保存的词 id 流重建，不重新分词）"""
+        ids, lengths, term_ids = [], [], []
+        for segment in segments:
+            rows = segment.live_rows()
+            ids.extend(segment.ids[row] for row in rows)
+            lengths.append(np.asarray(segment.doc_len)[rows])
+            term_ids.extend(segment.tokens(row) for row in rows)
+        term_ids = np.concatenate(term_ids) if term_ids else np.empty(0, dtype=np.int32)
+        self._write_segment(ids, np.concatenate(lengths).astype(np.int64), term_ids, replaces=segments)
+        self._save_meta()
+        for segment in segments:
+            shutil.rmtree(os.path.join(self.directory, segment.name))
+
+    def _maybe_merge(self):
+        """按数量级分层（buffer_size、×merge_factor、×merge_factor² ...），某一层的段够 merge_factor 个就合并"""
+        while True:
+            levels = {}
+            for segment in self.segments:
+                size = max(segment.live_count, 1) / self.buffer_size
+                levels.setdefault(max(0, int(math.log(size, self.merge_factor))) if size > 1 else 0,
+                                  []).append(segment)
+            full = [group for group in levels.values() if len(group) >= self.merge_factor]
+            if not full:
+                return
+            self.merge(full[0][: self.merge_factor])
+
+    def force_merge(self):
+        """合并成一个段（同时清掉所有删除标记），适合在批量导入结束后调用"""
+        self.flush()
+        if len(self.segments) > 1 or any(segment.deleted.any() for segment in self.segments):
+            self.merge(list(self.segments))
+
+    def sync(self, documents, max_workers: int = None) -> dict:
+        """
+        与向量库对齐：documents 是向量库里的全部文本块（例如 VectorIndex.documents()）
+        只为新增的 id 分词写入，删除向量库里已经没有的 id；返回 {"added", "deleted"}
+        """
+        wanted = {document_id(doc): doc.page_content for doc in documents}
+        existing = set(self._id_locations()) | set(self.buffer)
+        to_delete = [doc_id for doc_id in existing if doc_id not in wanted]
+        to_add = [doc_id for doc_id in wanted if doc_id not in existing]
+        self.delete(to_delete)
+        self.add(to_add, [wanted[doc_id] for doc_id in to_add], upsert=False, max_workers=max_workers)
+        self.flush()
+        return {"added": len(to_add), "deleted": len(to_delete)}
+
+    # --- 检索 ---
+    def search(self, query: str, k: int = 10) -> list[tuple[str, float]]:
+        """top-k 的 (文档 id, 分数)，按分数从高到低；只返回至少命中一个查询词的文档"""
+        query_ids = np.fromiter((self.vocab[token] for token in self.tokenizer(query) if token in self.vocab),
+                                dtype=np.int64)
+        if not len(self) or not len(query_ids):
+            return []
+        idf = self._idf(query_ids)
+        avgdl = (self.meta["total_len"] + self.buffer_len) / len(self)
+        candidates = []
+        for segment in self._searchable_segments():
+            rows, scores = segment.score(query_ids, idf, max(avgdl, 1e-9), self.k1, self.b, k)
+            candidates.extend((segment.ids[row], float(score)) for row, score in zip(rows, scores))
+        candidates.sort(key=lambda item: -item[1])
+        return candidates[:k]
+
+    def batch_search(self, queries: list[str], k: int = 10) -> list[list[tuple[str, float]]]:
+        return [self.search(query, k) for query in queries]
+
+    def _searchable_segments(self) -> list[Segment]:
+        if not self.buffer:
+            return self.segments
+        if self._buffer_segment is None:
+            lengths = np.fromiter(map(len, self.buffer.values()), dtype=np.int64, count=len(self.buffer))
+            self._buffer_segment = Segment.build("buffer", list(self.buffer), lengths,
+                                                 np.concatenate(list(self.buffer.values())), len(self.terms))
+        return self.segments + [self._buffer_segment]
+
+
+# --- 测试代码块：大索引上追加 / 删除少量文档的耗时，以及与整体重建的打分一致性 ---
+if __name__ == '__main__':
+    import tempfile
+
+    from R2_Retrieval_Optimization.sparse_bm25 import SparseBM25
+
+    rng = np.random.default_rng(0)
+    vocab_size = 50_000
+    words = [f"w{i}" for i in range(vocab_size)]
+
+    def make_texts(count):
+        sampled = np.minimum(rng.zipf(1.2, (count, 40)) + 99, vocab_size - 1).tolist()
+        return [" ".join(words[i] for i in row) for row in sampled]
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = SegmentedBM25(directory, tokenizer=MixedTokenizer(stopwords=()), buffer_size=10000)
+        texts = {f"doc-{i}": text for i, text in enumerate(make_texts(200_000))}
+        start = time.perf_counter()
+        index.add(list(texts), list(texts.values()), upsert=False)
+        index.flush()
+        print(f"初始写入 {len(texts)} 个文档: {time.perf_counter() - start:.1f}s，{len(index.segments)} 个段")
+
+        new = {f"new-{i}": text for i, text in enumerate(make_texts(1000))}
+        start = time.perf_counter()
+        index.add(list(new), list(new.values()))
+        index.flush()
+        removed = index.delete([f"doc-{i}" for i in range(0, 200_000, 1000)])
+        print(f"追加 1000 个 + 删除 {removed} 个: {time.perf_counter() - start:.2f}s，{len(index.segments)} 个段")
+        texts.update(new)
+        for i in range(0, 200_000, 1000):
+            del texts[f"doc-{i}"]
+
+        reopened = SegmentedBM25(directory)
+        reference = SparseBM25([text.split() for text in texts.values()])
+        doc_ids = list(texts)
+        query = " ".join(words[i] for i in (120, 350, 4000))
+        start = time.perf_counter()
+        hits = reopened.search(query, 5)
+        print(f"查询: {(time.perf_counter() - start) * 1000:.1f}ms")
+        # 同分的文档先后顺序可能不同，逐个比较命中文档在整体重建的索引里的分数
+        expected = reference.get_scores(query.split())
+        rows = {doc_id: row for row, doc_id in enumerate(doc_ids)}
+        print("与整体重建一致:", np.allclose([score for _, score in hits],
+                                             [expected[rows[doc_id]] for doc_id, _ in hits], atol=1e-4),
+              np.isclose(hits[0][1], expected.max(), atol=1e-4))
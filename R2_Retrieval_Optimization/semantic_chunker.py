@@ -0,0 +1,220 @@
+# 文件名: semantic_chunker.py
+# 语义分块：不按固定长度切，而是在“话题发生变化”的地方切。
+#   1. 把文本切成句子（只记录偏移量）
+#   2. 一次性把一批页面的所有句子送去向量化（配合 CachedEmbeddings / EmbeddingScheduler 自动组批、缓存）
+#   3. 用 NumPy 前缀和计算每个句子前后滑动窗口的平均向量，相邻窗口的余弦距离就是“话题变化程度”
+#   4. 距离超过阈值（分位数 / 标准差 / 四分位距）的位置作为断点，再按最大块长度合并句子。
+#      阈值按每页（每个文本）自己的距离分布计算：一页的分块只取决于这一页，改动其他页不会让它的块边界和 chunk ID 变化
+# 可以直接作为 splitter 传给 index_builder.build_or_update_vector_db / ingestion_pipeline.run_ingestion。
+
+import re
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import TextSplitter
+
+from R6_System_Optimization.embedding_cache import model_namespace
+from R6_System_Optimization.text_splitter import FastTextSplitter
+
+# 句子结束位置：中文句末标点（可带后引号/括号）、英文句号后跟空白、空行。
+# PDF 提取的文本每行末尾都有换行，单个换行不算句子结束
+SENTENCE_END = re.compile(r"[。！？；!?]+[”’」』）)]*|\.(?=\s)|\n\s*\n")
+
+
+def split_sentences(text: str) -> list[tuple[int, int]]:
+    """把文本切成句子，返回每个句子的 (起点, 终点)，已去掉首尾空白"""
+    spans = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        spans.append((start, match.end()))
+        start = match.end()
+    spans.append((start, len(text)))
+    result = []
+    for s, e in spans:
+        while s < e and text[s].isspace():
+            s += 1
+        while e > s and text[e - 1].isspace():
+            e -= 1
+        if e > s:
+            result.append((s, e))
+    return result
+
+
+def window_distances(vectors: np.ndarray, buffer_size: int = 1) -> np.ndarray:
+    """
+    计算相邻句子之间的语义距离
+    vectors: (句子数, 维度) 的单位向量
+    buffer_size (int): 窗口半径，第 i 个距离比较的是句子 [i-b+1, i] 与 [i+1, i+b] 两个窗口的平均向量
+    返回: 长度为 句子数-1 的数组，distances[i] 越大，越适合在句子 i 之后断开
+    """
+    n = len(vectors)
+    if n < 2:
+        return np.zeros(0, dtype=np.float32)
+    prefix = np.zeros((n + 1, vectors.shape[1]), dtype=np.float64)
+    np.cumsum(vectors, axis=0, out=prefix[1:])
+    cut = np.arange(1, n)  # 在第 cut 个句子之前断开
+    left = prefix[cut] - prefix[np.maximum(cut - buffer_size, 0)]
+    right = prefix[np.minimum(cut + buffer_size, n)] - prefix[cut]
+    left /= np.linalg.norm(left, axis=1, keepdims=True) + 1e-12
+    right /= np.linalg.norm(right, axis=1, keepdims=True) + 1e-12
+    return (1.0 - np.einsum("ij,ij->i", left, right)).astype(np.float32)
+
+
+def breakpoint_threshold(distances: np.ndarray, threshold_type: str = "percentile", amount: float = None) -> float:
+    """根据所有距离的分布计算断点阈值"""
+    if len(distances) == 0:
+        return float("inf")
+    if threshold_type == "percentile":
+        return float(np.percentile(distances, 95 if amount is None else amount))
+    if threshold_type == "standard_deviation":
+        return float(distances.mean() + (3 if amount is None else amount) * distances.std())
+    if threshold_type == "interquartile":
+        q1, q3 = np.percentile(distances, [25, 75])
+        return float(distances.mean() + (1.5 if amount is None else amount) * (q3 - q1))
+    raise ValueError(f"未知的 threshold_type: {threshold_type}")
+
+
+class SemanticChunker(TextSplitter):
+    """
+    基于句向量的语义分块器
+    embeddings: 任何 LangChain Embeddings，建议用 CachedEmbeddings 包装，重复建库时不再重复计算
+    buffer_size (int): 滑动窗口半径，越大越不容易被单个离题句子触发断点
+    threshold_type (str): "percentile" / "standard_deviation" / "interquartile"
+    threshold_amount (float): 对应阈值的参数，默认分别为 95 分位、3 倍标准差、1.5 倍四分位距
+    max_chunk_size (int): 单个块的最大长度，超过时即使没有断点也会切开
+    min_chunk_size (int): 单个块的最小长度，不足时忽略断点继续合并
+    length_unit (str) / tokenizer: 块长度的计算方式，同 FastTextSplitter
+    page_window (int): 流水线中每次一起处理多少页：同一窗口内的句子一次向量化；阈值仍按页各自计算，不影响分块结果
+    """
+    def __init__(self, embeddings: Embeddings, buffer_size: int = 1, threshold_type: str = "percentile",
+                 threshold_amount: float = None, max_chunk_size: int = 1000, min_chunk_size: int = 100,
+                 page_window: int = 32, length_unit: str = "char", tokenizer=None, **kwargs):
+        # 没有任何断点又超长的句子，交给普通切分器硬切；长度的计算方式也与它保持一致
+        self._fallback = FastTextSplitter(chunk_size=max_chunk_size, chunk_overlap=0, length_unit=length_unit,
+                                          tokenizer=tokenizer)
+        super().__init__(chunk_size=max_chunk_size, chunk_overlap=0,
+                         length_function=self._fallback._length_function, **kwargs)
+        breakpoint_threshold(np.ones(1), threshold_type)  # 尽早检查参数
+        self.embeddings = embeddings
+        self.buffer_size = buffer_size
+        self.threshold_type = threshold_type
+        self.threshold_amount = threshold_amount
+        self.min_chunk_size = min_chunk_size
+        self.page_window = page_window
+        self.length_unit = length_unit
+
+    def config(self) -> dict:
+        """写入索引清单的参数；换了 Embedding 模型，分块结果也会变"""
+        return {
+            "class": type(self).__name__,
+            "embeddings": model_namespace(self.embeddings),
+            "buffer_size": self.buffer_size,
+            "threshold_type": self.threshold_type,
+            "threshold_amount": self.threshold_amount,
+            "max_chunk_size": self._chunk_size,
+            "min_chunk_size": self.min_chunk_size,
+            "threshold_scope": "page",  # 早期版本按 page_window 整个窗口算阈值，分块结果不同
+            "length_unit": self.length_unit,
+        }
+
+    def _embed_sentences(self, texts: list[str], spans_list: list[list[tuple[int, int]]]) -> list[np.ndarray]:
+        """所有文本的句子只调用一次 embed_documents，返回每个文本的单位向量矩阵"""
+        sentences = [text[s:e] for text, spans in zip(texts, spans_list) for s, e in spans]
+        if not sentences:
+            return [np.zeros((0, 0), dtype=np.float32) for _ in texts]
+        vectors = np.asarray(self.embeddings.embed_documents(sentences), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        result, offset = [], 0
+        for spans in spans_list:
+            result.append(vectors[offset: offset + len(spans)])
+            offset += len(spans)
+        return result
+
+    def split_offsets_batch(self, texts: list[str]) -> list[list[tuple[int, int]]]:
+        """
+        对一批文本做语义分块，返回每个文本的块偏移量列表
+        整批的句子一次向量化，阈值按每个文本自己的距离分布计算，结果与逐个文本调用相同
+        """
+        spans_list = [split_sentences(text) for text in texts]
+        vectors_list = self._embed_sentences(texts, spans_list)
+        result = []
+        for text, spans, vectors in zip(texts, spans_list, vectors_list):
+            distances = window_distances(vectors, self.buffer_size)
+            threshold = breakpoint_threshold(distances, self.threshold_type, self.threshold_amount)
+            result.append(self._merge(text, spans, distances > threshold))
+        return result
+
+    def _merge(self, text: str, spans: list[tuple[int, int]], breaks: np.ndarray) -> list[tuple[int, int]]:
+        """按断点和长度上限把句子合并成块；breaks[i] 表示句子 i 之后是断点"""
+        chunks = []
+        chunk_start = None
+        for i, (s, e) in enumerate(spans):
+            if self._length_function(text[s:e]) > self._chunk_size:
+                # 单个句子就超长：先结束当前块，再把这个句子硬切
+                if chunk_start is not None:
+                    chunks.append((chunk_start, spans[i - 1][1]))
+                    chunk_start = None
+                chunks.extend((s + a, s + b) for a, b in self._fallback.split_offsets(text[s:e]))
+                continue
+            if chunk_start is not None and self._length_function(text[chunk_start:e]) > self._chunk_size:
+                chunks.append((chunk_start, spans[i - 1][1]))
+                chunk_start = None
+            if chunk_start is None:
+                chunk_start = s
+            is_break = i < len(breaks) and breaks[i]
+            if is_break and self._length_function(text[chunk_start:e]) >= self.min_chunk_size:
+                chunks.append((chunk_start, e))
+                chunk_start = None
+        if chunk_start is not None:
+            chunks.append((chunk_start, spans[-1][1]))
+        return chunks
+
+    def split_text(self, text: str) -> list[str]:
+        return [text[s:e] for s, e in self.split_offsets_batch([text])[0]]
+
+    def split_document_groups(self, documents: list[Document]) -> list[list[Document]]:
+        """对一批文档分块，按输入顺序返回每个文档各自的块（流水线需要按页分配 chunk ID）"""
+        texts = [doc.page_content for doc in documents]
+        groups = []
+        for doc, offsets in zip(documents, self.split_offsets_batch(texts)):
+            chunks = []
+            for s, e in offsets:
+                metadata = dict(doc.metadata)
+                if self._add_start_index:
+                    metadata["start_index"] = s
+                chunks.append(Document(page_content=doc.page_content[s:e], metadata=metadata))
+            groups.append(chunks)
+        return groups
+
+    def split_documents(self, documents) -> list[Document]:
+        documents = list(documents)
+        return [chunk for group in self.split_document_groups(documents) for chunk in group]
+
+    def create_documents(self, texts: list[str], metadatas: list[dict] = None) -> list[Document]:
+        metadatas = metadatas or [{}] * len(texts)
+        return self.split_documents([Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)])
+
+
+# --- 测试代码块：对 R1 的论文做语义分块，并与递归切分器对比 ---
+if __name__ == '__main__':
+    import os
+    import time
+    from local_model import get_embedding_model
+    from R6_System_Optimization.embedding_cache import CachedEmbeddings
+    from R6_System_Optimization.pdf_loader import load_pdfs
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    docs = load_pdfs(os.path.join(root, "R1_Evaluation_Framework", "PDF"))
+    embedding = CachedEmbeddings(get_embedding_model())
+    chunker = SemanticChunker(embedding, buffer_size=2, max_chunk_size=800)
+
+    start = time.perf_counter()
+    chunks = chunker.split_documents(docs)
+    print(f"{len(docs)} 页 -> {len(chunks)} 个语义块，耗时 {time.perf_counter() - start:.2f}s")
+    print(embedding.report())
+    lengths = [len(c.page_content) for c in chunks]
+    print(f"块长度: 最小 {min(lengths)}，平均 {sum(lengths) / len(lengths):.0f}，最大 {max(lengths)}")
+    for chunk in chunks[:3]:
+        print("-" * 50)
+        print(chunk.page_content)
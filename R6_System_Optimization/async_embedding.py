@@ -0,0 +1,221 @@
+# 文件名: async_embedding.py
+# 直接调用 OpenAI 兼容 /embeddings 接口的远程 Embedding 客户端，替代默认构建的 OpenAIEmbeddings：
+#   - 复用一个持久的 httpx 连接池（HTTP keep-alive），不必每次请求都重新握手
+#   - aembed_documents / aembed_query 是真正的异步实现，FastAPI 的 async 路由里调用不会阻塞事件循环；
+#     异步请求统一跑在客户端自己的事件循环线程上，调用方换了事件循环（多次 asyncio.run）也只有一个连接池
+#   - 一批文本按 chunk_size 切成多个请求并发发送，max_in_flight 限制同时在途的请求数
+#   - 连接 / 读取分别设置超时，429 / 5xx / 网络错误自动重试（指数退避）
+# AsyncRetriever 用 aembed_query 向量化查询，再在线程里查 Chroma，可以直接放进 LCEL 链或 RetrievalQA
+
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from R6_System_Optimization.embedding_batcher import RETRY_STATUS
+
+
+class AsyncEmbeddingClient(Embeddings):
+    """
+    OpenAI 兼容接口的 Embedding 客户端（Yovole 的 Qwen3-Embedding-8B、DashScope compatible-mode 等）
+    model (str): 模型名
+    api_key (str): API 密钥
+    base_url (str): 例如 https://ds-api.yovole.com/v1，请求发往 {base_url}/embeddings
+    chunk_size (int): 每个请求最多多少条文本
+    max_in_flight (int): 同时在途的请求数上限（同步和异步调用各自限制）
+    connect_timeout / read_timeout (float): 建立连接 / 等待响应的超时，秒
+    max_connections (int): 连接池大小
+    keepalive_expiry (float): 空闲连接保留多久，秒
+    max_retries (int): 可重试错误的最大重试次数
+    namespace_class (str): 它替代的 LangChain 类名，例如 "OpenAIEmbeddings"；只有请求与原来的客户端完全相同
+                           （同一个接口、同一个模型）时才可以设置，缓存和索引清单沿用原来的命名空间，不必重建索引。
+                           不要用它冒充 "DashScopeEmbeddings"：原生接口按 text_type 区分 query / document，
+                           compatible-mode 接口没有这个参数，查询向量不同
+    """
+    def __init__(self, model: str, api_key: str, base_url: str, chunk_size: int = 64, max_in_flight: int = 8,
+                 connect_timeout: float = 5.0, read_timeout: float = 60.0, max_connections: int = 32,
+                 keepalive_expiry: float = 60.0, max_retries: int = 3, namespace_class: str = None):
+        self.model = model
+        self.namespace_class = namespace_class
+        self.url = base_url.rstrip("/") + "/embeddings"
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.client_kwargs = {
+            "headers": {"Authorization": f"Bearer {api_key}"},
+            "timeout": httpx.Timeout(read_timeout, connect=connect_timeout),
+            "limits": httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                                   keepalive_expiry=keepalive_expiry),
+        }
+        self.client = httpx.Client(**self.client_kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        # httpx.AsyncClient 和 asyncio.Semaphore 都绑定在使用它们的事件循环上；
+        # 它们只在客户端自己的 IO 线程的事件循环里使用，第一次异步调用时创建
+        self._async_client = None
+        self._semaphore = None
+        self._io_loop = None
+        self._io_thread = None
+        self._io_lock = threading.Lock()
+
+    @property
+    def namespace(self) -> str:
+        return self.model
+
+    def _batches(self, texts: list[str]) -> list[list[str]]:
+        return [texts[i: i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+
+    @staticmethod
+    def _parse(response: httpx.Response) -> list[list[float]]:
+        data = sorted(response.json()["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+    def _should_retry(self, attempt: int, response: httpx.Response = None) -> bool:
+        return attempt < self.max_retries and (response is None or response.status_code in RETRY_STATUS)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return min(30.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+    # --- 同步接口：共享 httpx.Client，多个请求在线程池中并发 ---
+    def _post(self, texts: list[str]) -> list[list[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.client.post(self.url, json={"model": self.model, "input": texts})
+            except httpx.TransportError:
+                if not self._should_retry(attempt):
+                    raise
+            else:
+                if response.is_success:
+                    return self._parse(response)
+                if not self._should_retry(attempt, response):
+                    response.raise_for_status()
+            time.sleep(self._backoff(attempt))
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        batches = self._batches(texts)
+        if len(batches) == 1:
+            return self._post(batches[0])
+        return [vector for result in self.executor.map(self._post, batches) for vector in result]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._post([text])[0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """查询不加前缀，多条查询与文档一样合并请求"""
+        return self.embed_documents(texts)
+
+    # --- 异步接口：请求在客户端自己的事件循环线程上执行，调用方只 await 结果 ---
+    def _io(self) -> asyncio.AbstractEventLoop:
+        with self._io_lock:
+            if self._io_loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="embedding-io", daemon=True)
+                thread.start()
+                self._async_client = httpx.AsyncClient(**self.client_kwargs)
+                self._semaphore = asyncio.Semaphore(self.max_in_flight)
+                self._io_loop, self._io_thread = loop, thread
+            return self._io_loop
+
+    async def _run(self, coroutine):
+        """在 IO 线程的事件循环里执行，不阻塞调用方的事件循环；调用方取消时请求也一起取消"""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self._io()))
+
+    async def _apost(self, texts: list[str]) -> list[list[float]]:
+        client, semaphore = self._async_client, self._semaphore
+        for attempt in range(self.max_retries + 1):
+            async with semaphore:
+                try:
+                    response = await client.post(self.url, json={"model": self.model, "input": texts})
+                except httpx.TransportError:
+                    if not self._should_retry(attempt):
+                        raise
+                    response = None
+            if response is not None:
+                if response.is_success:
+                    return self._parse(response)
+                if not self._should_retry(attempt, response):
+                    response.raise_for_status()
+            await asyncio.sleep(self._backoff(attempt))  # 退避时不占用并发名额
+
+    async def _agather(self, texts: list[str]) -> list[list[float]]:
+        results = await asyncio.gather(*(self._apost(batch) for batch in self._batches(texts)))
+        return [vector for result in results for vector in result]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return await self._run(self._agather(texts))
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self._run(self._apost([text])))[0]
+
+    def _close_io(self):
+        with self._io_lock:
+            loop, thread, client = self._io_loop, self._io_thread, self._async_client
+            self._io_loop = self._io_thread = self._async_client = self._semaphore = None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    async def aclose(self):
+        """关闭异步连接池和 IO 线程（例如 FastAPI lifespan 结束时）；之后再调用异步接口会重新创建"""
+        await asyncio.to_thread(self._close_io)
+
+    def close(self):
+        self.client.close()
+        self.executor.shutdown(wait=False)
+        self._close_io()
+
+
+class AsyncRetriever(BaseRetriever):
+    """
+    先用 embeddings 向量化查询，再按向量查 vector_db
+    异步调用时查询向量化走 aembed_query，Chroma 的本地查询放到线程里，整个过程不阻塞事件循环
+    """
+    vector_db: object
+    embeddings: Embeddings
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        return self.vector_db.similarity_search_by_vector(self.embeddings.embed_query(query), k=self.k)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> list[Document]:
+        vector = await self.embeddings.aembed_query(query)
+        return await asyncio.to_thread(self.vector_db.similarity_search_by_vector, vector, k=self.k)
+
+
+# --- 测试代码块：同步串行 vs 异步并发 ---
+if __name__ == '__main__':
+    from local_model import get_async_embedding_model
+
+    client = get_async_embedding_model()
+    texts = [f"第 {i} 段测试文本：检索增强生成通过外部知识提升大模型回答的准确性。" for i in range(256)]
+
+    start = time.perf_counter()
+    for text in texts[:16]:
+        client.embed_query(text)
+    print(f"同步逐条 16 条: {time.perf_counter() - start:.2f}s")
+
+    async def main():
+        start = time.perf_counter()
+        await asyncio.gather(*(client.aembed_query(text) for text in texts[:16]))
+        print(f"异步并发 16 条: {time.perf_counter() - start:.2f}s")
+        start = time.perf_counter()
+        vectors = await client.aembed_documents(texts)
+        print(f"异步批量 {len(vectors)} 条: {time.perf_counter() - start:.2f}s，维度 {len(vectors[0])}")
+        await client.aclose()
+
+    asyncio.run(main())
@@ -0,0 +1,183 @@
+# 文件名: dim_reduction.py
+# 向量降维：Qwen3-Embedding-8B 输出 4096 维，索引体积和每次相似度计算都很大。
+#   - Matryoshka 截断：直接取前 d 维再归一化（Qwen3-Embedding 等用 MRL 训练的模型，前几百维就保留了大部分信息）
+#   - PCA 投影：在语料向量上拟合主成分，投影到 d 维，适用于任何模型
+# ReducedEmbeddings 包装任意 Embeddings，文档和查询走同一个投影，可以直接传给 build_or_update_vector_db；
+# 清单里的模型名和维度会随之变化，与全维度索引不会混用。
+# recall_report 用 R1 的黄金数据集比较各方案的 召回率 与 存储体积。
+
+import hashlib
+import json
+import os
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from R6_System_Optimization.embedding_cache import embed_queries, model_namespace
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / (np.linalg.norm(vectors, axis=-1, keepdims=True) + 1e-12)
+
+
+class MatryoshkaProjection:
+    """取前 dim 维并重新归一化"""
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    @property
+    def name(self) -> str:
+        return f"mrl{self.dim}"
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        return _normalize(np.asarray(vectors, dtype=np.float32)[..., :self.dim])
+
+
+class PCAProjection:
+    """在一批语料向量上拟合的 PCA 投影，可以保存/加载，保证建库和查询用的是同一个投影"""
+    def __init__(self, mean: np.ndarray, components: np.ndarray):
+        self.mean = mean.astype(np.float32)
+        self.components = components.astype(np.float32)  # (dim, 原始维度)
+        self.dim = len(components)
+
+    @classmethod
+    def fit(cls, vectors, dim: int) -> "PCAProjection":
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        if dim > min(vectors.shape):
+            raise ValueError(f"PCA 维度 {dim} 不能超过 样本数/原始维度 {vectors.shape}")
+        mean = vectors.mean(axis=0)
+        # 只需要前 dim 个右奇异向量；样本数远小于维度时 SVD 仍然很快
+        _, _, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+        return cls(mean, vt[:dim])
+
+    @property
+    def name(self) -> str:
+        # 不同语料拟合出来的投影不同，用投影矩阵的哈希区分
+        digest = hashlib.sha1(self.components[:, :64].tobytes()).hexdigest()[:8]
+        return f"pca{self.dim}-{digest}"
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        return _normalize((vectors - self.mean) @ self.components.T)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(path, mean=self.mean, components=self.components)
+
+    @classmethod
+    def load(cls, path: str) -> "PCAProjection":
+        data = np.load(path)
+        return cls(data["mean"], data["components"])
+
+
+class ReducedEmbeddings(Embeddings):
+    """
+    对底层模型的输出做降维，文档和查询使用同一个投影
+    base: 底层 Embedding 模型，建议先包一层 CachedEmbeddings，这样换维度时不必重新调用模型
+    projection: MatryoshkaProjection 或 PCAProjection
+    """
+    def __init__(self, base: Embeddings, projection):
+        # 属性名不用 embeddings：unwrap_embeddings 会剥掉名为 embeddings 的包装层，降维后的向量不能和原始向量共用缓存
+        self.base = base
+        self.projection = projection
+
+    @property
+    def namespace(self) -> str:
+        return f"{model_namespace(self.base)}|{self.projection.name}"
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return self.projection.transform(self.base.embed_documents(texts)).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.projection.transform(self.base.embed_query(text)).tolist()
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return self.projection.transform(embed_queries(self.base, texts)).tolist()
+
+
+def _tokens(text: str) -> set:
+    # 中文按字、英文按词，粗略判断两段文本是否讲同一件事
+    return set(text.lower().split()) | {ch for ch in text if "一" <= ch <= "鿿"}
+
+
+def golden_relevance(chunks: list[str], contexts: list[str], min_overlap: float = 0.6) -> set:
+    """黄金上下文的词有 min_overlap 以上出现在某个文本块里，就认为该块相关"""
+    relevant = set()
+    for context in contexts:
+        context_tokens = _tokens(context)
+        if not context_tokens:
+            continue
+        for i, chunk in enumerate(chunks):
+            if len(context_tokens & _tokens(chunk)) / len(context_tokens) >= min_overlap:
+                relevant.add(i)
+    return relevant
+
+
+def recall_report(embedding_model: Embeddings, chunks: list[str], golden_path: str, dims=(256, 512, 1024),
+                  k: int = 10) -> list[dict]:
+    """
+    比较 全维度 / Matryoshka 截断 / PCA 投影 在各维度下的检索效果和存储体积
+    只调用一次底层模型：所有方案都由同一批全维度向量投影得到
+    返回每个方案一行: {"method", "dim", "bytes_per_vector", "gb_per_million", "overlap@k", "hit@k"}
+      overlap@k: 与全维度检索 top-k 的重合比例；hit@k: top-k 中包含黄金上下文的问题比例
+    """
+    with open(golden_path, "r", encoding="utf-8") as f:
+        golden = [json.loads(line) for line in f]
+    doc_vectors = _normalize(np.asarray(embedding_model.embed_documents(chunks), dtype=np.float32))
+    query_vectors = _normalize(np.asarray([embedding_model.embed_query(item["question"]) for item in golden],
+                                          dtype=np.float32))
+    relevant = [golden_relevance(chunks, item.get("ground_truth_contexts", [])) for item in golden]
+    full_dim = doc_vectors.shape[1]
+
+    def top_k(docs, queries):
+        scores = queries @ docs.T
+        return np.argsort(-scores, axis=1)[:, :k]
+
+    reference = top_k(doc_vectors, query_vectors)
+    options = [("full", None)]
+    for dim in dims:
+        if dim < full_dim:
+            options.append(("matryoshka", MatryoshkaProjection(dim)))
+            if dim <= min(doc_vectors.shape):
+                options.append(("pca", PCAProjection.fit(doc_vectors, dim)))
+
+    rows = []
+    for method, projection in options:
+        if projection is None:
+            ranked, dim = reference, full_dim
+        else:
+            ranked, dim = top_k(projection.transform(doc_vectors), projection.transform(query_vectors)), projection.dim
+        overlap = np.mean([len(set(r) & set(ref)) / k for r, ref in zip(ranked, reference)])
+        judged = [(set(r), rel) for r, rel in zip(ranked, relevant) if rel]
+        hit = np.mean([bool(r & rel) for r, rel in judged]) if judged else float("nan")
+        rows.append({"method": method, "dim": dim, "bytes_per_vector": dim * 4,
+                     "gb_per_million": dim * 4 * 1e6 / 1024 ** 3, f"overlap@{k}": float(overlap), f"hit@{k}": float(hit)})
+    return rows
+
+
+def print_report(rows: list[dict]):
+    keys = list(rows[0])
+    print(" | ".join(f"{key:>16s}" for key in keys))
+    for row in rows:
+        print(" | ".join(f"{value:>16.3f}" if isinstance(value, float) else f"{str(value):>16s}" for value in row.values()))
+
+
+# --- 测试代码块：在 R1 的论文和黄金数据集上比较各降维方案 ---
+if __name__ == '__main__':
+    from local_model import get_embedding_model
+    from R6_System_Optimization.embedding_cache import CachedEmbeddings
+    from R6_System_Optimization.page_cache import load_chunks_cached
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    chunks = [doc.page_content for doc in load_chunks_cached(os.path.join(root, "R1_Evaluation_Framework", "PDF"))]
+    embedding = CachedEmbeddings(get_embedding_model())
+    print_report(recall_report(embedding, chunks, os.path.join(root, "R1_Evaluation_Framework", "golden_dataset.jsonl")))
+
+    # 建库时使用: 先在语料上拟合 PCA 并保存，建库和查询都加载同一个投影
+    # projection = PCAProjection.fit(embedding.embed_documents(chunks), 512)
+    # projection.save(os.path.join(root, ".cache", "pca512.npz"))
+    # build_or_update_vector_db(pdf_paths, db_dir, ReducedEmbeddings(embedding, projection))
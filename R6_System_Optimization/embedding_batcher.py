@@ -0,0 +1,273 @@
+# 文件名: embedding_batcher.py
+# 自适应并发的 Embedding 调度器，替换 “每批16个 + time.sleep(1)” 的写法：
+#   - 令牌桶限流：同时限制 每秒请求数 和 每分钟token数
+#   - 按 token 数自动组批：短文本一批多放，长文本一批少放
+#   - 多个请求同时在途；遇到 429 时把并发减半，连续成功后逐步恢复 (AIMD)
+#   - 429 / 5xx / 网络错误自动重试，指数退避 + 随机抖动
+#   - 统计吞吐量
+# 可以包装任何 LangChain Embeddings（DashScopeEmbeddings、local_model.get_embedding_model() 等）
+
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数：中日韩字符约 1 字 1 token，其余约 4 个字符 1 token"""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def get_status_code(error: BaseException):
+    """从不同 SDK 的异常里取出 HTTP 状态码，取不到返回 None"""
+    for attr in ("status_code", "http_status", "status"):
+        code = getattr(error, attr, None)
+        if isinstance(code, int):
+            return code
+    response = getattr(error, "response", None)
+    code = getattr(response, "status_code", None)
+    if isinstance(code, int):
+        return code
+    # DashScope 的异常只把状态码写在消息里，例如 "status_code: 429"
+    match = re.search(r"status[_ ]code\D{0,3}(\d{3})", str(error))
+    return int(match.group(1)) if match else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    code = get_status_code(error)
+    if code is not None:
+        return code in RETRY_STATUS
+    # 没有状态码的一般是超时、连接断开之类的网络错误
+    name = type(error).__name__.lower()
+    return any(key in name for key in ("timeout", "connection", "ratelimit"))
+
+
+class TokenBucket:
+    """令牌桶：以 rate 每秒的速度补充令牌，最多攒 capacity 个；acquire 在令牌不足时阻塞等待"""
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        # 单次请求超过桶容量时按容量计，否则永远等不到
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimit:
+    """可动态调整上限的并发闸门：被限流时上限减半，连续成功后加一"""
+    def __init__(self, max_limit: int):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.active = 0
+        self.successes = 0
+        self.cond = threading.Condition()
+
+    def __enter__(self):
+        with self.cond:
+            while self.active >= self.limit:
+                self.cond.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def on_success(self):
+        with self.cond:
+            self.successes += 1
+            if self.limit < self.max_limit and self.successes >= self.limit:
+                self.limit += 1
+                self.successes = 0
+                self.cond.notify_all()
+
+    def on_throttled(self):
+        with self.cond:
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+
+
+class EmbeddingScheduler(Embeddings):
+    """
+    包装一个 Embeddings，对 embed_documents 做 按token组批 + 限流 + 并发 + 重试
+    embeddings: 被包装的 Embedding 模型
+    max_in_flight (int): 最多同时在途的请求数
+    max_batch_size (int): 每个请求最多多少条文本（DashScope text-embedding-v1 上限为25）
+    max_batch_tokens (int): 每个请求最多多少 token
+    requests_per_second (float): 每秒请求数上限，None 表示不限
+    tokens_per_minute (float): 每分钟 token 上限，None 表示不限
+    max_retries (int): 单个批次最多重试次数
+    """
+    def __init__(self, embeddings: Embeddings, max_in_flight: int = 4, max_batch_size: int = 25,
+                 max_batch_tokens: int = 8000, requests_per_second: float = None, tokens_per_minute: float = None,
+                 max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 30.0,
+                 length_function=estimate_tokens):
+        self.embeddings = embeddings
+        self.max_in_flight = max_in_flight
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.length_function = length_function
+        self.request_bucket = TokenBucket(requests_per_second) if requests_per_second else None
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+        self.limit = AdaptiveLimit(max_in_flight)
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"requests": 0, "texts": 0, "tokens": 0, "retries": 0, "throttled": 0, "seconds": 0.0}
+
+    def make_batches(self, texts: list[str]) -> list[tuple[int, list[str], int]]:
+        """按条数和 token 数组批，返回 [(起始下标, 文本列表, token数), ...]"""
+        batches = []
+        start, batch, batch_tokens = 0, [], 0
+        for i, text in enumerate(texts):
+            tokens = self.length_function(text)
+            if batch and (len(batch) >= self.max_batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append((start, batch, batch_tokens))
+                start, batch, batch_tokens = i, [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append((start, batch, batch_tokens))
+        return batches
+
+    def _call_with_retry(self, func, payload, tokens: int):
+        for attempt in range(self.max_retries + 1):
+            if self.request_bucket:
+                self.request_bucket.acquire()
+            if self.token_bucket:
+                self.token_bucket.acquire(tokens)
+            try:
+                with self.limit:
+                    result = func(payload)
+                self.limit.on_success()
+                return result
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                with self.stats_lock:
+                    self.stats["retries"] += 1
+                    if get_status_code(e) == 429:
+                        self.stats["throttled"] += 1
+                if get_status_code(e) == 429:
+                    self.limit.on_throttled()
+                # 指数退避 + 全抖动，避免所有线程在同一时刻一起重试
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                time.sleep(random.uniform(0, delay))
+
+    def _embed_batch(self, batch: tuple) -> list[list[float]]:
+        _, texts, tokens = batch
+        vectors = self._call_with_retry(self.embeddings.embed_documents, texts, tokens)
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            self.stats["texts"] += len(texts)
+            self.stats["tokens"] += tokens
+        return vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        started = time.perf_counter()
+        batches = self.make_batches(texts)
+        results = [None] * len(texts)
+        if len(batches) == 1:
+            batch_results = [self._embed_batch(batches[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+                batch_results = list(executor.map(self._embed_batch, batches))
+        # 按起始下标放回原位，输出顺序与输入一致
+        for (start, batch_texts, _), vectors in zip(batches, batch_results):
+            results[start: start + len(batch_texts)] = list(vectors)
+        with self.stats_lock:
+            self.stats["seconds"] += time.perf_counter() - started
+        return results
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._call_with_retry(self.embeddings.embed_query, text, self.length_function(text))
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        from R6_System_Optimization.embedding_cache import embed_queries
+
+        tokens = sum(self.length_function(text) for text in texts)
+        return self._call_with_retry(lambda batch: embed_queries(self.embeddings, batch), texts, tokens)
+
+    def report(self) -> str:
+        """返回吞吐量报告"""
+        s = self.stats
+        seconds = s["seconds"] or 1e-9
+        return (f"请求 {s['requests']} 次，文本 {s['texts']} 条，约 {s['tokens']} token，"
+                f"重试 {s['retries']} 次（限流 {s['throttled']} 次），耗时 {s['seconds']:.2f}s，"
+                f"吞吐 {s['texts'] / seconds:.1f} 条/s，{s['tokens'] / seconds:.0f} token/s，"
+                f"当前并发上限 {self.limit.limit}/{self.max_in_flight}")
+
+
+# --- 测试代码块：启动一个本地的假 OpenAI 兼容 /v1/embeddings 服务，随机返回 429 ---
+if __name__ == '__main__':
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from langchain_openai import OpenAIEmbeddings
+
+    class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if random.random() < 0.2:
+                self.send_response(429)
+                self.end_headers()
+                return
+            time.sleep(0.05)  # 模拟网络和推理延迟
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            data = [{"object": "embedding", "index": i, "embedding": [float(len(str(t)) % 7), 1.0, 0.5]}
+                    for i, t in enumerate(inputs)]
+            payload = json.dumps({"object": "list", "data": data, "model": body.get("model"),
+                                  "usage": {"prompt_tokens": 0, "total_tokens": 0}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeEmbeddingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    remote = OpenAIEmbeddings(
+        model="fake-embedding",
+        openai_api_key="fake",
+        openai_api_base=f"http://127.0.0.1:{server.server_address[1]}/v1",
+        check_embedding_ctx_length=False,  # 假服务只接受原始文本
+        max_retries=0,  # 重试交给调度器
+    )
+    scheduler = EmbeddingScheduler(remote, max_in_flight=8, max_batch_size=16, requests_per_second=50)
+    texts = [f"第{i}个测试文本 " + "PCB " * (i % 50) for i in range(2000)]
+    vectors = scheduler.embed_documents(texts)
+    assert len(vectors) == len(texts)
+    assert all(v[0] == float(len(t) % 7) for v, t in zip(vectors, texts)), "输出顺序与输入不一致"
+    print("✅ 调度器测试成功")
+    print(scheduler.report())
+    server.shutdown()
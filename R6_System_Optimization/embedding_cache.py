@@ -0,0 +1,245 @@
+# 文件名: embedding_cache.py
+# 持久化的、按内容寻址的 Embedding 缓存，可以包装任何 LangChain Embeddings。
+#   key = sha256(模型名 + 规范化后的文本)，同一段文本无论在哪个实验脚本里出现，都只调用一次模型
+#   value = float16 / float32 的紧凑二进制，存放在 SQLite 中
+#   超过容量上限时按最近访问时间淘汰 (LRU)，并统计命中/未命中次数
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  ".cache", "embeddings.sqlite3")
+
+
+def normalize_text(text: str) -> str:
+    """NFKC 规范化并合并空白，全角/半角、多余空格不同的文本得到同一个 key"""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def unwrap_embeddings(embeddings):
+    """
+    剥掉调度器、缓存等包装层，取到真正计算向量的模型
+    只看有没有 .embeddings 属性，不要求内层是 LangChain Embeddings：HuggingFaceBGEEmbedding / OnnxEmbedding
+    不是 Embeddings 的子类，包在 EmbeddingScheduler 里时也必须剥到它们，否则不同模型会得到同一个命名空间
+    会改变向量的包装（如 dim_reduction.ReducedEmbeddings）不用 embeddings 这个属性名，也就不会被剥掉
+    """
+    inner = getattr(embeddings, "embeddings", None)
+    while inner is not None and inner is not embeddings:
+        embeddings = inner
+        inner = getattr(embeddings, "embeddings", None)
+    return embeddings
+
+
+def model_namespace(embeddings) -> str:
+    """
+    用类名 + 模型名区分不同模型的向量，换模型后不会读到旧模型的缓存
+    只由最内层的模型决定：缓存、调度器、进程池等包装层不改变命名空间，包装前后建的索引 / 缓存可以互相使用
+    """
+    embeddings = unwrap_embeddings(embeddings)
+    # 模型包装类可以提供 namespace 属性，把影响向量结果的参数（如是否归一化）也放进去；
+    # 注意 HuggingFaceBGEEmbedding.model 是模型对象而不是名字，只取字符串
+    for attr in ("namespace", "model", "model_name"):
+        name = getattr(embeddings, attr, None)
+        if isinstance(name, str) and name:
+            break
+    else:
+        name = ""
+    # 替代其他客户端、向量完全相同的类（例如 AsyncEmbeddingClient 替代 DashScopeEmbeddings）
+    # 用 namespace_class 沿用原来的类名，换客户端后缓存和已有索引的清单仍然可用
+    class_name = getattr(embeddings, "namespace_class", None) or type(embeddings).__name__
+    return f"{class_name}:{name}"
+
+
+# 查询和文档编码方式相同（查询不加前缀）的第三方模型，多条查询可以合并成一次 embed_documents
+SYMMETRIC_QUERY_MODELS = ("OpenAIEmbeddings",)
+
+
+def embed_queries(embeddings, texts: list[str]) -> list:
+    """
+    N 条查询一次向量化，结果与逐条 embed_query 相同
+    模型/包装层提供 embed_queries 时用它；查询与文档编码相同的模型直接 embed_documents；其他模型只能逐条调用
+    """
+    if not texts:
+        return []
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if type(embeddings).__name__ in SYMMETRIC_QUERY_MODELS:
+        return embeddings.embed_documents(texts)
+    return [embeddings.embed_query(text) for text in texts]
+
+
+class EmbeddingStore:
+    """基于 SQLite 的向量存储，按总字节数做 LRU 淘汰，可在多个线程间共享"""
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = 2 * 1024 ** 3):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, dtype TEXT NOT NULL, "
+            "nbytes INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: list[str]) -> dict:
+        """批量读取，返回 {key: np.ndarray(float32)}，并刷新命中条目的访问时间"""
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):  # SQLite 对参数个数有上限，分段查询
+                part = keys[i: i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self.conn.execute(
+                    f"SELECT key, vector, dtype FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                for key, blob, dtype in rows:
+                    found[key] = np.frombuffer(blob, dtype=dtype).astype(np.float32)
+            if found:
+                now = time.time()
+                self.conn.executemany("UPDATE embeddings SET last_access=? WHERE key=?",
+                                      [(now, key) for key in found])
+                self.conn.commit()
+        return found
+
+    def put_many(self, items: list[tuple[str, np.ndarray]], dtype: str = "float16"):
+        now = time.time()
+        rows = []
+        for key, vector in items:
+            blob = np.asarray(vector, dtype=dtype).tobytes()
+            rows.append((key, blob, dtype, len(blob), now))
+        with self.lock:
+            # 覆盖写入时先减掉旧条目的大小，保证 total_bytes 准确
+            for i in range(0, len(rows), 500):
+                part = [row[0] for row in rows[i: i + 500]]
+                placeholders = ",".join("?" * len(part))
+                old = self.conn.execute(
+                    f"SELECT COALESCE(SUM(nbytes), 0) FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchone()[0]
+                self.total_bytes -= old
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, dtype, nbytes, last_access) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.total_bytes += sum(row[3] for row in rows)
+            if self.total_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self.conn.commit()
+
+    def _evict(self, target_bytes: int):
+        """按最近访问时间从旧到新删除，直到总大小降到 target_bytes 以下"""
+        cursor = self.conn.execute("SELECT key, nbytes FROM embeddings ORDER BY last_access ASC")
+        to_delete = []
+        for key, nbytes in cursor:
+            if self.total_bytes <= target_bytes:
+                break
+            to_delete.append((key,))
+            self.total_bytes -= nbytes
+        self.conn.executemany("DELETE FROM embeddings WHERE key=?", to_delete)
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    给任意 Embeddings 加上磁盘缓存，只有真正没见过的文本才会调用底层模型
+    embeddings: 被包装的 Embedding 模型
+    cache_path (str): SQLite 缓存文件路径，多个脚本共用同一个文件即可共享缓存
+    namespace (str): 缓存命名空间，默认取 类名 + 模型名
+    dtype (str): 存储精度 "float16" 或 "float32"；未命中时返回的向量也按存储精度取整，与之后命中缓存时完全相同
+    max_bytes (int): 缓存容量上限，超出后按 LRU 淘汰
+    """
+    def __init__(self, embeddings: Embeddings, cache_path: str = DEFAULT_CACHE_PATH, namespace: str = None,
+                 dtype: str = "float16", max_bytes: int = 2 * 1024 ** 3, store: EmbeddingStore = None):
+        self.embeddings = embeddings
+        self.namespace = namespace or model_namespace(embeddings)
+        self.dtype = dtype
+        self.store = store or EmbeddingStore(cache_path, max_bytes=max_bytes)
+        self.stats = {"hits": 0, "misses": 0}
+        self.stats_lock = threading.Lock()
+
+    def _key(self, text: str, kind: str) -> str:
+        # 文档和查询分开缓存：有的模型对查询会加指令前缀，两者的向量不同
+        raw = f"{self.namespace}\x00{kind}\x00{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _as_stored(self, vector) -> list[float]:
+        """按存储精度取整后的向量：float16 缓存时，第一次计算和之后命中返回同样的值，结果不随缓存状态变化"""
+        return np.asarray(vector, dtype=self.dtype).astype(np.float32).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [self._key(text, "doc") for text in texts]
+        cached = self.store.get_many(list(dict.fromkeys(keys)))
+
+        # 同一批里重复的文本只计算一次
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.store.put_many(list(computed.items()), dtype=self.dtype)
+        else:
+            computed = {}
+
+        with self.stats_lock:
+            self.stats["misses"] += len(missing)
+            self.stats["hits"] += len(texts) - len(missing)
+
+        return [self._as_stored(computed[key]) if key in computed else cached[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self._key(text, "query")
+        cached = self.store.get_many([key])
+        if key in cached:
+            with self.stats_lock:
+                self.stats["hits"] += 1
+            return cached[key].tolist()
+        vector = self.embeddings.embed_query(text)
+        self.store.put_many([(key, vector)], dtype=self.dtype)
+        with self.stats_lock:
+            self.stats["misses"] += 1
+        return self._as_stored(vector)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """批量版的 embed_query：缓存未命中的查询合并成一次调用"""
+        keys = [self._key(text, "query") for text in texts]
+        cached = self.store.get_many(list(dict.fromkeys(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        computed = {}
+        if missing:
+            computed = dict(zip(missing.keys(), embed_queries(self.embeddings, list(missing.values()))))
+            self.store.put_many(list(computed.items()), dtype=self.dtype)
+        with self.stats_lock:
+            self.stats["misses"] += len(missing)
+            self.stats["hits"] += len(texts) - len(missing)
+        return [self._as_stored(computed[key]) if key in computed else cached[key].tolist() for key in keys]
+
+    def report(self) -> str:
+        total = self.stats["hits"] + self.stats["misses"]
+        rate = self.stats["hits"] / total if total else 0.0
+        return (f"缓存命中 {self.stats['hits']} 次，未命中 {self.stats['misses']} 次，命中率 {rate:.1%}，"
+                f"缓存条目 {self.store.count()}，约 {self.store.total_bytes / 1024 ** 2:.1f} MB")
@@ -0,0 +1,168 @@
+# 文件名: embedding_pool.py
+# 多进程的本地 Embedding 池：每个工作进程持有一份模型副本，并绑定到一组固定的CPU核上。
+# PyTorch 单进程的 intra-op 多线程在核数多时扩展性很差，改成 “多进程 × 每进程少量线程” 后，
+# 大批量重新向量化的吞吐量可以随核数近似线性增长。
+# 用法:
+#   with EmbeddingProcessPool(HuggingFaceBGEEmbedding, {"model_name": "BAAI/bge-small-en"}) as pool:
+#       vectors = pool.embed_documents(texts)
+
+import contextlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+_worker_model = None  # 工作进程内的模型副本
+_ready_barrier = None  # 启动预热时让每个进程各领一个任务
+
+
+def _init_worker(core_queue, ready_barrier, threads: int, factory, factory_kwargs: dict):
+    """工作进程启动时执行：绑定CPU核，再加载模型（线程数的环境变量由父进程在创建进程前设置好）"""
+    global _worker_model, _ready_barrier
+    _ready_barrier = ready_barrier
+    cores = core_queue.get()
+    if cores and hasattr(os, "sched_setaffinity"):  # 只有 Linux 支持绑核
+        os.sched_setaffinity(0, cores)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_model = factory(**factory_kwargs)
+
+
+def _embed_chunk(texts: list[str]) -> np.ndarray:
+    return np.asarray(_worker_model.embed_documents(texts), dtype=np.float32)
+
+
+def _worker_ready(timeout: float) -> str:
+    """
+    预热任务：在 barrier 上等齐所有进程再返回，每个进程只能领到一个，所以返回时每个进程都已经加载好模型
+    返回底层模型的 namespace
+    """
+    from R6_System_Optimization.embedding_cache import model_namespace
+    _ready_barrier.wait(timeout)
+    return model_namespace(_worker_model)
+
+
+@contextlib.contextmanager
+def _thread_env(threads: int):
+    """
+    临时设置线程数的环境变量：spawn 的子进程启动时复制父进程的环境，解封 initializer 参数时就会导入 numpy / torch，
+    在 initializer 里再设置已经晚了，只能在创建进程之前放进环境
+    """
+    saved = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+    os.environ.update({name: str(threads) for name in THREAD_ENV_VARS})
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def plan_cores(workers: int, threads_per_worker: int) -> list[list[int]]:
+    """把当前进程可用的CPU核均分给各工作进程，核不够时返回空列表（不绑核）"""
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    if len(available) < workers * threads_per_worker:
+        return [[] for _ in range(workers)]
+    return [available[i * threads_per_worker: (i + 1) * threads_per_worker] for i in range(workers)]
+
+
+class EmbeddingProcessPool(Embeddings):
+    """
+    多进程 Embedding 池
+    factory: 构建模型的可调用对象，必须能被 pickle（模块级的类或函数），例如 local_model.HuggingFaceBGEEmbedding
+    factory_kwargs (dict): 传给 factory 的参数
+    workers (int): 工作进程数，默认 CPU核数 / threads_per_worker
+    threads_per_worker (int): 每个进程的计算线程数
+    chunk_size (int): 每个任务包含多少条文本，太小进程间通信开销大，太大负载不均衡
+    start_timeout (float): 等待所有进程加载好模型的秒数
+    """
+    def __init__(self, factory, factory_kwargs: dict = None, workers: int = None, threads_per_worker: int = 4,
+                 chunk_size: int = 256, start_timeout: float = 600):
+        cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+        self.workers = workers or max(1, cpu_count // threads_per_worker)
+        self.threads_per_worker = threads_per_worker
+        self.chunk_size = chunk_size
+
+        # spawn 启动的子进程是干净的解释器，不会继承父进程里已经初始化好的 torch 线程池
+        context = multiprocessing.get_context("spawn")
+        core_queue = context.Queue()
+        for cores in plan_cores(self.workers, threads_per_worker):
+            core_queue.put(cores)
+        ready_barrier = context.Barrier(self.workers)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(core_queue, ready_barrier, threads_per_worker, factory, factory_kwargs or {}),
+        )
+        # 子进程在第一次提交任务时创建；预热任务在 barrier 上等齐，返回时每个进程都已经加载好模型。
+        # 类名和名字都沿用底层模型的（同 AsyncEmbeddingClient 的 namespace_class），
+        # 换成进程池不会改变缓存和索引清单里记录的模型
+        with _thread_env(threads_per_worker):
+            namespaces = list(self.executor.map(_worker_ready, [start_timeout] * self.workers))
+        self.namespace_class, self.namespace = namespaces[0].split(":", 1)
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """编码为 (条数, 维度) 的 float32 数组：按长度排序后切成若干块分给各进程，结果按原顺序拼回"""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))  # 长度相近的文本分到同一块，padding 少
+        chunks = [order[i: i + self.chunk_size] for i in range(0, len(order), self.chunk_size)]
+        results = self.executor.map(_embed_chunk, [[texts[i] for i in chunk] for chunk in chunks])
+        out = None
+        for chunk, vectors in zip(chunks, results):
+            if out is None:
+                out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[chunk] = vectors
+        return out
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """按 LangChain Embeddings 的约定返回 list[list[float]]；需要 NumPy 数组时直接调用 encode()"""
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.executor.submit(_embed_chunk, [text]).result()[0].tolist()
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_documents(texts)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- 测试代码块：对比单进程和多进程池的吞吐量 ---
+if __name__ == '__main__':
+    import time
+    from local_model import HuggingFaceBGEEmbedding
+    from R6_System_Optimization.page_cache import load_chunks_cached
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    texts = [doc.page_content for doc in load_chunks_cached(os.path.join(root, "R1_Evaluation_Framework", "PDF"))]
+    model_kwargs = {"model_name": "BAAI/bge-small-en", "normalize": True}
+
+    single = HuggingFaceBGEEmbedding(**model_kwargs)
+    start = time.perf_counter()
+    expected = single.embed_documents(texts)
+    print(f"单进程: {len(texts) / (time.perf_counter() - start):.1f} 条/s")
+
+    with EmbeddingProcessPool(HuggingFaceBGEEmbedding, model_kwargs) as pool:
+        start = time.perf_counter()
+        vectors = pool.encode(texts)
+        print(f"{pool.workers} 进程 × {pool.threads_per_worker} 线程: "
+              f"{len(texts) / (time.perf_counter() - start):.1f} 条/s")
+    assert np.allclose(expected, vectors, atol=1e-4), "多进程结果与单进程不一致"
@@ -0,0 +1,338 @@
+# 文件名: flat_index.py
+# 基于内存映射(np.memmap)的精确检索向量库，本仓库的语料规模下可以替代 Chroma：
+#   - 向量矩阵以 float32 / float16 原始二进制存放，打开时只映射文件，不读入内存，毫秒级就能用
+#   - 多个工作进程只读打开同一个目录时，共享操作系统的页缓存，内存里只有一份向量
+#   - 检索 = 一次 矩阵 × 向量 + argpartition 取 top-k，按块计算，float16 矩阵也不会整块展开
+#   - 提供与 Chroma 相同的 similarity_search / similarity_search_by_vector / as_retriever 接口
+# 目录结构:
+#   directory/
+#     flat_index.json   元数据：维度、精度、条数、Embedding 模型、已删除的行
+#     vectors.bin       (条数, 维度) 的向量矩阵，写入时已 L2 归一化，内积即余弦相似度
+#     docs.jsonl        每行一个 {"id", "text", "metadata"}
+#     offsets.bin       每行在 docs.jsonl 中的起始字节（int64），取 top-k 文档时只读这几行
+# 只支持单个进程写入；写入时先追加数据再替换元数据，读者看到的总是完整的前缀，调用 refresh() 可以看到新数据。
+
+import json
+import mmap
+import os
+import threading
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from R6_System_Optimization.embedding_cache import model_namespace
+from R6_System_Optimization.index_builder import IndexConfigMismatchError
+
+META_NAME = "flat_index.json"
+FLAT_INDEX_VERSION = 1
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / (np.linalg.norm(vectors, axis=-1, keepdims=True) + 1e-12)
+
+
+class FlatVectorStore(VectorStore):
+    """
+    精确检索的内存映射向量库
+    directory (str): 索引目录，不存在时在第一次写入时创建
+    embedding_model: 用于向量化查询/新文本；目录里记录的模型与它不一致时抛出 IndexConfigMismatchError
+    dtype (str): 新建索引时向量的存储精度 "float32" / "float16"，float16 体积减半
+    block_rows (int): 每次参与矩阵乘法的行数，限制 float16 转 float32 时的临时内存
+    on_mismatch (str): 目录里的模型与 embedding_model 不一致时，"error" 抛出异常，"rebuild" 清空后按当前模型重建
+    返回的分数是余弦距离 (1 - 余弦相似度)，越小越相似，与 Chroma 的距离同向
+    """
+    def __init__(self, directory: str, embedding_model=None, dtype: str = "float32", block_rows: int = 65536,
+                 on_mismatch: str = "error"):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"未知的 dtype: {dtype}")
+        self.directory = directory
+        self.embedding_model = embedding_model
+        self.block_rows = block_rows
+        self.lock = threading.Lock()
+        self._id_rows = None  # id -> 行号，删除/更新时才建立
+        self.meta = {"version": FLAT_INDEX_VERSION, "dim": None, "dtype": dtype, "count": 0, "docs_bytes": 0,
+                     "embedding_model": model_namespace(embedding_model) if embedding_model else None,
+                     "deleted": []}
+        self.refresh()
+        stored_model = self.meta.get("embedding_model")
+        if embedding_model is not None and stored_model and stored_model != model_namespace(embedding_model):
+            message = f"索引 '{directory}' 由 {stored_model!r} 构建，当前为 {model_namespace(embedding_model)!r}"
+            if on_mismatch != "rebuild":
+                raise IndexConfigMismatchError(message)
+            print(message + "，将清空后按当前模型重建")
+            self.clear()
+
+    @property
+    def embeddings(self):
+        return self.embedding_model
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def refresh(self):
+        """重新读取元数据并映射文件（其他进程写入了新数据后调用）"""
+        meta_path = self._path(META_NAME)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+            self._id_rows = None
+        count, dim = self.meta["count"], self.meta["dim"]
+        self.deleted = np.zeros(count, dtype=bool)
+        self.deleted[self.meta["deleted"]] = True
+        if count == 0:
+            self.vectors = np.empty((0, dim or 0), dtype=self.meta["dtype"])
+            self.offsets = np.empty(0, dtype=np.int64)
+            self.docs = b""
+            return
+        self.vectors = np.memmap(self._path("vectors.bin"), dtype=self.meta["dtype"], mode="r", shape=(count, dim))
+        self.offsets = np.memmap(self._path("offsets.bin"), dtype=np.int64, mode="r", shape=(count,))
+        with open(self._path("docs.jsonl"), "rb") as f:
+            self.docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return int(self.meta["count"] - len(self.meta["deleted"]))
+
+    def _record(self, row: int) -> dict:
+        end = self.offsets[row + 1] if row + 1 < len(self.offsets) else self.meta["docs_bytes"]
+        return json.loads(self.docs[self.offsets[row]: end])
+
+    def _document(self, row: int) -> Document:
+        record = self._record(row)
+        return Document(page_content=record["text"], metadata=record["metadata"], id=record["id"])
+
+    def _rows_by_id(self) -> dict:
+        if self._id_rows is None:
+            deleted = set(self.meta["deleted"])
+            self._id_rows = {self._record(row)["id"]: row for row in range(self.meta["count"]) if row not in deleted}
+        return self._id_rows
+
+    # --- 检索 ---
+    def _top_k(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """queries (条数, 维度) -> (行号, 相似度)，各为 (条数, k)，按相似度从高到低；行号 -1 表示空位（ANN 候选不足 k 条时）"""
+        queries = _normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        count = self.meta["count"]
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+        scores = np.empty((len(queries), count), dtype=np.float32)
+        for start in range(0, count, self.block_rows):
+            block = np.asarray(self.vectors[start: start + self.block_rows], dtype=np.float32)  # float32 时不复制
+            scores[:, start: start + len(block)] = queries @ block.T
+        scores[:, self.deleted] = -np.inf
+        rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(scores, rows, axis=1)
+        order = np.argsort(-top, axis=1)
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+    def similarity_search_by_vector_with_score(self, embedding, k: int = 4) -> list[tuple[Document, float]]:
+        """返回 [(Document, 余弦距离)]，距离越小越相似"""
+        rows, scores = self._top_k(np.asarray(embedding), k)
+        return [(self._document(row), float(1 - score)) for row, score in zip(rows[0], scores[0]) if row >= 0]
+
+    def similarity_search_by_vectors_with_score(self, embeddings, k: int = 4) -> list[list[tuple[Document, float]]]:
+        """批量检索：N 条查询向量与整个矩阵只做一次矩阵乘法，返回 N 个 top-k 列表"""
+        rows, scores = self._top_k(np.asarray(embeddings), k)
+        return [[(self._document(row), float(1 - score)) for row, score in zip(query_rows, query_scores) if row >= 0]
+                for query_rows, query_scores in zip(rows, scores)]
+
+    def similarity_search_by_vectors(self, embeddings, k: int = 4) -> list[list[Document]]:
+        return [[doc for doc, _ in results] for results in self.similarity_search_by_vectors_with_score(embeddings, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list[tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding_model.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, **kwargs) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        return lambda distance: 1.0 - distance
+
+    def iter_documents(self):
+        """按写入顺序逐个产出未删除的文档（不读向量）"""
+        for row in np.flatnonzero(~self.deleted):
+            yield self._document(row)
+
+    def get_by_ids(self, ids) -> list[Document]:
+        rows = self._rows_by_id()
+        return [self._document(rows[i]) for i in ids if i in rows]
+
+    # --- 写入 ---
+    def add_vectors(self, vectors, texts: list[str], metadatas: list[dict] = None, ids: list[str] = None) -> list[str]:
+        """写入已经算好的向量；ids 已存在时旧的那一行被标记删除（相当于 upsert）"""
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        if not len(texts):
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        with self.lock:
+            meta = self.meta
+            if meta["dim"] is None:
+                meta["dim"] = int(vectors.shape[1])
+            elif vectors.shape[1] != meta["dim"]:
+                raise IndexConfigMismatchError(f"向量维度 {vectors.shape[1]} 与索引的 {meta['dim']} 不一致")
+            self._delete_rows([row for row in map(self._rows_by_id().get, ids) if row is not None])
+
+            os.makedirs(self.directory, exist_ok=True)
+            lines = [json.dumps({"id": i, "text": t, "metadata": m or {}}, ensure_ascii=False).encode("utf-8") + b"\n"
+                     for i, t, m in zip(ids, texts, metadatas)]
+            offsets = meta["docs_bytes"] + np.cumsum([0] + [len(line) for line in lines[:-1]], dtype=np.int64)
+            # 只追加写到元数据记录的末尾；上次写到一半崩溃留下的尾巴会被截掉
+            self._unmap()
+            for name, data in (("vectors.bin", vectors.astype(meta["dtype"], copy=False).tobytes()),
+                               ("offsets.bin", offsets.tobytes()),
+                               ("docs.jsonl", b"".join(lines))):
+                with open(self._path(name), "ab") as f:
+                    if f.tell() > self._committed_bytes(name):
+                        f.truncate(self._committed_bytes(name))
+                    f.write(data)
+            start = meta["count"]
+            meta["count"] += len(texts)
+            meta["docs_bytes"] += sum(len(line) for line in lines)
+            self._save_meta()
+            rows = self._rows_by_id()
+            rows.update({i: start + n for n, i in enumerate(ids)})
+            self._remap(rows)
+        return ids
+
+    def _committed_bytes(self, name: str) -> int:
+        meta = self.meta
+        if name == "vectors.bin":
+            return meta["count"] * meta["dim"] * np.dtype(meta["dtype"]).itemsize
+        if name == "offsets.bin":
+            return meta["count"] * 8
+        return meta["docs_bytes"]
+
+    def _save_meta(self):
+        path = self._path(META_NAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def _unmap(self):
+        """写文件前释放本进程的映射（Windows 下文件被映射时不能截断/删除）"""
+        if isinstance(self.docs, mmap.mmap):
+            self.docs.close()
+        self.vectors = self.offsets = self.docs = None
+
+    def _remap(self, id_rows: dict = None):
+        """写入后重新映射文件，保留已经建立的 id -> 行号 表"""
+        self.refresh()
+        self._id_rows = id_rows
+
+    def add_texts(self, texts, metadatas: list[dict] = None, ids: list[str] = None, **kwargs) -> list[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_vectors(self.embedding_model.embed_documents(texts), texts, metadatas, ids)
+
+    def update_metadata(self, ids: list[str], metadata: dict):
+        """把 metadata 合并到已有的行上：按原向量重新追加一行（旧行标记删除），不调用 Embedding 模型"""
+        rows = [row for row in map(self._rows_by_id().get, ids) if row is not None]
+        if not rows:
+            return
+        records = [self._record(row) for row in rows]
+        self.add_vectors(np.asarray(self.vectors[rows], dtype=np.float32), [r["text"] for r in records],
+                         [{**r["metadata"], **metadata} for r in records], [r["id"] for r in records])
+
+    def _delete_rows(self, rows: list[int]):
+        if not rows:
+            return
+        id_rows = self._rows_by_id()
+        for row in rows:
+            id_rows.pop(self._record(row)["id"], None)
+        self.meta["deleted"] = sorted(set(self.meta["deleted"]) | set(map(int, rows)))
+        self.deleted[rows] = True
+
+    def delete(self, ids: list[str] = None, **kwargs) -> bool:
+        """标记删除（不立即回收空间，删除较多时调用 compact）"""
+        if not ids:
+            return False
+        with self.lock:
+            rows = [row for row in map(self._rows_by_id().get, ids) if row is not None]
+            self._delete_rows(rows)
+            self._save_meta()
+        return bool(rows)
+
+    def compact(self):
+        """重写索引文件，真正去掉已删除的行"""
+        with self.lock:
+            live = np.flatnonzero(~self.deleted)
+            vectors = np.asarray(self.vectors[live], dtype=np.float32)
+            records = [self._record(row) for row in live]
+            self._unmap()
+            for name in ("vectors.bin", "offsets.bin", "docs.jsonl"):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            self.meta.update(count=0, docs_bytes=0, deleted=[])
+            self._save_meta()
+            self._remap({})
+        self.add_vectors(vectors, [r["text"] for r in records], [r["metadata"] for r in records],
+                         [r["id"] for r in records])
+
+    def clear(self):
+        """删除全部数据，维度和模型按之后第一次写入的重新确定"""
+        with self.lock:
+            self._unmap()
+            for name in ("vectors.bin", "offsets.bin", "docs.jsonl"):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            self.meta.update(dim=None, count=0, docs_bytes=0, deleted=[],
+                             embedding_model=model_namespace(self.embedding_model) if self.embedding_model else None)
+            if os.path.isdir(self.directory):
+                self._save_meta()
+            self._remap({})
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, directory: str = None, **kwargs):
+        if directory is None:
+            raise ValueError("FlatVectorStore 需要指定 directory")
+        store = cls(directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+
+def export_chroma_to_flat(vector_db, directory: str, embedding_model=None, dtype: str = "float32",
+                          batch_size: int = 1000) -> FlatVectorStore:
+    """
+    把已有的 Chroma 库（连同已算好的向量和 chunk ID）导出为 FlatVectorStore，不需要重新调用 Embedding 模型
+    embedding_model 默认取 Chroma 库的 embedding_function
+    """
+    store = FlatVectorStore(directory, embedding_model or vector_db.embeddings, dtype=dtype)
+    offset = 0
+    while True:
+        result = vector_db._collection.get(include=["embeddings", "documents", "metadatas"],
+                                           limit=batch_size, offset=offset)
+        if len(result["ids"]):
+            store.add_vectors(result["embeddings"], result["documents"],
+                              [dict(m or {}) for m in result["metadatas"]], result["ids"])
+        if len(result["ids"]) < batch_size:
+            break
+        offset += batch_size
+    return store
+
+
+# --- 测试代码块：把 R1 的 Chroma 库导出为内存映射索引，对比打开耗时和检索结果 ---
+if __name__ == '__main__':
+    import time
+    from local_model import get_embedding_model
+    from R6_System_Optimization.embedding_cache import CachedEmbeddings
+    from R6_System_Optimization.index_builder import find_index_directory, load_vector_db
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    embedding = CachedEmbeddings(get_embedding_model())
+    flat_dir = os.path.join(root, "R1_Evaluation_Framework", "flat_index")
+    if not os.path.exists(os.path.join(flat_dir, META_NAME)):
+        chroma_dir = find_index_directory(os.path.join(root, "R1_Evaluation_Framework", "chroma_db"), embedding)
+        chroma_db = load_vector_db(chroma_dir, embedding)
+        export_chroma_to_flat(chroma_db, flat_dir)
+
+    start = time.perf_counter()
+    store = FlatVectorStore(flat_dir, embedding)
+    print(f"打开 {len(store)} 条向量耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+    for doc, distance in store.similarity_search_with_score("ARES系统的全称是什么？", k=5):
+        print(f"{distance:.4f} [p{doc.metadata.get('page')}] {doc.page_content[:80]!r}")
@@ -0,0 +1,468 @@
+# 文件名: index_builder.py
+# 所有脚本共用的索引构建/加载模块。
+# 增量构建：每个 chunk 使用由 (来源路径, 页码, 内容哈希) 生成的稳定ID，并在数据库目录里保存一个清单(manifest)，
+# PDF 改动后只重新向量化真正变化的 chunk，删除已经消失的 chunk。
+# 配置校验：清单里记录 Embedding 模型、向量维度、切分参数，加载时与当前配置比对，
+# 不一致时拒绝使用（或按要求重建），避免误用别的参数建出来的索引。
+# 距离：Chroma 集合用余弦距离（open_chroma），与 flat / ann 后端的排序一致；旧的 L2 集合打开时就地迁移。
+# 按配置分目录：index_directory / find_index_directory 把 chroma_db 映射到 chroma_db_<配置指纹>，
+# 不同模型、切分参数的索引各自一个目录，多个脚本共用 chroma_db 这个名字也不会互相覆盖。
+
+import hashlib
+import json
+import os
+import re
+
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from R6_System_Optimization.embedding_cache import model_namespace
+from R6_System_Optimization.ingestion_pipeline import run_ingestion
+from R6_System_Optimization.pdf_loader import iter_pdf_documents
+
+MANIFEST_NAME = "index_manifest.json"
+MANIFEST_VERSION = 2
+CHROMA_METADATA = {"hnsw:space": "cosine"}
+
+
+class IndexConfigMismatchError(ValueError):
+    """已有索引的构建配置与当前配置不一致"""
+
+
+def file_sha256(path: str) -> str:
+    """按块读取文件并计算 sha256，大文件也不会一次性读入内存"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def source_key(path: str) -> str:
+    """把来源路径规范化，保证同一个文件在 Windows / Linux 下得到同一个 key"""
+    return os.path.normpath(os.path.abspath(path)).replace("\\", "/")
+
+
+def make_chunk_id(source: str, page, content: str) -> str:
+    """由 来源路径 + 页码 + 内容哈希 生成稳定的 chunk ID，内容不变则ID不变"""
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+    source_hash = hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+    return f"{source_hash}-p{page}-{content_hash}"
+
+
+def assign_chunk_ids(chunks: list, source: str) -> list[str]:
+    """为切分后的 chunk 生成ID；同一页出现完全相同的内容时追加序号，避免ID冲突"""
+    ids = []
+    seen = {}
+    for chunk in chunks:
+        chunk_id = make_chunk_id(source, chunk.metadata.get("page", 0), chunk.page_content)
+        count = seen.get(chunk_id, 0)
+        seen[chunk_id] = count + 1
+        if count:
+            chunk_id = f"{chunk_id}-{count}"
+        chunk.metadata["chunk_id"] = chunk_id
+        ids.append(chunk_id)
+    return ids
+
+
+def load_manifest(persist_directory: str) -> dict:
+    path = os.path.join(persist_directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(persist_directory: str, manifest: dict):
+    """先写临时文件再替换，防止中途崩溃留下半个清单"""
+    os.makedirs(persist_directory, exist_ok=True)
+    path = os.path.join(persist_directory, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def chroma_space(vector_db: Chroma) -> str:
+    """Chroma 集合的距离函数，没有显式设置时是默认的 l2"""
+    configuration = getattr(vector_db._collection, "configuration", None) or {}
+    space = (configuration.get("hnsw") or {}).get("space")
+    return space or (vector_db._collection.metadata or {}).get("hnsw:space", "l2")
+
+
+def _migrate_to_cosine(vector_db: Chroma, batch_size: int = 1000):
+    """
+    把 L2 距离的集合换成余弦距离：距离函数建好后不能修改，只能建一个新集合，
+    把 id、向量、文本、metadata 原样复制过去再替换旧集合，不重新调用 Embedding 模型
+    """
+    client, old = vector_db._client, vector_db._collection
+    name, tmp_name = old.name, f"{old.name}_cosine"
+    if tmp_name in [collection.name for collection in client.list_collections()]:
+        client.delete_collection(tmp_name)  # 上次迁移中途失败留下的
+    new = client.create_collection(tmp_name, metadata={**(old.metadata or {}), **CHROMA_METADATA})
+    offset = 0
+    while True:
+        batch = old.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+        if batch["ids"]:
+            new.add(ids=batch["ids"], embeddings=batch["embeddings"], documents=batch["documents"],
+                    metadatas=batch["metadatas"])
+        if len(batch["ids"]) < batch_size:
+            break
+        offset += batch_size
+    client.delete_collection(name)
+    new.modify(name=name)
+    print(f"Chroma 集合 '{name}' 已从 L2 距离迁移为余弦距离（{new.count()} 条，未重新向量化）")
+
+
+def open_chroma(persist_directory: str, embedding_model) -> Chroma:
+    """
+    打开（或新建）Chroma 库，集合使用余弦距离，与 flat / ann 后端的排序一致
+    之前按默认 L2 距离建的集合在这里迁移一次
+    """
+    vector_db = Chroma(persist_directory=persist_directory, embedding_function=embedding_model,
+                       collection_metadata=CHROMA_METADATA)
+    if chroma_space(vector_db) != "cosine":
+        _migrate_to_cosine(vector_db)
+        vector_db = Chroma(persist_directory=persist_directory, embedding_function=embedding_model,
+                           collection_metadata=CHROMA_METADATA)
+    return vector_db
+
+
+def default_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=500,
+        chunk_overlap=50,
+        length_function=len,
+        is_separator_regex=False,
+    )
+
+
+def update_chunk_metadata(vector_db, ids: list[str], metadata: dict):
+    """把 metadata 合并到已经在库中的 chunk 上，不重新向量化"""
+    if not ids or not metadata:
+        return
+    if isinstance(vector_db, Chroma):
+        for start in range(0, len(ids), 1000):
+            batch = vector_db._collection.get(ids=ids[start: start + 1000], include=["metadatas"])
+            vector_db._collection.update(ids=batch["ids"],
+                                         metadatas=[{**(old or {}), **metadata} for old in batch["metadatas"]])
+    else:
+        vector_db.update_metadata(ids, metadata)
+
+
+def sync_pdf(vector_db: Chroma, pdf_path: str, manifest: dict, splitter=None, batch_size: int = 16,
+             extra_metadata: dict = None, parse_workers: int = None) -> dict:
+    """
+    把一个PDF同步到向量数据库，只对新增的 chunk 做向量化，删除已经消失的 chunk
+    vector_db (Chroma): 目标数据库
+    pdf_path (str): PDF文件路径
+    manifest (dict): 清单，会被原地更新
+    extra_metadata (dict): 附加到每个 chunk 上的 metadata
+    parse_workers (int): 解析PDF的进程数，默认等于CPU核数
+    返回: {"added": 新增数量, "deleted": 删除数量, "kept": 复用数量}
+    """
+    splitter = splitter or default_splitter()
+    source = source_key(pdf_path)
+    sources = manifest.setdefault("sources", {})
+    entry = sources.get(source, {})
+
+    file_hash = file_sha256(pdf_path)
+    old_ids = entry.get("chunk_ids", [])
+    extra_metadata = {"source_name": os.path.basename(pdf_path), **(extra_metadata or {})}
+    if entry.get("file_hash") == file_hash:
+        # 文件没有变化，连解析都不需要；附加 metadata 变了（例如换了分片）只改 metadata，不重新向量化
+        if entry.get("extra_metadata") != extra_metadata:
+            update_chunk_metadata(vector_db, old_ids, extra_metadata)
+            entry["extra_metadata"] = extra_metadata
+        return {"added": 0, "deleted": 0, "kept": len(old_ids)}
+
+    # 流式处理：边解析边切分边向量化，已在库中的 chunk 直接跳过
+    new_ids = []
+    stats = run_ingestion(
+        iter_pdf_documents(pdf_path, max_workers=parse_workers),
+        vector_db,
+        vector_db.embeddings,
+        splitter=splitter,
+        batch_size=batch_size,
+        skip_ids=set(old_ids),
+        seen_ids=new_ids,
+        extra_metadata=extra_metadata,
+    )
+
+    # 全部写入成功后再删除消失的 chunk，中途失败时旧数据仍然可用
+    new_id_set = set(new_ids)
+    to_delete = [chunk_id for chunk_id in old_ids if chunk_id not in new_id_set]
+    if to_delete:
+        vector_db.delete(ids=to_delete)
+
+    if entry.get("extra_metadata") != extra_metadata:
+        # 跳过的 chunk 还带着上次写入时的 metadata
+        update_chunk_metadata(vector_db, [chunk_id for chunk_id in old_ids if chunk_id in new_id_set], extra_metadata)
+    sources[source] = {"file_hash": file_hash, "chunk_ids": new_ids, "extra_metadata": extra_metadata}
+    return {"added": stats["chunks"], "deleted": len(to_delete), "kept": len(new_ids) - stats["chunks"]}
+
+
+def splitter_config(splitter) -> dict:
+    """提取切分器的关键参数；自定义切分器可以提供 config() 方法"""
+    if hasattr(splitter, "config"):
+        return splitter.config()
+    length_function = getattr(splitter, "_length_function", len)
+    return {
+        "class": type(splitter).__name__,
+        "chunk_size": getattr(splitter, "_chunk_size", None),
+        "chunk_overlap": getattr(splitter, "_chunk_overlap", None),
+        "separators": getattr(splitter, "_separators", None),
+        "is_separator_regex": getattr(splitter, "_is_separator_regex", None),
+        "keep_separator": getattr(splitter, "_keep_separator", None),
+        "strip_whitespace": getattr(splitter, "_strip_whitespace", None),
+        "length_function": getattr(length_function, "__name__", type(length_function).__name__),
+    }
+
+
+def stored_dimension(vector_db) -> int:
+    """库里已有向量的维度，直接从存储读取；空库返回 None。只用来给没有记录维度的旧清单补记"""
+    if not isinstance(vector_db, Chroma):
+        return vector_db.meta["dim"] if vector_db.meta["count"] else None
+    embeddings = vector_db._collection.get(limit=1, include=["embeddings"])["embeddings"]
+    return len(embeddings[0]) if embeddings is not None and len(embeddings) else None
+
+
+_probed_dimensions = {}
+
+
+def probe_dimension(embedding_model) -> int:
+    """
+    当前模型实际输出的维度：调用一次 embed_query 取长度，同一个模型对象在进程内只探测一次
+    同名但输出维度不同的模型（例如换了 Matryoshka 截断维度）靠它与清单里记录的维度比对出来
+    """
+    key = id(embedding_model)
+    if key not in _probed_dimensions:
+        # 连同模型对象一起保存，防止对象被回收后 id 被别的模型复用
+        _probed_dimensions[key] = (embedding_model, len(embedding_model.embed_query("dimension probe")))
+    return _probed_dimensions[key][1]
+
+
+def index_config(embedding_model, splitter=None, dimension: int = None) -> dict:
+    """
+    当前的构建配置，写入清单并用于比对
+    dimension: 当前模型的输出维度（probe_dimension），写入时记录，加载时与清单里记录的值比对
+    """
+    config = {"embedding_model": model_namespace(embedding_model)}
+    if dimension is not None:
+        config["embedding_dim"] = dimension
+    if splitter is not None:
+        config["splitter"] = splitter_config(splitter)
+    return config
+
+
+def config_fingerprint(embedding_model, splitter=None) -> str:
+    """模型 + 切分参数的短指纹，用于给不同配置的索引起不同的目录名"""
+    raw = json.dumps({"embedding_model": model_namespace(embedding_model),
+                      "splitter": splitter_config(splitter or default_splitter())},
+                     ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:8]
+
+
+def _legacy_index_matches(base_directory: str, embedding_model, splitter=None) -> bool:
+    """base_directory 本身是否是同样配置建的索引（按配置分目录之前建的，或者 v1 清单没有记录配置）"""
+    manifest = load_manifest(base_directory)
+    if not manifest:
+        return False
+    stored = manifest.get("config")
+    if not stored:
+        return True
+    current = {"embedding_model": model_namespace(embedding_model),
+               "splitter": splitter_config(splitter or default_splitter())}
+    return all(stored.get(key, value) == value for key, value in current.items())
+
+
+def index_directory(base_directory: str, embedding_model, splitter=None) -> str:
+    """
+    构建时使用的目录：例如 chroma_db -> chroma_db_1a2b3c4d，不同配置的索引各住各的目录，切换配置时互不覆盖，切回来也不必重建
+    base_directory 本身已经是同样配置建的索引时直接沿用，已有的索引不用重新向量化
+    """
+    base_directory = os.path.normpath(base_directory)
+    directory = f"{base_directory}_{config_fingerprint(embedding_model, splitter)}"
+    if not os.path.exists(directory) and _legacy_index_matches(base_directory, embedding_model, splitter):
+        return base_directory
+    return directory
+
+
+def find_index_directory(base_directory: str, embedding_model, splitter=None) -> str:
+    """
+    加载时使用的目录：在 base_directory 和 base_directory_<指纹> 里找与当前配置一致的索引
+    给出 splitter 时与 index_directory 相同；不给时只按 Embedding 模型找，同一个模型有多种切分参数的索引时要求给出 splitter
+    """
+    if splitter is not None:
+        return index_directory(base_directory, embedding_model, splitter)
+    base_directory = os.path.normpath(base_directory)
+    parent, name = os.path.split(base_directory)
+    pattern = re.compile(re.escape(name) + r"_[0-9a-f]{8}")
+    siblings = sorted(entry for entry in os.listdir(parent or ".") if pattern.fullmatch(entry)) \
+        if os.path.isdir(parent or ".") else []
+    namespace = model_namespace(embedding_model)
+    matches = []
+    for directory in [base_directory] + [os.path.join(parent, entry) for entry in siblings]:
+        manifest = load_manifest(directory)
+        if manifest and (manifest.get("config") or {}).get("embedding_model", namespace) == namespace:
+            matches.append(directory)
+    if len(matches) > 1:
+        raise IndexConfigMismatchError(f"'{base_directory}' 下有多个 {namespace!r} 的索引（切分参数不同）: "
+                                       f"{matches}\n请传入建库时使用的 splitter")
+    return matches[0] if matches else index_directory(base_directory, embedding_model)
+
+
+def config_differences(stored: dict, current: dict) -> list[str]:
+    """比较清单中的配置与当前配置，只比较当前给出的项，返回差异描述"""
+    differences = []
+    for key, value in current.items():
+        if stored.get(key) != value:
+            differences.append(f"{key}: 索引为 {stored.get(key)!r}，当前为 {value!r}")
+    return differences
+
+
+def clear_vector_db(vector_db):
+    if not isinstance(vector_db, Chroma):
+        vector_db.clear()
+        return
+    ids = vector_db.get(include=[])["ids"]
+    for i in range(0, len(ids), 5000):
+        vector_db.delete(ids=ids[i: i + 5000])
+
+
+def migrate_manifest(manifest: dict, current: dict, persist_directory: str) -> bool:
+    """
+    旧清单里没有记录的配置项（v1 清单整个没有 config；空库建的清单还没有维度）按当前配置补记并落盘
+    这些索引在记录配置之前就已经建好，无从比对，补记后以后就能正常校验；返回是否有补记
+    """
+    stored = manifest.setdefault("config", {})
+    missing = {key: value for key, value in current.items() if key not in stored}
+    if not missing:
+        return False
+    stored.update(missing)
+    manifest["version"] = MANIFEST_VERSION
+    if manifest.get("sources"):
+        save_manifest(persist_directory, manifest)
+        print(f"索引 '{persist_directory}' 的清单补记了构建配置: {sorted(missing)}")
+    return True
+
+
+def check_config(manifest: dict, current: dict, on_mismatch: str, persist_directory: str, vector_db=None) -> bool:
+    """
+    校验配置，返回 True 表示需要清空重建
+    on_mismatch: "error" 抛出 IndexConfigMismatchError；"rebuild" 清空后按当前配置重建
+    vector_db: 清单还没有记录维度时，按库里已有向量的维度补记（而不是当前模型的维度，否则补记后永远比对不出差异）
+    """
+    recorded = dict(current)
+    if vector_db is not None and "embedding_dim" not in manifest.get("config", {}):
+        dimension = stored_dimension(vector_db)
+        if dimension is not None:
+            recorded["embedding_dim"] = dimension
+    migrate_manifest(manifest, recorded, persist_directory)
+    differences = config_differences(manifest["config"], current)
+    if not differences:
+        return False
+    message = f"索引 '{persist_directory}' 的构建配置与当前配置不一致:\n  " + "\n  ".join(differences)
+    if on_mismatch == "rebuild":
+        print(message + "\n将清空后按当前配置重建")
+        return True
+    raise IndexConfigMismatchError(message + "\n请换一个目录，或传入 on_mismatch='rebuild' 重建索引")
+
+
+def load_vector_db(persist_directory: str, embedding_model, splitter=None) -> Chroma:
+    """
+    只加载、不构建：检查清单中的 Embedding 模型、维度（以及给出时的切分参数）与当前一致后才返回
+    维度用 probe_dimension 调用一次当前模型得到，与建库时记录在清单里的维度比对
+    """
+    manifest = load_manifest(persist_directory)
+    if not manifest:
+        raise FileNotFoundError(f"'{persist_directory}' 下没有索引清单，请先用 build_or_update_vector_db 构建索引")
+    vector_db = open_chroma(persist_directory, embedding_model)
+    check_config(manifest, index_config(embedding_model, splitter, probe_dimension(embedding_model)), "error",
+                 persist_directory, vector_db)
+    return vector_db
+
+
+def load_stored_documents(vector_db: Chroma, batch_size: int = 1000) -> list:
+    """
+    直接从向量库读出已经切分好的全部文本块（不读向量），按 来源、页码 排序
+    BM25 等关键词检索用它建语料，保证和向量检索用的是同一批文本块，也不用重新解析PDF
+    """
+    if not isinstance(vector_db, Chroma):
+        docs = list(vector_db.iter_documents())
+        docs.sort(key=lambda doc: (str(doc.metadata.get("source", "")), doc.metadata.get("page", 0)))
+        return docs
+    docs = []
+    offset = 0
+    while True:
+        result = vector_db._collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        for chunk_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"]):
+            metadata = dict(metadata or {})
+            metadata.setdefault("chunk_id", chunk_id)
+            docs.append(Document(page_content=text, metadata=metadata))
+        if len(result["ids"]) < batch_size:
+            break
+        offset += batch_size
+    docs.sort(key=lambda doc: (str(doc.metadata.get("source", "")), doc.metadata.get("page", 0)))
+    return docs
+
+
+def build_or_update_vector_db(pdf_paths, persist_directory: str, embedding_model, splitter=None,
+                              batch_size: int = 16, on_mismatch: str = "error",
+                              prune_missing_sources: bool = True, extra_metadata: dict = None,
+                              parse_workers: int = None, vector_db=None) -> Chroma:
+    """
+    增量地创建或更新向量数据库
+    pdf_paths (str | list[str]): 一个或多个PDF路径
+    persist_directory (str): 数据库在硬盘上的路径，清单也保存在这里
+    embedding_model: 用于向量化的Embedding模型
+    on_mismatch (str): 已有索引的模型/维度/切分参数与当前不一致时，"error" 拒绝使用，"rebuild" 清空重建
+    prune_missing_sources (bool): 删除清单中有、但这次没有传入的PDF对应的 chunk
+    extra_metadata (dict): 附加到每个 chunk 上的 metadata
+    parse_workers (int): 解析PDF的进程数
+    vector_db: 已经打开的其他向量库（例如 flat_index.FlatVectorStore），默认在 persist_directory 打开 Chroma
+    返回: 已经和PDF保持同步的向量库实例
+    """
+    splitter = splitter or default_splitter()
+    if isinstance(pdf_paths, str):
+        pdf_paths = [pdf_paths]
+    for pdf_path in pdf_paths:
+        if not os.path.exists(pdf_path):
+            raise FileNotFoundError(f"错误：PDF文件 '{pdf_path}' 未找到！")
+
+    had_directory = os.path.exists(persist_directory)
+    manifest = load_manifest(persist_directory)
+    if vector_db is None:
+        vector_db = open_chroma(persist_directory, embedding_model)
+
+    if had_directory and not manifest and isinstance(vector_db, Chroma):
+        # 旧版本脚本建的库没有稳定ID，无法做差异比较，只能清空后按新规则重建一次
+        legacy_ids = vector_db.get(include=[])["ids"]
+        if legacy_ids:
+            print(f"检测到没有清单的旧数据库（{len(legacy_ids)} 条），将按稳定ID重建一次")
+            vector_db.delete(ids=legacy_ids)
+
+    current = index_config(embedding_model, splitter, probe_dimension(embedding_model))
+    if manifest.get("sources") and check_config(manifest, current, on_mismatch, persist_directory, vector_db):
+        clear_vector_db(vector_db)
+        manifest = {}
+    manifest["version"] = MANIFEST_VERSION
+    manifest["config"] = current
+
+    if prune_missing_sources:
+        wanted = {source_key(path) for path in pdf_paths}
+        for source in [s for s in manifest.get("sources", {}) if s not in wanted]:
+            stale_ids = manifest["sources"].pop(source)["chunk_ids"]
+            if stale_ids:
+                vector_db.delete(ids=stale_ids)
+            print(f"{os.path.basename(source)}: 已不在输入中，删除 {len(stale_ids)} 个文本块")
+
+    for pdf_path in pdf_paths:
+        stats = sync_pdf(vector_db, pdf_path, manifest, splitter=splitter, batch_size=batch_size,
+                         extra_metadata=extra_metadata, parse_workers=parse_workers)
+        print(f"{os.path.basename(pdf_path)}: 新增 {stats['added']}，删除 {stats['deleted']}，复用 {stats['kept']}")
+        # 每个文件同步完立即落盘，中途失败时已完成的部分不会白做
+        save_manifest(persist_directory, manifest)
+
+    return vector_db
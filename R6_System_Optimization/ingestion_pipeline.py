@@ -0,0 +1,212 @@
+# 文件名: ingestion_pipeline.py
+# 流式入库流水线： 解析页面 → 切分 → 向量化 → 写入数据库
+# 各阶段运行在独立线程中，阶段之间用有界队列连接：
+#   - 解析/切分、向量化(网络IO或模型推理)、写库 三者同时进行，总耗时趋近于最慢的那个阶段，而不是三者之和
+#   - 队列满时上游阻塞等待，内存峰值只和 batch_size * queue_size 有关，与语料总量无关
+#   - 有 encode() 的本地模型直接产出 NumPy 数组（可以是 float16 / int8），一路传到写库，不经过 list[list[float]]
+
+import itertools
+import queue
+import threading
+import time
+
+import numpy as np
+
+# index_builder 也会导入本模块，这里导入模块对象而不是名字，避免循环导入
+from R6_System_Optimization import index_builder
+
+_DONE = object()  # 队列结束标记
+
+
+class _StageError:
+    """把子线程中的异常包装起来，经由队列传递给主线程重新抛出"""
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def embed_batch(embedding_model, texts: list[str]):
+    """
+    向量化一批文本：有 encode() 的本地模型（HuggingFaceBGEEmbedding、OnnxEmbedding 等）直接返回 NumPy 数组，
+    精度由模型的 precision 决定；其余模型（包括 CachedEmbeddings 等包装层）走 embed_documents
+    """
+    if hasattr(embedding_model, "encode"):
+        return embedding_model.encode(texts)
+    return embedding_model.embed_documents(texts)
+
+
+def write_embedded_batch(vector_db, ids: list[str], docs: list, vectors):
+    """
+    把已经算好向量的一批文档直接写入向量库，避免 add_documents 再次调用 Embedding 模型
+    vectors: list[list[float]]，或 encode() 返回的 float32 / float16 / int8 数组（int8 的值为 round(v * 127)）
+    """
+    if isinstance(vectors, np.ndarray) and vectors.dtype == np.int8:
+        vectors = vectors.astype(np.float32) / 127
+    if hasattr(vector_db, "add_vectors"):  # flat_index.FlatVectorStore 等直接接收向量的存储
+        vector_db.add_vectors(vectors, [doc.page_content for doc in docs], [doc.metadata for doc in docs], ids)
+        return
+    if isinstance(vectors, np.ndarray):
+        vectors = vectors.astype(np.float32, copy=False)  # Chroma 按 float32 存储
+    vector_db._collection.upsert(
+        ids=ids,
+        embeddings=vectors,
+        documents=[doc.page_content for doc in docs],
+        metadatas=[doc.metadata or None for doc in docs],
+    )
+
+
+def iter_page_chunks(pages, splitter):
+    """
+    逐页切分，产出 (page, chunks)
+    提供 split_document_groups 的切分器（如语义分块器）每次拿到 page_window 页，一次性处理整个窗口，
+    避免每页单独调用一次 Embedding 模型
+    """
+    if not hasattr(splitter, "split_document_groups"):
+        for page in pages:
+            yield page, splitter.split_documents([page])
+        return
+    window = []
+    for page in itertools.chain(pages, [None]):
+        if page is not None:
+            window.append(page)
+        if window and (page is None or len(window) >= splitter.page_window):
+            yield from zip(window, splitter.split_document_groups(window))
+            window = []
+
+
+def iter_chunk_batches(pages, splitter=None, batch_size: int = 32, skip_ids=None, seen_ids: list = None,
+                       extra_metadata: dict = None):
+    """
+    逐页切分并按 batch_size 组成批次，每批是 [(chunk_id, Document), ...]
+    skip_ids (set): 已经在库中的 chunk ID，直接跳过不再向量化（增量同步时使用）
+    seen_ids (list): 传入一个列表时，会把切分出的所有 chunk ID 按顺序追加进去
+    extra_metadata (dict): 附加到每个 chunk 上的 metadata，例如来源名、分片名
+    """
+    splitter = splitter or index_builder.default_splitter()
+    skip_ids = skip_ids or set()
+    batch = []
+    for page, chunks in iter_page_chunks(pages, splitter):
+        ids = index_builder.assign_chunk_ids(chunks, index_builder.source_key(page.metadata.get("source", "")))
+        if seen_ids is not None:
+            seen_ids.extend(ids)
+        for chunk_id, chunk in zip(ids, chunks):
+            if chunk_id in skip_ids:
+                continue
+            if extra_metadata:
+                chunk.metadata.update(extra_metadata)
+            batch.append((chunk_id, chunk))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def run_ingestion(pages, vector_db, embedding_model, splitter=None, batch_size: int = 32, queue_size: int = 4,
+                  embed_workers: int = 1, skip_ids=None, seen_ids: list = None, extra_metadata: dict = None,
+                  writer=write_embedded_batch) -> dict:
+    """
+    运行流式入库流水线
+    pages: 逐页产出 Document 的可迭代对象，例如 pdf_loader.iter_pdf_documents(...)
+    vector_db: 目标向量数据库
+    embedding_model: 任何实现了 embed_documents 的 Embedding 模型；有 encode() 时用它（见 embed_batch）
+    batch_size (int): 每批向量化的 chunk 数
+    queue_size (int): 每个阶段之间最多缓存多少批，决定内存上限
+    embed_workers (int): 并发向量化的线程数，远程 API 可以适当调大
+    writer: 写库函数 writer(vector_db, ids, docs, vectors)
+    返回: 统计信息 {"chunks": 写入数, "batches": 批数, "seconds": 总耗时, "stage_seconds": 各阶段忙碌时间}
+    """
+    chunk_queue = queue.Queue(maxsize=queue_size)
+    vector_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    busy = {"split": 0.0, "embed": 0.0, "write": 0.0}
+    busy_lock = threading.Lock()
+
+    def add_busy(stage, seconds):
+        with busy_lock:
+            busy[stage] += seconds
+
+    def put(q, item):
+        # 下游出错退出后不再阻塞在满队列上
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def split_stage():
+        try:
+            batches = iter_chunk_batches(pages, splitter, batch_size, skip_ids, seen_ids, extra_metadata)
+            while True:
+                start = time.perf_counter()
+                batch = next(batches, None)
+                add_busy("split", time.perf_counter() - start)
+                if batch is None or not put(chunk_queue, batch):
+                    break
+        except BaseException as e:
+            put(vector_queue, _StageError(e))
+        finally:
+            for _ in range(embed_workers):
+                put(chunk_queue, _DONE)
+
+    def embed_stage():
+        try:
+            while not stop.is_set():
+                batch = get(chunk_queue)
+                if batch is _DONE:
+                    break
+                start = time.perf_counter()
+                vectors = embed_batch(embedding_model, [doc.page_content for _, doc in batch])
+                add_busy("embed", time.perf_counter() - start)
+                if not put(vector_queue, (batch, vectors)):
+                    break
+        except BaseException as e:
+            put(vector_queue, _StageError(e))
+        finally:
+            put(vector_queue, _DONE)
+
+    threads = [threading.Thread(target=split_stage, name="split", daemon=True)]
+    threads += [threading.Thread(target=embed_stage, name=f"embed-{i}", daemon=True) for i in range(embed_workers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+
+    # 写库阶段在当前线程中执行
+    total_chunks = 0
+    total_batches = 0
+    finished_workers = 0
+    try:
+        while finished_workers < embed_workers:
+            item = vector_queue.get()
+            if item is _DONE:
+                finished_workers += 1
+                continue
+            if isinstance(item, _StageError):
+                raise item.error
+            batch, vectors = item
+            start = time.perf_counter()
+            writer(vector_db, [chunk_id for chunk_id, _ in batch], [doc for _, doc in batch], vectors)
+            add_busy("write", time.perf_counter() - start)
+            total_chunks += len(batch)
+            total_batches += 1
+            print(f"已写入 {total_chunks} 个文本块...")
+    finally:
+        stop.set()
+        for t in threads:
+            t.join(timeout=5)
+
+    return {
+        "chunks": total_chunks,
+        "batches": total_batches,
+        "seconds": round(time.perf_counter() - started, 3),
+        "stage_seconds": {k: round(v, 3) for k, v in busy.items()},
+    }
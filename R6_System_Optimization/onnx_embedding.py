@@ -0,0 +1,299 @@
+# 文件名: onnx_embedding.py
+# ONNX Runtime 的 CPU 推理后端，用来替代 PyTorch 全精度推理：
+#   - export_onnx: 把 Hugging Face 模型（BGE / Qwen3-Embedding 等）导出为 ONNX，批大小和序列长度都是动态的
+#   - quantize_int8: 动态 int8 量化，权重体积约为原来的 1/4，CPU 上通常还能再快一截
+#   - OnnxEmbedding: 只依赖 onnxruntime + tokenizers 的 Embedding 模型，推理时不需要 torch
+#   - check_parity / benchmark: 与 PyTorch 向量直接比对（不先各自归一化），对比吞吐量
+# 导出和比对需要 torch + transformers；导出一次之后，线上节点只需要 onnxruntime 和 tokenizers。
+# BGE 的全精度 ONNX 模型与 local_model.HuggingFaceBGEEmbedding 的默认配置输出相同的向量，也报告相同的模型标识，
+# 两个后端互换时缓存和索引清单都不会失效；int8 量化、查询前缀、关闭归一化都会改变向量，标识也随之不同。
+
+import json
+import os
+import time
+
+import numpy as np
+
+DEFAULT_ONNX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "onnx")
+CONFIG_NAME = "onnx_config.json"
+
+
+def default_pooling(model_name: str) -> str:
+    """
+    各模型官方的池化方式：BGE 用 [CLS] 向量（与 sentence-transformers 的配置相同），
+    Qwen3-Embedding 用最后一个 token（与 qwen3_embedding.Qwen3Embedding 的默认值相同），其余模型默认平均池化
+    R1_Evaluation_Framework/embedding.py 对 Qwen3 做的是平均池化，要与它比对时导出 / 比对都传 pooling="mean"
+    """
+    name = model_name.lower()
+    if "bge" in name:
+        return "cls"
+    if "qwen" in name:
+        return "last"
+    return "mean"
+
+
+def model_directory(model_name: str, base_directory: str = DEFAULT_ONNX_DIR) -> str:
+    """BAAI/bge-small-en -> .cache/onnx/BAAI--bge-small-en"""
+    name = model_name.rstrip("/\\").replace("\\", "/")
+    if os.path.isdir(model_name):
+        name = os.path.basename(os.path.abspath(model_name))  # 本地模型目录只取目录名
+    return os.path.join(base_directory, name.replace("/", "--"))
+
+
+def export_onnx(model_name: str, output_dir: str = None, pooling: str = None, max_length: int = 512,
+                opset: int = 17) -> str:
+    """
+    导出 ONNX 模型和分词器，返回输出目录
+    model_name (str): Hugging Face 模型名或本地路径，例如 "BAAI/bge-small-en"、"../Qwen3-Embedding-0.6B"
+    pooling (str): "cls" / "mean" / "last"，默认由 default_pooling 推断
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    output_dir = output_dir or model_directory(model_name)
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name, torch_dtype=torch.float32).eval()
+    if hasattr(model.config, "use_cache"):
+        model.config.use_cache = False  # 解码器模型（Qwen）不要导出 KV cache
+
+    sample = tokenizer(["导出示例 export sample", "第二句"], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            os.path.join(output_dir, "model.onnx"),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    tokenizer.save_pretrained(output_dir)  # fast 分词器会保存 tokenizer.json，推理时用 tokenizers 库直接加载
+    with open(os.path.join(output_dir, CONFIG_NAME), "w", encoding="utf-8") as f:
+        json.dump({"model_name": model_name, "pooling": pooling or default_pooling(model_name),
+                   "max_length": max_length, "input_names": input_names}, f, ensure_ascii=False, indent=2)
+    print(f"已导出 ONNX 模型: {output_dir}")
+    return output_dir
+
+
+def quantize_int8(model_dir: str) -> str:
+    """对 model.onnx 做动态 int8 量化（权重 int8，激活在运行时量化），生成 model.int8.onnx"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    output_path = os.path.join(model_dir, "model.int8.onnx")
+    quantize_dynamic(os.path.join(model_dir, "model.onnx"), output_path, weight_type=QuantType.QInt8)
+    print(f"已生成 int8 量化模型: {output_path}")
+    return output_path
+
+
+def prepare_onnx_model(model_name: str, quantize: bool = False, base_directory: str = DEFAULT_ONNX_DIR) -> str:
+    """返回可用的 ONNX 模型目录；还没有导出/量化过时自动导出/量化"""
+    model_dir = model_directory(model_name, base_directory)
+    if not os.path.exists(os.path.join(model_dir, "model.onnx")):
+        export_onnx(model_name, model_dir)
+    if quantize and not os.path.exists(os.path.join(model_dir, "model.int8.onnx")):
+        quantize_int8(model_dir)
+    return model_dir
+
+
+def pool(hidden: np.ndarray, mask: np.ndarray, pooling: str) -> np.ndarray:
+    """hidden: (批, 序列, 维度)，mask: (批, 序列)；padding 在右侧"""
+    if pooling == "cls":
+        return hidden[:, 0]
+    if pooling == "last":
+        last = mask.sum(axis=1) - 1
+        return hidden[np.arange(len(hidden)), last]
+    weights = mask[..., None].astype(hidden.dtype)
+    return (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+
+
+class OnnxEmbedding:
+    """
+    ONNX Runtime 版的 Embedding 模型，接口与 local_model.HuggingFaceBGEEmbedding 相同
+    model_dir (str): export_onnx 的输出目录
+    quantized (bool): 使用 model.int8.onnx
+    batch_size / max_batch_tokens: 组批参数，按真实 token 数排序后组批，padding 最少
+    normalize (bool): 是否做 L2 归一化；默认归一化，与 sentence-transformers 的 BGE 流水线
+                      （Transformer -> Pooling(CLS) -> Normalize）和 qwen3_embedding.Qwen3Embedding 的默认值相同
+    query_instruction (str): 查询前缀，例如 BGE 的 "Represent this sentence for searching relevant passages: "
+    num_threads (int): ONNX Runtime 的线程数，默认由 onnxruntime 决定
+    """
+    def __init__(self, model_dir: str, quantized: bool = False, batch_size: int = 32, max_batch_tokens: int = 16384,
+                 normalize: bool = True, query_instruction: str = "", num_threads: int = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, CONFIG_NAME), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        self.model_name = config["model_name"]
+        self.pooling = config["pooling"]
+        self.max_length = config["max_length"]
+        self.quantized = quantized
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.normalize = normalize
+        self.query_instruction = query_instruction
+        # BGE 沿用 torch 版的类名做标识（同 AsyncEmbeddingClient 的 namespace_class），切换后端不用重建缓存和索引
+        is_bge = "bge" in self.model_name.lower() and self.pooling == "cls"
+        self.namespace_class = "HuggingFaceBGEEmbedding" if is_bge else None
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.max_length)
+        self.tokenizer.no_padding()  # padding 在组批时按批内最长手动补
+        self.pad_id = self.tokenizer.token_to_id("[PAD]") or 0  # 被 attention_mask 遮住，取值不影响结果
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        path = os.path.join(model_dir, "model.int8.onnx" if quantized else "model.onnx")
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    @property
+    def namespace(self) -> str:
+        if self.namespace_class:
+            # 与 HuggingFaceBGEEmbedding 默认配置的标识相同：它的 ST 流水线自带 Normalize，输出本来就是单位向量
+            namespace = f"{self.model_name}{'' if self.normalize else '+raw'}"
+        else:
+            namespace = f"{self.model_name}{'+norm' if self.normalize else ''}"
+        # 量化后的向量与全精度有细微差别，缓存分开存；查询前缀不同，查询向量也不同
+        namespace += "+int8" if self.quantized else ""
+        return f"{namespace}:{self.query_instruction}" if self.query_instruction else namespace
+
+    def _run(self, encodings: list) -> np.ndarray:
+        length = max(len(e.ids) for e in encodings)
+        ids = np.full((len(encodings), length), self.pad_id, dtype=np.int64)
+        mask = np.zeros((len(encodings), length), dtype=np.int64)
+        for row, e in enumerate(encodings):
+            ids[row, :len(e.ids)] = e.ids
+            mask[row, :len(e.ids)] = 1
+        feed = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feed["token_type_ids"] = np.zeros_like(ids)
+        hidden = self.session.run(["last_hidden_state"], feed)[0]
+        return pool(hidden, mask, self.pooling)
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """编码为 (条数, 维度) 的 float32 数组，顺序与输入一致"""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        encodings = self.tokenizer.encode_batch(list(texts))  # Rust 多线程分词
+        lengths = np.array([len(e.ids) for e in encodings])
+        order = np.argsort(-lengths, kind="stable")
+        out = None
+        start = 0
+        while start < len(order):
+            size = max(1, min(self.batch_size, self.max_batch_tokens // max(1, lengths[order[start]])))
+            index = order[start: start + size]
+            vectors = self._run([encodings[i] for i in index])
+            if out is None:
+                out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[index] = vectors
+            start += size
+        if self.normalize:
+            out /= np.linalg.norm(out, axis=1, keepdims=True) + 1e-12
+        return out
+
+    def __call__(self, texts):
+        return self.encode(texts)
+
+    def embed_documents(self, texts):
+        """按 LangChain Embeddings 的约定返回 list[list[float]]；需要 NumPy 数组时直接调用 encode()"""
+        if not texts:
+            return []
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text):
+        return self.encode([self.query_instruction + text])[0].tolist()
+
+    def embed_queries(self, texts):
+        """多条查询一次编码"""
+        if not texts:
+            return []
+        return self.encode([self.query_instruction + text for text in texts]).tolist()
+
+
+def reference_embeddings(model_name: str, texts: list[str], pooling: str = None, max_length: int = 512,
+                         normalize: bool = False) -> np.ndarray:
+    """
+    用 PyTorch 全精度计算参考向量：与 R1_Evaluation_Framework/embedding.py 一样 AutoModel 前向 + 手工池化，
+    池化方式默认由 default_pooling 决定（与导出时相同），不是 embedding.py 的平均池化
+    normalize (bool): 池化后做 L2 归一化，对应 sentence-transformers 流水线里的 Normalize 模块
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    pooling = pooling or default_pooling(model_name)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name, torch_dtype=torch.float32).eval()
+    tokenizer.padding_side = "right"  # 与 ONNX 端的 pool() 约定一致
+    vectors = []
+    with torch.no_grad():
+        for i in range(0, len(texts), 16):
+            inputs = tokenizer(texts[i: i + 16], padding=True, truncation=True, max_length=max_length,
+                               return_tensors="pt")
+            hidden = model(**inputs).last_hidden_state.numpy()
+            vectors.append(pool(hidden, inputs["attention_mask"].numpy(), pooling))
+    vectors = np.concatenate(vectors).astype(np.float32)
+    if normalize:
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+    return vectors
+
+
+def check_parity(model_name: str, onnx_model: OnnxEmbedding, texts: list[str], max_error: float = 0.15) -> float:
+    """
+    ONNX 的原始输出与 PyTorch 参考向量（按 onnx_model.normalize 决定是否经过 Normalize）逐条比较
+    两边都不另做归一化，用相对误差 |a - e| / |e| 衡量：方向和长度任何一个不一致（例如漏了归一化）都会暴露
+    单位向量的相对误差 0.15 约等于余弦相似度 0.99；最大误差超过 max_error 时抛出异常，返回最大相对误差
+    """
+    expected = reference_embeddings(model_name, texts, onnx_model.pooling, onnx_model.max_length,
+                                    normalize=onnx_model.normalize)
+    actual = onnx_model.encode(texts)
+    expected_norm = np.linalg.norm(expected, axis=1)
+    actual_norm = np.linalg.norm(actual, axis=1)
+    error = np.linalg.norm(actual - expected, axis=1) / (expected_norm + 1e-12)
+    cosine = np.einsum("ij,ij->i", expected, actual) / (expected_norm * actual_norm + 1e-12)
+    print(f"与 PyTorch 的相对误差: 最大 {error.max():.5f}，平均 {error.mean():.5f}；"
+          f"余弦相似度最小 {cosine.min():.5f}")
+    if error.max() > max_error:
+        raise AssertionError(f"ONNX 向量与 PyTorch 不一致: 最大相对误差 {error.max():.5f} > {max_error}")
+    return float(error.max())
+
+
+def benchmark(models: dict, texts: list[str], repeats: int = 3) -> dict:
+    """对比多个模型的吞吐量，models = {名字: 有 embed_documents 的模型}，返回 {名字: 条/秒}"""
+    results = {}
+    for name, model in models.items():
+        model.embed_documents(texts[:8])  # 预热
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model.embed_documents(texts)
+        seconds = (time.perf_counter() - start) / repeats
+        results[name] = len(texts) / seconds
+        print(f"{name:16s} {results[name]:8.1f} 条/s")
+    return results
+
+
+# --- 测试代码块：导出 bge-small-en，量化，做一致性检查和吞吐量对比 ---
+if __name__ == '__main__':
+    from local_model import HuggingFaceBGEEmbedding
+    from R6_System_Optimization.pdf_loader import load_pdfs
+    from R6_System_Optimization.text_splitter import FastTextSplitter
+
+    model_name = "BAAI/bge-small-en"
+    model_dir = prepare_onnx_model(model_name, quantize=True)
+    fp32 = OnnxEmbedding(model_dir)
+    int8 = OnnxEmbedding(model_dir, quantized=True)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pages = load_pdfs(os.path.join(root, "R1_Evaluation_Framework", "PDF", "ARES.pdf"))
+    texts = [doc.page_content for doc in FastTextSplitter(chunk_size=500, chunk_overlap=50).split_documents(pages)]
+
+    check_parity(model_name, fp32, texts[:64])
+    check_parity(model_name, int8, texts[:64])
+    benchmark({"pytorch": HuggingFaceBGEEmbedding(model_name), "onnx-fp32": fp32, "onnx-int8": int8},
+              texts)
@@ -0,0 +1,106 @@
+# 文件名: page_cache.py
+# 解析结果的磁盘缓存：PDF 解析和切分的结果按 文件内容哈希 (+ 切分参数) 保存为 JSONL，
+# 进程重启后直接读缓存，不再重新解析没有变化的PDF。
+#   .cache/pages/<文件sha256>_<解析器版本>.jsonl                 逐页文本
+#   .cache/chunks/<文件sha256>_<切分参数指纹>_<路径指纹>.jsonl   切分后的文本块（带与向量库一致的 chunk_id）
+# 文件内容变了哈希就变，旧缓存自然失效；换了切分参数会生成另一个缓存文件，互不干扰。
+
+import hashlib
+import json
+import os
+
+import pypdf
+from langchain_core.documents import Document
+
+from R6_System_Optimization.index_builder import (assign_chunk_ids, default_splitter, file_sha256, source_key,
+                                                  splitter_config)
+from R6_System_Optimization.ingestion_pipeline import iter_page_chunks
+from R6_System_Optimization.pdf_loader import expand_pdf_paths, iter_pdf_documents
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache")
+# 解析逻辑或 pypdf 版本变化时，页面文本可能不同，一并放进缓存 key
+PARSER_VERSION = f"pypdf-{pypdf.__version__}-plain-1"
+
+
+def _read_jsonl(path: str) -> list[Document]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [Document(**json.loads(line)) for line in f]
+
+
+def _write_jsonl(path: str, docs: list[Document]):
+    """先写临时文件再替换，多个进程同时写同一个缓存也不会读到半个文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for doc in docs:
+            f.write(json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False))
+            f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def _short_hash(data) -> str:
+    raw = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:8]
+
+
+def _with_current_source(docs: list[Document], pdf_path: str) -> list[Document]:
+    # 同一份文件被复制/移动后哈希不变，缓存可以复用，但 source 要换成当前路径
+    for doc in docs:
+        doc.metadata["source"] = pdf_path
+    return docs
+
+
+def load_pages_cached(paths, cache_dir: str = DEFAULT_CACHE_DIR, max_workers: int = None) -> list[Document]:
+    """
+    与 pdf_loader.load_pdfs 相同，但每个文件的解析结果会缓存到磁盘
+    paths: 文件 / 文件夹 / 通配符 / 列表
+    """
+    pages = []
+    for pdf_path in expand_pdf_paths(paths):
+        key = f"{file_sha256(pdf_path)}_{_short_hash(PARSER_VERSION)}"
+        cache_path = os.path.join(cache_dir, "pages", f"{key}.jsonl")
+        if os.path.exists(cache_path):
+            pages.extend(_with_current_source(_read_jsonl(cache_path), pdf_path))
+            continue
+        file_pages = list(iter_pdf_documents(pdf_path, max_workers=max_workers))
+        _write_jsonl(cache_path, file_pages)
+        pages.extend(file_pages)
+    return pages
+
+
+def load_chunks_cached(paths, splitter=None, cache_dir: str = DEFAULT_CACHE_DIR,
+                       max_workers: int = None) -> list[Document]:
+    """
+    解析 + 切分，并按 (文件哈希, 切分参数) 缓存切分结果
+    返回的 chunk 带有 metadata["chunk_id"]，与 index_builder 写入向量库的ID相同，可用于两路检索结果对齐
+    """
+    splitter = splitter or default_splitter()
+    fingerprint = _short_hash({"parser": PARSER_VERSION, "splitter": splitter_config(splitter)})
+    chunks = []
+    for pdf_path in expand_pdf_paths(paths):
+        # chunk_id 由来源路径参与计算，所以切分缓存还要按路径区分（页面缓存则不需要）
+        key = f"{file_sha256(pdf_path)}_{fingerprint}_{_short_hash(source_key(pdf_path))}"
+        cache_path = os.path.join(cache_dir, "chunks", f"{key}.jsonl")
+        if os.path.exists(cache_path):
+            chunks.extend(_read_jsonl(cache_path))
+            continue
+        pages = load_pages_cached(pdf_path, cache_dir=cache_dir, max_workers=max_workers)
+        file_chunks = []
+        for page, page_chunks in iter_page_chunks(pages, splitter):
+            assign_chunk_ids(page_chunks, source_key(page.metadata.get("source", "")))
+            file_chunks.extend(page_chunks)
+        _write_jsonl(cache_path, file_chunks)
+        chunks.extend(file_chunks)
+    return chunks
+
+
+# --- 测试代码块：对比第一次（解析）和第二次（读缓存）的耗时 ---
+if __name__ == '__main__':
+    import time
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pdf_folder = os.path.join(root, "R1_Evaluation_Framework", "PDF")
+    for attempt in ("第一次", "第二次"):
+        start = time.perf_counter()
+        chunks = load_chunks_cached(pdf_folder)
+        print(f"{attempt}: {len(chunks)} 个文本块，耗时 {time.perf_counter() - start:.3f}s")
@@ -0,0 +1,121 @@
+# 文件名: pdf_loader.py
+# 多进程并行解析PDF：把 (文件, 页码区间) 作为任务分给进程池，
+# 一个大PDF的不同页、一个文件夹里的多个PDF都可以同时解析，按 文件顺序 + 页码顺序 产出 Document。
+# 注意：Windows 使用 spawn 启动子进程，调用方脚本必须放在 if __name__ == "__main__": 之下。
+
+import glob
+import itertools
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+# 每个子进程缓存最近打开的 PdfReader，同一个文件的连续页码区间不必重复解析文件结构
+_reader_cache = {}
+
+
+def expand_pdf_paths(paths) -> list[str]:
+    """
+    把输入统一展开成排好序的PDF路径列表
+    paths: 单个文件 / 文件夹 / 通配符(如 'PDF/*.pdf') / 以上几种的列表
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            result.extend(sorted(glob.glob(os.path.join(path, "*.pdf"))))
+        elif glob.has_magic(path):
+            result.extend(sorted(glob.glob(path, recursive=True)))
+        else:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"错误：PDF文件 '{path}' 未找到！")
+            result.append(path)
+    return result
+
+
+def _get_reader(path: str) -> PdfReader:
+    # 以 (路径, 修改时间, 大小) 作为key，文件被替换后不会读到旧的 reader
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    reader = _reader_cache.get(key)
+    if reader is None:
+        _reader_cache.clear()
+        reader = PdfReader(path)
+        _reader_cache[key] = reader
+    return reader
+
+
+def _parse_pages(task: tuple) -> list[tuple]:
+    """子进程里执行：解析一个文件的 [start, end) 页，返回 (页码, 页标签, 文本) 列表"""
+    path, start, end = task
+    reader = _get_reader(path)
+    labels = reader.page_labels  # 每次访问都会重新计算，取一次即可
+    pages = []
+    for i in range(start, end):
+        label = labels[i] if i < len(labels) else str(i + 1)
+        pages.append((i, label, reader.pages[i].extract_text(extraction_mode="plain").strip()))
+    return pages
+
+
+def _make_tasks(pdf_paths: list[str], pages_per_task: int) -> tuple[list[tuple], dict]:
+    tasks = []
+    total_pages = {}
+    for path in pdf_paths:
+        n_pages = len(PdfReader(path).pages)
+        total_pages[path] = n_pages
+        for start in range(0, n_pages, pages_per_task):
+            tasks.append((path, start, min(start + pages_per_task, n_pages)))
+    return tasks, total_pages
+
+
+def iter_pdf_documents(paths, max_workers: int = None, pages_per_task: int = 8, min_pages_for_pool: int = 16):
+    """
+    并行解析PDF，按确定的顺序逐个产出 Document（每页一个，metadata 与 PyPDFLoader 保持一致）
+    paths: 文件 / 文件夹 / 通配符 / 列表，见 expand_pdf_paths
+    max_workers (int): 进程数，默认等于CPU核数；为1时在当前进程串行解析
+    pages_per_task (int): 每个任务包含的页数，越小负载越均衡，越大调度开销越小
+    min_pages_for_pool (int): 总页数少于该值时不启动进程池，避免进程启动开销大于收益
+    """
+    pdf_paths = expand_pdf_paths(paths)
+    tasks, total_pages = _make_tasks(pdf_paths, pages_per_task)
+    max_workers = max_workers or os.cpu_count() or 1
+
+    def to_documents(task, pages):
+        path = task[0]
+        for page, label, text in pages:
+            yield Document(
+                page_content=text,
+                metadata={"source": path, "total_pages": total_pages[path], "page": page, "page_label": label},
+            )
+
+    # 已经身处子进程时（例如 spawn 重新导入了没有 main 保护的脚本）不再嵌套创建进程池
+    in_child = multiprocessing.parent_process() is not None
+    if max_workers == 1 or in_child or sum(total_pages.values()) < min_pages_for_pool:
+        for task in tasks:
+            yield from to_documents(task, _parse_pages(task))
+        return
+
+    workers = min(max_workers, len(tasks))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # 只保持有限个任务在途（而不是像 executor.map 那样一次全部提交），
+        # 下游消费慢时解析结果不会在内存里无限堆积；按提交顺序取结果，保证输出顺序与串行解析完全一致
+        pending = deque()
+        task_iter = iter(tasks)
+        for task in itertools.islice(task_iter, workers * 2):
+            pending.append((task, executor.submit(_parse_pages, task)))
+        while pending:
+            task, future = pending.popleft()
+            pages = future.result()
+            next_task = next(task_iter, None)
+            if next_task is not None:
+                pending.append((next_task, executor.submit(_parse_pages, next_task)))
+            yield from to_documents(task, pages)
+
+
+def load_pdfs(paths, max_workers: int = None, pages_per_task: int = 8) -> list[Document]:
+    """iter_pdf_documents 的列表版本，可以直接替换 PyPDFLoader(path).load()"""
+    return list(iter_pdf_documents(paths, max_workers=max_workers, pages_per_task=pages_per_task))
@@ -0,0 +1,123 @@
+# 文件名: qwen3_embedding.py
+# 本地 Qwen3-Embedding 模型的 LangChain Embeddings 封装，把 R1_Evaluation_Framework/embedding.py 里
+# AutoModel + 手写池化的验证代码变成可以直接接入建库/检索流水线的组件：
+#   - 一次性分词（不 padding），按 token 数排序后分桶，每个桶只 padding 到桶内最长
+#   - torch.inference_mode 推理，截断到可配置的最大长度
+#   - 查询加指令前缀 "Instruct: {task}\nQuery: {query}"（与 RAG.py 的 task_instruction 写法一致），文档不加
+#   - 默认按官方做法取最后一个 token 的向量并归一化，也可以改成 embedding.py 里的平均池化
+
+import os
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# embedding.py 约定模型放在仓库的上一级目录，也可以用环境变量指定
+DEFAULT_MODEL_PATH = os.getenv(
+    "QWEN3_EMBEDDING_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "Qwen3-Embedding-0.6B"),
+)
+
+
+class Qwen3Embedding(Embeddings):
+    """
+    本地 Qwen3-Embedding 模型
+    model_path (str): 模型目录或 Hugging Face 模型名
+    task_instruction (str): 查询的任务描述，为空时查询也不加前缀
+    max_length (int): 超过的部分截断
+    batch_size (int): 每批最多多少条
+    max_batch_tokens (int): 每批最多多少 token（含 padding），短文本一批可以放更多
+    pooling (str): "last" 取最后一个有效 token（官方做法），"mean" 平均池化
+    normalize (bool): L2 归一化
+    device (str): 默认有 GPU 用 GPU，否则 CPU
+    torch_dtype: GPU 上默认 float16，CPU 上 float32
+    """
+    def __init__(self, model_path: str = DEFAULT_MODEL_PATH, task_instruction: str = "根据查询找到相关文档",
+                 max_length: int = 512, batch_size: int = 32, max_batch_tokens: int = 16384, pooling: str = "last",
+                 normalize: bool = True, device: str = None, torch_dtype=None):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        if pooling not in ("last", "mean"):
+            raise ValueError(f"未知的 pooling: {pooling}")
+        self.torch = torch
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        if torch_dtype is None:
+            torch_dtype = torch.float16 if self.device.type == "cuda" else torch.float32
+        self.model_name = os.path.basename(os.path.normpath(model_path))
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.tokenizer.padding_side = "right"  # 池化时按 attention_mask 找最后一个有效 token
+        self.model = AutoModel.from_pretrained(model_path, torch_dtype=torch_dtype).to(self.device).eval()
+        self.task_instruction = task_instruction
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.pooling = pooling
+        self.normalize = normalize
+
+    @property
+    def namespace(self) -> str:
+        # 查询向量随指令前缀变化，换了 task_instruction 的缓存不能混用
+        namespace = f"{self.model_name}:{self.pooling}{'+norm' if self.normalize else ''}:{self.max_length}"
+        return f"{namespace}:{self.task_instruction}" if self.task_instruction else namespace
+
+    def _encode_batch(self, features: list[dict]) -> np.ndarray:
+        torch = self.torch
+        inputs = self.tokenizer.pad(features, padding=True, return_tensors="pt").to(self.device)
+        with torch.inference_mode():
+            hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"]
+            if self.pooling == "last":
+                last = mask.sum(dim=1) - 1
+                pooled = hidden[torch.arange(hidden.shape[0], device=hidden.device), last]
+            else:
+                weights = mask.unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * weights).sum(dim=1) / weights.sum(dim=1).clamp(min=1e-9)
+            if self.normalize:
+                pooled = torch.nn.functional.normalize(pooled.float(), p=2, dim=1)
+        return pooled.float().cpu().numpy()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """编码为 (条数, 维度) 的 float32 数组，顺序与输入一致"""
+        if not texts:
+            return np.empty((0, self.model.config.hidden_size), dtype=np.float32)
+        # 一次性分词（fast 分词器内部并行），先不 padding
+        encoded = self.tokenizer(list(texts), truncation=True, max_length=self.max_length, padding=False)
+        features = [{"input_ids": ids, "attention_mask": mask}
+                    for ids, mask in zip(encoded["input_ids"], encoded["attention_mask"])]
+        lengths = np.array([len(f["input_ids"]) for f in features])
+        order = np.argsort(-lengths, kind="stable")
+        out = np.empty((len(texts), self.model.config.hidden_size), dtype=np.float32)
+        start = 0
+        while start < len(order):
+            size = max(1, min(self.batch_size, self.max_batch_tokens // max(1, lengths[order[start]])))
+            index = order[start: start + size]
+            out[index] = self._encode_batch([features[i] for i in index])
+            start += size
+        return out
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.encode(texts).tolist()
+
+    def _instruct(self, text: str) -> str:
+        return f"Instruct: {self.task_instruction}\nQuery: {text}" if self.task_instruction else text
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.encode([self._instruct(text)])[0].tolist()
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """多条查询一次编码（分桶 padding 与文档相同）"""
+        return self.encode([self._instruct(text) for text in texts]).tolist()
+
+
+# --- 测试代码块：查询与相关/无关文档的相似度 ---
+if __name__ == '__main__':
+    import time
+
+    model = Qwen3Embedding()
+    docs = ["ARES 是一个自动化的 RAG 评估框架。", "今天天气真好", "LoRA 通过低秩矩阵微调大模型。"]
+    start = time.perf_counter()
+    doc_vectors = np.asarray(model.embed_documents(docs))
+    query_vector = np.asarray(model.embed_query("ARES系统的全称是什么？"))
+    print(f"向量维度: {doc_vectors.shape[1]}，耗时 {time.perf_counter() - start:.2f}s")
+    for doc, score in zip(docs, doc_vectors @ query_vector):
+        print(f"{score:.4f}  {doc}")
@@ -0,0 +1,206 @@
+# 文件名: sharded_index.py
+# 多文档语料的分片索引：一个文件夹/通配符下的PDF按来源分片，每个分片是一个独立的 Chroma 库，
+# 各分片并行构建（互不抢同一个 SQLite 写锁），检索时同时查询所有分片再按距离合并。
+# 目录结构:
+#   base_directory/
+#     shards.json            分片 -> 来源文件 的映射
+#     shard_xxxxxxxxxx/      每个分片一个 Chroma 库，内含 index_manifest.json
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from R6_System_Optimization.index_builder import (MANIFEST_VERSION, build_or_update_vector_db, index_config,
+                                                  load_vector_db, make_chunk_id, open_chroma, probe_dimension,
+                                                  save_manifest, source_key)
+from R6_System_Optimization.pdf_loader import expand_pdf_paths
+
+SHARDS_FILE = "shards.json"
+
+
+def shard_name(source: str) -> str:
+    """每个来源一个分片时的分片名：由来源路径哈希得到，增删其他文件不会影响它"""
+    return "shard_" + hashlib.sha1(source_key(source).encode("utf-8")).hexdigest()[:10]
+
+
+def plan_shards(pdf_paths: list[str], docs_per_shard: int = 1) -> dict:
+    """
+    把PDF分配到分片，返回 {分片名: [pdf路径, ...]}
+    docs_per_shard=1 时每个来源一个分片，分片名由来源路径哈希得到，增删其他文件不会影响它；
+    大于1时按排好序的路径每 N 个一组
+    """
+    pdf_paths = sorted(pdf_paths, key=source_key)
+    shards = {}
+    if docs_per_shard == 1:
+        for path in pdf_paths:
+            shards[shard_name(path)] = [path]
+    else:
+        for i in range(0, len(pdf_paths), docs_per_shard):
+            shards[f"shard_{i // docs_per_shard:04d}"] = pdf_paths[i: i + docs_per_shard]
+    return shards
+
+
+def build_sharded_index(paths, base_directory: str, embedding_model, splitter=None, docs_per_shard: int = 1,
+                        max_workers: int = 4, on_mismatch: str = "error") -> "ShardedVectorStore":
+    """
+    并行构建（或增量更新）分片索引
+    paths: 文件 / 文件夹 / 通配符 / 列表
+    base_directory (str): 分片索引的根目录
+    docs_per_shard (int): 每个分片包含多少个PDF
+    max_workers (int): 同时构建的分片数
+    """
+    pdf_paths = expand_pdf_paths(paths)
+    if not pdf_paths:
+        raise FileNotFoundError(f"在 {paths} 中没有找到PDF文件")
+    shards = plan_shards(pdf_paths, docs_per_shard)
+    os.makedirs(base_directory, exist_ok=True)
+
+    # 分片之间已经是并行的，每个分片解析PDF时分到的进程数相应减少，避免进程数乘法爆炸
+    parse_workers = max(1, (os.cpu_count() or 1) // max_workers)
+
+    def build(item):
+        name, shard_paths = item
+        return name, build_or_update_vector_db(
+            shard_paths,
+            os.path.join(base_directory, name),
+            embedding_model,
+            splitter=splitter,
+            on_mismatch=on_mismatch,
+            extra_metadata={"shard": name},
+            parse_workers=parse_workers,
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        stores = dict(executor.map(build, shards.items()))
+
+    shard_sources = {name: [source_key(p) for p in shard_paths] for name, shard_paths in shards.items()}
+    save_shards(base_directory, shard_sources)
+    print(f"分片索引构建完成：{len(pdf_paths)} 个PDF，{len(shards)} 个分片")
+    return ShardedVectorStore(stores, embedding_model, base_directory=base_directory, shard_sources=shard_sources)
+
+
+def save_shards(base_directory: str, shard_sources: dict):
+    with open(os.path.join(base_directory, SHARDS_FILE), "w", encoding="utf-8") as f:
+        json.dump(shard_sources, f, ensure_ascii=False, indent=2)
+
+
+def load_sharded_index(base_directory: str, embedding_model, splitter=None) -> "ShardedVectorStore":
+    """加载已经构建好的分片索引，每个分片都会校验构建配置"""
+    shards_path = os.path.join(base_directory, SHARDS_FILE)
+    if not os.path.exists(shards_path):
+        raise FileNotFoundError(f"'{base_directory}' 下没有 {SHARDS_FILE}，请先用 build_sharded_index 构建")
+    with open(shards_path, "r", encoding="utf-8") as f:
+        shards = json.load(f)
+    stores = {name: load_vector_db(os.path.join(base_directory, name), embedding_model, splitter)
+              for name in shards}
+    return ShardedVectorStore(stores, embedding_model, base_directory=base_directory, shard_sources=shards)
+
+
+class ShardedVectorStore(VectorStore):
+    """
+    对多个分片做合并检索：查询只向量化一次，所有分片并行检索，再按距离取全局 top-k
+    提供与 Chroma 相同的 similarity_search / similarity_search_by_vector / as_retriever 接口
+    base_directory (str): 分片索引的根目录，add_texts 需要为新来源创建分片时使用
+    shard_sources (dict): {分片名: [来源, ...]}，即 shards.json 的内容，add_texts 按它把文本路由到来源所在的分片
+    """
+    def __init__(self, stores: dict, embedding_model, max_workers: int = 8, base_directory: str = None,
+                 shard_sources: dict = None):
+        self.stores = stores
+        self.embedding_model = embedding_model
+        self.max_workers = max_workers
+        self.base_directory = base_directory
+        self.shard_sources = shard_sources if shard_sources is not None else {name: [] for name in stores}
+
+    @property
+    def embeddings(self):
+        return self.embedding_model
+
+    def similarity_search_by_vector_with_score(self, embedding: list[float], k: int = 4,
+                                               shards: list[str] = None) -> list[tuple[Document, float]]:
+        """返回 [(Document, 距离)]，距离越小越相似；shards 可以只查询部分分片"""
+        names = shards or list(self.stores)
+
+        def search(name):
+            return self.stores[name].similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(names))) as executor:
+            results = [pair for shard_results in executor.map(search, names) for pair in shard_results]
+        results.sort(key=lambda pair: pair[1])
+        return results[:k]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list[tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding_model.embed_query(query), k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4, **kwargs) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _shard_for(self, source: str) -> str:
+        """来源已经在某个分片里就写到那个分片，否则按来源新建一个分片（与 docs_per_shard=1 的命名相同）"""
+        key = source_key(source)
+        for name, sources in self.shard_sources.items():
+            if key in sources:
+                return name
+        name = shard_name(source)
+        if name not in self.stores:
+            if self.base_directory is None:
+                raise ValueError("没有 base_directory，无法为新来源创建分片")
+            directory = os.path.join(self.base_directory, name)
+            self.stores[name] = open_chroma(directory, self.embedding_model)
+            # 写一份没有 sources 的清单，load_sharded_index 能按当前配置校验并加载这个分片
+            config = index_config(self.embedding_model, dimension=probe_dimension(self.embedding_model))
+            save_manifest(directory, {"version": MANIFEST_VERSION, "config": config, "sources": {}})
+        self.shard_sources.setdefault(name, []).append(key)
+        if self.base_directory is not None:
+            save_shards(self.base_directory, self.shard_sources)
+        return name
+
+    def add_texts(self, texts, metadatas: list[dict] = None, ids: list[str] = None, **kwargs) -> list[str]:
+        """
+        按 metadata["source"] 把文本写到来源所在的分片，每条文本都要带 source
+        ids 不给时与建库相同，由 来源 + 页码 + 内容 生成稳定ID
+        """
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        if any("source" not in metadata for metadata in metadatas):
+            raise ValueError("分片索引按来源分片，每条文本的 metadata 都需要 'source'")
+        ids = list(ids) if ids else [make_chunk_id(source_key(m["source"]), m.get("page", 0), t)
+                                     for t, m in zip(texts, metadatas)]
+        groups = {}
+        for text, metadata, chunk_id in zip(texts, metadatas, ids):
+            name = self._shard_for(metadata["source"])
+            group = groups.setdefault(name, ([], [], []))
+            for values, value in zip(group, (text, {**metadata, "shard": name}, chunk_id)):
+                values.append(value)
+        for name, (shard_texts, shard_metadatas, shard_ids) in groups.items():
+            self.stores[name].add_texts(shard_texts, shard_metadatas, ids=shard_ids)
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, base_directory: str = None, **kwargs):
+        """在 base_directory 下按来源分片写入文本；已有的分片索引请用 load_sharded_index 打开后 add_texts"""
+        if base_directory is None:
+            raise ValueError("ShardedVectorStore 需要指定 base_directory")
+        os.makedirs(base_directory, exist_ok=True)
+        store = cls({}, embedding, base_directory=base_directory, shard_sources={}, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+
+# --- 测试代码块：把 R1 的论文文件夹按来源分片建库并检索 ---
+if __name__ == '__main__':
+    from local_model import get_embedding_model
+    from R6_System_Optimization.embedding_cache import CachedEmbeddings
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pdf_folder = os.path.join(root, "R1_Evaluation_Framework", "PDF")
+    embedding = CachedEmbeddings(get_embedding_model())
+    store = build_sharded_index(pdf_folder, os.path.join(root, "R1_Evaluation_Framework", "chroma_shards"), embedding)
+    for doc in store.similarity_search("ARES系统的全称是什么？", k=5):
+        print(f"[{doc.metadata.get('source_name')} p{doc.metadata.get('page')}] {doc.page_content[:80]!r}")
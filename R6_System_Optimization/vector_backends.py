@@ -0,0 +1,246 @@
+# 文件名: vector_backends.py
+# 可插拔的向量库后端。检索脚本只依赖 VectorIndex 这个小接口（按文本检索、按向量检索、批量检索、写入、删除），
+# 具体用哪个存储引擎由配置决定，切换/对比存储引擎时不必修改每个脚本:
+#   "chroma"  Chroma 持久化库（默认）
+#   "flat"    flat_index.FlatVectorStore，内存映射的精确检索
+#   "ann"     ann_index.AnnVectorStore，IVF-PQ 近似检索
+# 选择方式：参数 backend=...，或环境变量 VECTOR_BACKEND（可写在 .env 里）。
+# flat / ann 的数据放在 Chroma 目录旁边（chroma_db -> chroma_db_flat / chroma_db_ann）；
+# 第一次打开时如果只有 Chroma 库，会直接把它的向量导出过去，不需要重新调用 Embedding 模型；
+# 之后 Chroma 库再更新，打开时比较两份清单，只把变化的来源（新增 / 删除的 chunk）同步过去。
+# keyword_index=True 时同时打开与向量库对齐的分段 BM25 索引（实际 Chroma 目录旁边的 _bm25 目录），
+# 之后通过 VectorIndex.add / delete 写入的文本块两边同步。
+
+import os
+
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from R6_System_Optimization.embedding_cache import embed_queries
+from R6_System_Optimization.index_builder import (build_or_update_vector_db, check_config, find_index_directory,
+                                                  index_config, index_directory, load_manifest, load_stored_documents,
+                                                  load_vector_db, probe_dimension, save_manifest)
+
+BACKENDS = ("chroma", "flat", "ann")
+# R1 的评测索引，R1 / R2 的脚本共用；用绝对路径，从哪个目录启动脚本都能找到
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 "R1_Evaluation_Framework", "chroma_db")
+
+
+class VectorIndex:
+    """
+    检索代码依赖的最小接口，包装任意 LangChain VectorStore
+    store: 底层向量库，需要用到其他能力（例如 HyDE 里的 retriever.vectorstore）时也可以直接访问
+    keyword_index: 可选的关键词索引（例如 segment_bm25.SegmentedBM25），add / delete 时用同样的 id 同步写入
+    """
+    def __init__(self, store: VectorStore, backend: str, keyword_index=None):
+        self.store = store
+        self.backend = backend
+        self.keyword_index = keyword_index
+
+    @property
+    def embeddings(self):
+        return self.store.embeddings
+
+    def search(self, query: str, k: int = 4) -> list[Document]:
+        return self.store.similarity_search(query, k=k)
+
+    def search_by_vector(self, vector, k: int = 4) -> list[Document]:
+        return self.store.similarity_search_by_vector(vector, k=k)
+
+    def search_by_vectors(self, vectors, k: int = 4) -> list[list[Document]]:
+        """N 条查询向量各自的 top-k；flat / ann 一次矩阵乘法，Chroma 一次 query 调用"""
+        if hasattr(self.store, "similarity_search_by_vectors"):
+            return self.store.similarity_search_by_vectors(vectors, k=k)
+        if isinstance(self.store, Chroma):
+            result = self.store._collection.query(query_embeddings=[list(map(float, v)) for v in vectors],
+                                                  n_results=k, include=["documents", "metadatas"])
+            return [[Document(page_content=text, metadata=metadata or {}, id=doc_id)
+                     for doc_id, text, metadata in zip(ids, texts, metadatas)]
+                    for ids, texts, metadatas in zip(result["ids"], result["documents"], result["metadatas"])]
+        return [self.search_by_vector(vector, k) for vector in vectors]
+
+    def batch_search(self, queries: list[str], k: int = 4) -> list[list[Document]]:
+        """
+        N 条查询各自的 top-k：查询一次向量化（embed_queries），再一次批量检索
+        替代逐条 retriever.invoke(query)，N 次 向量化+检索 的往返变成一次
+        """
+        if not queries:
+            return []
+        return self.search_by_vectors(embed_queries(self.embeddings, list(queries)), k)
+
+    def add(self, texts: list[str], metadatas: list[dict] = None, ids: list[str] = None) -> list[str]:
+        """
+        直接写入，不经过清单：这些文本块不属于任何PDF来源，build_vector_index 不会清理它们，
+        flat / ann 副本按清单同步时也不会带上它们。需要受管理的数据请走 build_vector_index
+        """
+        ids = self.store.add_texts(texts, metadatas=metadatas, ids=ids)
+        if self.keyword_index is not None:
+            self.keyword_index.add(ids, texts)
+        return ids
+
+    def delete(self, ids: list[str]):
+        """与 add 相同，不更新清单；删除清单里记录的 chunk 后，下次 build_vector_index 只会在PDF变化时补回"""
+        self.store.delete(ids=ids)
+        if self.keyword_index is not None:
+            self.keyword_index.delete(ids)
+
+    def documents(self) -> list[Document]:
+        """库中全部文本块（BM25 等关键词检索用它建语料）"""
+        return load_stored_documents(self.store)
+
+    def as_retriever(self, **kwargs):
+        return self.store.as_retriever(**kwargs)
+
+
+def resolve_backend(backend: str = None) -> str:
+    backend = (backend or os.getenv("VECTOR_BACKEND") or "chroma").lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的向量库后端: {backend}，可选 {BACKENDS}")
+    return backend
+
+
+def backend_directory(directory: str, backend: str) -> str:
+    """chroma_db -> chroma_db / chroma_db_flat / chroma_db_ann"""
+    directory = os.path.normpath(directory)
+    return directory if backend == "chroma" else f"{directory}_{backend}"
+
+
+def _open_local_store(directory: str, embedding_model, backend: str, on_mismatch: str = "error", **options):
+    if backend == "ann":
+        from R6_System_Optimization.ann_index import AnnVectorStore
+        return AnnVectorStore(directory, embedding_model, on_mismatch=on_mismatch, **options)
+    from R6_System_Optimization.flat_index import FlatVectorStore
+    return FlatVectorStore(directory, embedding_model, on_mismatch=on_mismatch, **options)
+
+
+def _ensure_ann(store, max_unindexed: float = 0.1):
+    """没有 ANN 索引，或建索引后新增的行超过 max_unindexed 比例时重建"""
+    indexed = store.ivf.indexed_count if store.ivf is not None else 0
+    if len(store) and store.meta["count"] - indexed > max_unindexed * store.meta["count"]:
+        store.build_ann()
+
+
+# 清单里的标记：flat / ann 库的数据来自哪里。"chroma" 是 Chroma 库的副本，打开时跟随 Chroma 同步；
+# "pdf" 是 build_vector_index 直接按PDF更新过的库，以自己为准。没有标记的是早期导出的副本，按 "chroma" 处理
+SYNCED_FROM = "synced_from"
+
+
+def keyword_index_directory(directory: str) -> str:
+    """chroma_db_xxxxxxxx -> chroma_db_xxxxxxxx_bm25：跟随实际的索引目录，不同配置的索引各有自己的关键词索引"""
+    return f"{os.path.normpath(directory)}_bm25"
+
+
+def _attach_keyword_index(index: VectorIndex, directory: str, keyword_index) -> VectorIndex:
+    """
+    keyword_index: None / False 不使用；True 在 keyword_index_directory(directory) 打开 SegmentedBM25；
+                   也可以传入已经建好的关键词索引（需要 sync / add / delete）
+    打开后按 chunk id 与向量库对齐，只为新增的文本块分词
+    """
+    if keyword_index is None or keyword_index is False:
+        return index
+    if keyword_index is True:
+        from R2_Retrieval_Optimization.segment_bm25 import SegmentedBM25
+        keyword_index = SegmentedBM25(keyword_index_directory(directory))
+    stats = keyword_index.sync(index.documents())
+    print(f"关键词索引与向量库同步: 新增 {stats['added']}，删除 {stats['deleted']}")
+    index.keyword_index = keyword_index
+    return index
+
+
+def _sync_from_chroma(chroma_db, store, chroma_sources: dict, local_sources: dict) -> dict:
+    """
+    按清单里每个来源的 chunk_ids 把 Chroma 的变化应用到副本：删掉消失的 chunk，新增的连同向量复制过来，
+    附加 metadata 变了的来源整份重新复制（add_vectors 按 id 覆盖）；全程不调用 Embedding 模型
+    返回: {"added": 复制的数量, "deleted": 删除的数量}
+    """
+    to_copy, to_delete = [], []
+    for source in set(chroma_sources) | set(local_sources):
+        new, old = chroma_sources.get(source, {}), local_sources.get(source, {})
+        if new == old:
+            continue
+        new_ids, old_ids = new.get("chunk_ids", []), set(old.get("chunk_ids", []))
+        to_delete.extend(old_ids - set(new_ids))
+        if new.get("extra_metadata") != old.get("extra_metadata"):
+            to_copy.extend(new_ids)
+        else:
+            to_copy.extend(chunk_id for chunk_id in new_ids if chunk_id not in old_ids)
+    if to_delete:
+        store.delete(ids=to_delete)
+    for start in range(0, len(to_copy), 1000):
+        result = chroma_db._collection.get(ids=to_copy[start: start + 1000],
+                                           include=["embeddings", "documents", "metadatas"])
+        if len(result["ids"]):
+            store.add_vectors(result["embeddings"], result["documents"],
+                              [dict(m or {}) for m in result["metadatas"]], result["ids"])
+    return {"added": len(to_copy), "deleted": len(to_delete)}
+
+
+def open_vector_index(directory: str = DEFAULT_INDEX_DIR, embedding_model=None, backend: str = None,
+                      splitter=None, keyword_index=None, **options) -> VectorIndex:
+    """
+    只加载、不构建（对应 index_builder.load_vector_db），校验清单中的构建配置
+    directory (str): 基础目录，例如 R1 的 chroma_db；实际的 Chroma 库由 find_index_directory 按模型 / 切分参数选出，
+                     flat / ann 使用它旁边的目录
+    keyword_index: True 时打开与之对齐的 SegmentedBM25（见 _attach_keyword_index），也可以直接传入关键词索引
+    options: 传给 FlatVectorStore / AnnVectorStore，例如 dtype、nprobe、rerank
+    """
+    backend = resolve_backend(backend)
+    directory = find_index_directory(directory, embedding_model, splitter)
+    if backend == "chroma":
+        return _attach_keyword_index(VectorIndex(load_vector_db(directory, embedding_model, splitter), backend),
+                                     directory, keyword_index)
+
+    local_directory = backend_directory(directory, backend)
+    local_manifest = load_manifest(local_directory)
+    if not local_manifest:
+        # 还没有 flat / ann 库：从已经校验过的 Chroma 库导出向量，连同清单一起复制，之后可以继续增量更新
+        from R6_System_Optimization.flat_index import export_chroma_to_flat
+        chroma_db = load_vector_db(directory, embedding_model, splitter)
+        export_chroma_to_flat(chroma_db, local_directory, embedding_model,
+                              dtype=options.get("dtype", "float32"))
+        save_manifest(local_directory, {**load_manifest(directory), SYNCED_FROM: "chroma"})
+    store = _open_local_store(local_directory, embedding_model, backend, **options)
+    chroma_manifest = load_manifest(directory)
+    if (local_manifest and local_manifest.get(SYNCED_FROM, "chroma") == "chroma" and chroma_manifest
+            and chroma_manifest.get("sources") != local_manifest.get("sources")):
+        # 导出之后 Chroma 库又更新过：按两份清单的差异同步，副本不会停留在导出时的状态
+        stats = _sync_from_chroma(load_vector_db(directory, embedding_model, splitter), store,
+                                  chroma_manifest.get("sources", {}), local_manifest.get("sources", {}))
+        save_manifest(local_directory, {**chroma_manifest, SYNCED_FROM: "chroma"})
+        print(f"'{local_directory}' 已与 Chroma 库同步: 复制 {stats['added']}，删除 {stats['deleted']}")
+    # 与 load_vector_db 相同的清单校验：模型、维度（当前模型实际输出的维度）、给出时的切分参数
+    current = index_config(embedding_model, splitter, probe_dimension(embedding_model))
+    check_config(load_manifest(local_directory), current, "error", local_directory, store)
+    if backend == "ann":
+        _ensure_ann(store)
+    return _attach_keyword_index(VectorIndex(store, backend), directory, keyword_index)
+
+
+def build_vector_index(pdf_paths, directory: str, embedding_model, backend: str = None, splitter=None,
+                       on_mismatch: str = "error", keyword_index=None, **kwargs) -> VectorIndex:
+    """
+    增量构建（对应 index_builder.build_or_update_vector_db），三种后端共用同一套清单和 chunk ID
+    directory (str): 基础目录，实际目录由 index_directory 按模型 / 切分参数决定，不同配置的索引互不覆盖
+    keyword_index: 同 open_vector_index，建库之后与向量库对齐
+    kwargs: 传给 build_or_update_vector_db，例如 batch_size、extra_metadata
+    """
+    backend = resolve_backend(backend)
+    directory = index_directory(directory, embedding_model, splitter)
+    if backend == "chroma":
+        return _attach_keyword_index(
+            VectorIndex(build_or_update_vector_db(pdf_paths, directory, embedding_model, splitter=splitter,
+                                                  on_mismatch=on_mismatch, **kwargs), backend),
+            directory, keyword_index)
+    local_directory = backend_directory(directory, backend)
+    store = _open_local_store(local_directory, embedding_model, backend, on_mismatch=on_mismatch)
+    build_or_update_vector_db(pdf_paths, local_directory, embedding_model, splitter=splitter,
+                              on_mismatch=on_mismatch, vector_db=store, **kwargs)
+    manifest = load_manifest(local_directory)
+    if manifest and manifest.get(SYNCED_FROM) != "pdf":
+        # 直接按PDF更新过的库以自己为准，之后打开时不再用（可能更旧的）Chroma 库覆盖它
+        save_manifest(local_directory, {**manifest, SYNCED_FROM: "pdf"})
+    if backend == "ann":
+        _ensure_ann(store)
+    return _attach_keyword_index(VectorIndex(store, backend), directory, keyword_index)
@@ -1,53 +1,194 @@
 # 文件名: local_model_yovole.py
+# 所有脚本共用的模型入口。模型通过进程内的注册表懒加载：
+#   - 导入本模块时不导入 sentence_transformers / langchain_openai，只有真正用到时才导入
+#   - 同一个模型在一个进程里只构建一次，多个脚本/类拿到的是同一个实例
+#   - 每个模型的加载耗时都会记录下来，可以用 model_load_times() 查看
+# 注意：get_embedding_model / get_llm 第一次调用时要导入 langchain_openai（连带 openai SDK，实测约 2.3s），
+# 懒加载只是把这笔开销从 import 推迟到第一次使用，“一秒内就绪”对远程 API 模型并未达到。
 
 import os
-import httpx
+import threading
+import time
+from typing import TYPE_CHECKING
+
+import numpy as np
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
 # 确保.env文件被加载
 load_dotenv()
 
-# --- 3. 为 Hugging Face BGE 模型创建加载函数 ---
-from sentence_transformers import SentenceTransformer
+_models = {}          # key -> 模型实例
+_load_seconds = {}    # key -> 加载耗时(秒)
+_key_locks = {}       # key -> 构建锁，同一个模型并发请求时只构建一次
+_registry_lock = threading.Lock()
+
+
+def get_or_create_model(key: str, factory):
+    """
+    进程内共享的模型注册表：第一次请求 key 时调用 factory() 构建并缓存，之后直接返回同一个实例
+    factory 抛出异常时不缓存，下次请求会重试
+    """
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _registry_lock:
+        lock = _key_locks.setdefault(key, threading.Lock())
+    with lock:
+        if key not in _models:
+            start = time.perf_counter()
+            _models[key] = factory()
+            _load_seconds[key] = time.perf_counter() - start
+            print(f"模型 {key} 加载完成，耗时 {_load_seconds[key]:.2f}s")
+    return _models[key]
+
+
+def model_load_times() -> dict:
+    """已加载模型的加载耗时 {key: 秒}"""
+    return dict(_load_seconds)
+
 
+def clear_models():
+    """清空注册表（例如修改了 .env 之后需要重新构建客户端）"""
+    with _registry_lock:
+        _models.clear()
+        _load_seconds.clear()
 
-from sentence_transformers import SentenceTransformer
 
+# --- 3. 为 Hugging Face BGE 模型创建加载函数 ---
 class HuggingFaceBGEEmbedding:
-    """封装 BGE 模型以兼容 Chroma"""
-    def __init__(self, model_name="BAAI/bge-small-en"):
-        self.model = SentenceTransformer(model_name)
+    """
+    封装 BGE 模型以兼容 Chroma / LangChain
+    batch_size (int): 每批最多多少条文本
+    max_batch_tokens (int): 每批最多多少 token（按 批内最长文本 * 条数 计，即包含 padding），短文本一批可以放更多
+    normalize (bool): 是否做 L2 归一化（BGE 官方推荐归一化后用内积/余弦）；
+                      BGE 的 sentence-transformers 流水线末尾自带 Normalize 模块，默认配置的输出已经是单位向量
+    precision (str): encode() 的输出精度 "float32" / "float16" / "int8"，int8 要求 normalize=True；
+                     建库流水线（ingestion_pipeline.embed_batch）直接把 encode() 的数组写入向量库
+    """
+    def __init__(self, model_name="BAAI/bge-small-en", batch_size: int = 32, max_batch_tokens: int = 16384,
+                 normalize: bool = False, precision: str = "float32", device: str = None):
+        if precision not in ("float32", "float16", "int8"):
+            raise ValueError(f"未知的 precision: {precision}")
+        if precision == "int8" and not normalize:
+            raise ValueError("int8 输出按 [-1, 1] 量化，需要 normalize=True")
+        from sentence_transformers import SentenceTransformer  # 很重（会导入 torch），只在真正使用时导入
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device=device)
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.normalize = normalize
+        self.precision = precision
+
+    @property
+    def namespace(self) -> str:
+        """缓存/索引清单用的模型标识：归一化与否得到的向量不同，不能混用"""
+        return f"{self.model_name}{'+norm' if self.normalize else ''}"
+
+    def make_batches(self, texts: list[str]) -> list[np.ndarray]:
+        """
+        按长度排序后组批，返回每批文本在原列表中的下标
+        长度相近的文本放在一起，padding 最少；批大小同时受条数和 token 数限制
+        """
+        from R6_System_Optimization.embedding_batcher import estimate_tokens
+
+        max_len = self.model.max_seq_length or 512
+        lengths = np.fromiter((min(estimate_tokens(t), max_len) for t in texts), dtype=np.int64, count=len(texts))
+        order = np.argsort(-lengths, kind="stable")  # 从长到短：最长的一批最先算，内存峰值一开始就能暴露
+        batches, start = [], 0
+        while start < len(order):
+            longest = lengths[order[start]]  # 批内第一条最长，padding 到它的长度
+            size = max(1, min(self.batch_size, self.max_batch_tokens // max(1, longest)))
+            batches.append(order[start: start + size])
+            start += size
+        return batches
+
+    def encode(self, texts: list[str], precision: str = None) -> np.ndarray:
+        """
+        编码为 (条数, 维度) 的 NumPy 数组，顺序与输入一致
+        precision 为 float16 / int8 时返回紧凑格式，int8 的值为 round(v * 127)
+        """
+        precision = precision or self.precision
+        dim = self.model.get_sentence_embedding_dimension()
+        out = np.empty((len(texts), dim), dtype=np.float16 if precision == "float16" else np.float32)
+        for index in self.make_batches(texts):
+            out[index] = self.model.encode([texts[i] for i in index], batch_size=len(index),
+                                           normalize_embeddings=self.normalize, convert_to_numpy=True,
+                                           show_progress_bar=False)
+        if precision == "int8":
+            return np.clip(np.rint(out * 127), -127, 127).astype(np.int8)
+        return out
 
     def __call__(self, texts):
         """方便直接调用"""
-        return self.model.encode(texts, convert_to_tensor=False)
+        return self.encode(texts)
 
     def embed_documents(self, texts):
-        """Chroma 需要的方法"""
-        return self.model.encode(texts, convert_to_tensor=False)
+        """
+        Chroma 需要的方法，按 LangChain Embeddings 的约定返回 list[list[float]]
+        需要 NumPy 数组的地方（批量建库、相似度计算）直接调用 encode()，省去转换
+        """
+        if not texts:
+            return []
+        return self.encode(texts, precision="float32").tolist()
 
     def embed_query(self, text):
         """Chroma 需要的方法"""
         # 单条文本也返回向量
-        return self.model.encode([text], convert_to_tensor=False)[0]
+        return self.encode([text], precision="float32")[0].tolist()
+
+    def embed_queries(self, texts):
+        """BGE 的查询和文档编码方式相同，多条查询一次编码"""
+        return self.embed_documents(texts)
 
 
-def get_bge_embedding_model(model_name="BAAI/bge-small-en") -> HuggingFaceBGEEmbedding:
-    """返回 BGE 嵌入模型包装对象"""
-    return HuggingFaceBGEEmbedding(model_name)
+def get_bge_embedding_model(model_name="BAAI/bge-small-en", backend: str = "torch", quantize: bool = False,
+                            **kwargs) -> HuggingFaceBGEEmbedding:
+    """
+    返回 BGE 嵌入模型包装对象，同样的参数在进程内只加载一次
+    backend (str): "torch" 使用 sentence-transformers；"onnx" 使用 ONNX Runtime（第一次使用时自动导出）
+    quantize (bool): onnx 后端是否使用动态 int8 量化模型
+    kwargs: 传给 HuggingFaceBGEEmbedding / OnnxEmbedding，例如 batch_size、normalize
+    """
+    if backend not in ("torch", "onnx"):
+        raise ValueError(f"未知的 backend: {backend}")
+    key = f"bge:{model_name}:{backend}{':int8' if quantize else ''}" + "".join(
+        f",{k}={v}" for k, v in sorted(kwargs.items()))
+
+    def create():
+        if backend == "onnx":
+            from R6_System_Optimization.onnx_embedding import OnnxEmbedding, prepare_onnx_model
+            return OnnxEmbedding(prepare_onnx_model(model_name, quantize=quantize), quantized=quantize, **kwargs)
+        return HuggingFaceBGEEmbedding(model_name, **kwargs)
 
+    return get_or_create_model(key, create)
 
 
-def get_bge_embedding_model(model_name="BAAI/bge-large-en") -> HuggingFaceBGEEmbedding:
+def get_qwen3_embedding_model(model_path: str = None, **kwargs):
     """
-    返回 BGE 嵌入模型包装对象
+    返回本地 Qwen3-Embedding 模型（R6_System_Optimization.qwen3_embedding.Qwen3Embedding），进程内只加载一次
+    可以替代远程的 Qwen3-Embedding-8B 做批量建库；model_path 默认取环境变量 QWEN3_EMBEDDING_PATH 或仓库上一级目录
+    kwargs: 例如 task_instruction、max_length、batch_size、pooling
     """
-    return HuggingFaceBGEEmbedding(model_name)
+    from R6_System_Optimization.qwen3_embedding import DEFAULT_MODEL_PATH, Qwen3Embedding
+
+    model_path = model_path or DEFAULT_MODEL_PATH
+    key = f"qwen3:{model_path}" + "".join(f",{k}={v}" for k, v in sorted(kwargs.items()))
+    return get_or_create_model(key, lambda: Qwen3Embedding(model_path, **kwargs))
 
 
 # --- 1. 为你的 Embedding 模型创建加载函数 ---
-def get_embedding_model() -> OpenAIEmbeddings:
+def get_embedding_model() -> "OpenAIEmbeddings":
+    """第一次调用时才导入 langchain_openai 并构建 OpenAIEmbeddings，之后返回同一个实例"""
+    return get_or_create_model("embedding:Qwen3-Embedding-8B", _create_embedding_model)
+
+
+def _create_embedding_model() -> "OpenAIEmbeddings":
+    from langchain_openai import OpenAIEmbeddings
+
     # 从.env文件中读取你的配置
     api_key = os.getenv("QWEN_EMBEDDING_API_KEY")
     model_name = "Qwen3-Embedding-8B"  # 这是你指定的模型名称
@@ -67,8 +208,34 @@ def get_embedding_model() -> OpenAIEmbeddings:
     return embedding_model
 
 
+def get_async_embedding_model():
+    """
+    同一个 Qwen3-Embedding-8B 接口的异步客户端（R6_System_Optimization.async_embedding.AsyncEmbeddingClient）
+    共享 HTTP 连接池，提供 aembed_documents / aembed_query，适合在 async 的 FastAPI 路由里使用
+    """
+    return get_or_create_model("async_embedding:Qwen3-Embedding-8B", _create_async_embedding_model)
+
+
+def _create_async_embedding_model():
+    from R6_System_Optimization.async_embedding import AsyncEmbeddingClient
+
+    api_key = os.getenv("QWEN_EMBEDDING_API_KEY")
+    if not api_key:
+        raise ValueError("请在.env文件中配置你的API密钥 (YOVOLE_API_KEY)")
+    # 与 get_embedding_model 的 OpenAIEmbeddings 是同一个接口、同一个模型，缓存和索引清单共用
+    return AsyncEmbeddingClient(model="Qwen3-Embedding-8B", api_key=api_key, base_url="https://ds-api.yovole.com/v1",
+                                namespace_class="OpenAIEmbeddings")
+
+
 # --- 2. 为你的 LLM 创建加载函数 ---
-def get_llm() -> ChatOpenAI:
+def get_llm() -> "ChatOpenAI":
+    """第一次调用时才导入 langchain_openai 并构建 ChatOpenAI，之后返回同一个实例"""
+    return get_or_create_model("llm:qwen3-coder-plus", _create_llm)
+
+
+def _create_llm() -> "ChatOpenAI":
+    from langchain_openai import ChatOpenAI
+
     # 从.env文件中读取你的配置
     api_key = os.getenv("QWEN_LLM_API_KEY")
     model_name = "qwen3-coder-plus"  # 这是你指定的模型名称